@@ -1,63 +1,278 @@
-from collections import Counter
-
-def compare_transcripts(chunk1, chunk2):
-    chunk1_cleaned = chunk1.strip().lower().split()
-    chunk2_cleaned = chunk2.strip().lower().split()
-
-    chunk1_counter = Counter(chunk1_cleaned)
-    chunk2_counter = Counter(chunk2_cleaned)
-
-    matching_words_count = sum((chunk1_counter & chunk2_counter).values())
-    total_words_chunk1 = len(chunk1_cleaned)
-    total_words_chunk2 = len(chunk2_cleaned)
-    if total_words_chunk1 == 0:
-        matching_percentage = 0
-    else:
-        matching_percentage = (matching_words_count / total_words_chunk1) * 100
-
-
-    non_matching_words_chunk1 = set(chunk1_cleaned) - set(chunk2_cleaned)
-    non_matching_words_chunk2 = set(chunk2_cleaned) - set(chunk1_cleaned)
-
-
-    result = {
-        "matching_count": matching_words_count,
-        "matching_percentage": matching_percentage,
-        "non_matching_words_chunk1": non_matching_words_chunk1,
-        "non_matching_words_chunk2": non_matching_words_chunk2
-    }
-    
-    return result
-
-chunk1 = """
-    Fellow-Citizens of the Senate and of the House of Representatives: 
-    Among the vicissitudes incident to life no event could have filled me with greater anxieties than that of which the notification was transmitted
-     by your order, and received on the 14th day of the present month. On the one hand, I was summoned by my Country, 
-    whose voice I can never hear but with veneration and love, from a retreat which I had chosen with the fondest predilection, and, in my flattering hopes, with an immutable decision, as the asylum of my declining years--a retreat which was rendered every day more necessary as well as more dear to me by the addition of habit to inclination, and of frequent interruptions in my health to the gradual waste committed on it by time. On the other hand, the magnitude and difficulty of the trust to which the voice of my country called me, being sufficient to awaken in the wisest and most experienced of her citizens a distrustful scrutiny into his qualifications, could not but overwhelm with despondence one who (inheriting inferior endowments from nature and unpracticed in the duties of civil administration) ought to be peculiarly conscious of his own deficiencies. In this conflict of emotions all I dare aver is that it has been my faithful study to collect my duty from a just appreciation of every circumstance by which it might be affected. All I dare hope is that if, in executing this task, I have been too much swayed by a grateful remembrance of former instances, or by an affectionate sensibility to this transcendent proof of the confidence of my fellow-citizens, and have thence too little consulted my incapacity as well as disinclination for the weighty and untried cares before me, my error will be palliated by the motives which mislead me, and its consequences be judged by my country with some share of the partiality in which they originated.
-"""
-
-chunk2 = """
-Fellow-Citizens of the Senate and of the House of Representatives:
-Among  the  vicissitudes  incident  to  life  no  event  could  have  filled  me  with  greater  anxieties  than
-that of which the notification was transmitted by your order, and received on the 14th day of the present month. On the one hand, I was summoned by my Country, whose voice I can never hear
-but with veneration and love, from a retreat which I had chosen with the fondest predilection, and,
-in my flattering hopes, with an immutable decision, as the asylum of my declining years--a retreat which  was  rendered  every  day  more  necessary  as  well  as  more  dear  to  me  by  the  addition  of
-habit to inclination, and of frequent interruptions in my health to the gradual waste committed on it
-by time. On the other hand, the magnitude and difficulty of the trust to which the voice of my coun-
-try called me, being sufficient to awaken in the wisest and most experienced of her citizens a dis-
-trustful scrutiny into his qualifications, could not but overwhelm with despondence one who (inher-
-iting inferior endowments from nature and unpracticed in the duties of civil administration) ought to
-be peculiarly conscious of his own deficiencies. In this conflict of emotions all I dare aver is that it
-has  been  my  faithful  study  to  collect  my  duty  from  a  just  appreciation  of  every  circumstance  by
-which it might be affected. All I dare hope is that if, in executing this task, I have been too much
-swayed  by  a  grateful  remembrance  of  former  instances,  or  by  an  affectionate  sensibility  to  this
-transcendent proof of the confidence of my fellow-citizens, and have thence too little consulted my
-incapacity  as  well  as  disinclination  for  the  weighty  and  untried  cares  before  me,  my  error  will  be
-palliated by the motives which mislead me, and its consequences be judged by my country with
-some share of the partiality in which they originated.
-"""
-result = compare_transcripts(chunk1, chunk2)
-print(f"Number of matching words: {result['matching_count']}")
-print(f"Percentage of matching words: {result['matching_percentage']:.2f}%")
-print(f"Words in chunk1 that do not match: {result['non_matching_words_chunk1']}")
-print(f"Words in chunk2 that do not match: {result['non_matching_words_chunk2']}")
+import os
+import re
+import json
+import sys
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+# Abbreviations and archaic forms common in 18th century deeds, mapped to modern words
+ARCHAIC_SPELLINGS = {
+    "ye": "the",
+    "yt": "that",
+    "ym": "them",
+    "yr": "your",
+    "sd": "said",
+    "wch": "which",
+    "wth": "with",
+    "&": "and",
+    "&c": "etc",
+    "decd": "deceased",
+    "recd": "received",
+    "regr": "register",
+    "viz": "namely",
+    "shew": "show",
+    "shewn": "shown",
+    "publick": "public",
+    "musick": "music",
+    "lawfull": "lawful",
+    "gaol": "jail",
+}
+
+
+def compare_transcripts(chunk1, chunk2):
+    chunk1_cleaned = chunk1.strip().lower().split()
+    chunk2_cleaned = chunk2.strip().lower().split()
+
+    chunk1_counter = Counter(chunk1_cleaned)
+    chunk2_counter = Counter(chunk2_cleaned)
+
+    matching_words_count = sum((chunk1_counter & chunk2_counter).values())
+    total_words_chunk1 = len(chunk1_cleaned)
+    total_words_chunk2 = len(chunk2_cleaned)
+    if total_words_chunk1 == 0:
+        matching_percentage = 0
+    else:
+        matching_percentage = (matching_words_count / total_words_chunk1) * 100
+
+
+    non_matching_words_chunk1 = set(chunk1_cleaned) - set(chunk2_cleaned)
+    non_matching_words_chunk2 = set(chunk2_cleaned) - set(chunk1_cleaned)
+
+
+    result = {
+        "matching_count": matching_words_count,
+        "matching_percentage": matching_percentage,
+        "non_matching_words_chunk1": non_matching_words_chunk1,
+        "non_matching_words_chunk2": non_matching_words_chunk2
+    }
+    
+    return result
+
+def normalise(text: str, dehyphenate: bool = True, long_s: bool = True,
+              archaic: Optional[Dict[str, str]] = ARCHAIC_SPELLINGS,
+              lowercase: bool = True, strip_punctuation: bool = True) -> str:
+    """
+    Normalise a transcription before scoring so that differences in layout and
+    orthography do not count as errors.
+    Args:
+        dehyphenate: Join words hyphenated across a line break ("coun-\\ntry").
+        long_s: Map the long s (ſ) to s.
+        archaic: Word-level replacements applied after lowercasing, None to skip.
+        lowercase: Case-fold the text.
+        strip_punctuation: Drop punctuation other than "&" and intra-word apostrophes.
+    """
+    if dehyphenate:
+        text = re.sub(r"(\w)[-\u00ac]\s*\n\s*(\w)", r"\1\2", text)
+    if long_s:
+        text = text.replace("\u017f", "s")
+    if lowercase:
+        text = text.lower()
+    if strip_punctuation:
+        text = re.sub(r"[^\w\s&']", " ", text)
+        text = re.sub(r"(?<!\w)'|'(?!\w)", " ", text)
+    words = text.split()
+    if archaic:
+        words = [archaic.get(word, word) for word in words]
+    return " ".join(words)
+
+
+def levenshtein(a: Sequence[Hashable], b: Sequence[Hashable]) -> int:
+    """
+    Edit distance between two sequences (characters or word tokens).
+    Uses the bit-parallel algorithm of Myers (1999) in Hyyro's formulation:
+    each column of the dynamic programming matrix is a pair of bit vectors, so
+    the cost is O(len(b)) big-integer operations over len(a) bits instead of
+    O(len(a) * len(b)) cell updates.
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    m = len(b)
+    if m == 0:
+        return len(a)
+    # Pattern bit masks: bit i of peq[x] is set where b[i] == x
+    peq = {}
+    for i, item in enumerate(b):
+        peq[item] = peq.get(item, 0) | (1 << i)
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    pv, mv, score = full, 0, m
+    for item in a:
+        eq = peq.get(item, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+    return score
+
+
+def error_rates(reference: str, hypothesis: str, **normalise_kwargs) -> Dict[str, Any]:
+    # Character and word error rates of a hypothesis against the reference transcription
+    reference = normalise(reference, **normalise_kwargs)
+    hypothesis = normalise(hypothesis, **normalise_kwargs)
+    reference_words = reference.split()
+    hypothesis_words = hypothesis.split()
+    # Map words to integer tokens so the word-level distance runs on the same engine
+    vocabulary = {}
+    reference_tokens = [vocabulary.setdefault(w, len(vocabulary)) for w in reference_words]
+    hypothesis_tokens = [vocabulary.setdefault(w, len(vocabulary)) for w in hypothesis_words]
+
+    char_distance = levenshtein(reference, hypothesis)
+    word_distance = levenshtein(reference_tokens, hypothesis_tokens)
+    return {
+        "char_distance": char_distance,
+        "reference_chars": len(reference),
+        "cer": char_distance / len(reference) if reference else float(bool(hypothesis)),
+        "word_distance": word_distance,
+        "reference_words": len(reference_words),
+        "wer": word_distance / len(reference_words) if reference_words else float(bool(hypothesis_words)),
+    }
+
+
+def read_transcript(path: str) -> str:
+    # Model outputs are per-page JSON files; ground truth is plain text
+    with open(path, "r", encoding="utf-8") as transcript_file:
+        if path.endswith(".json"):
+            return json.load(transcript_file).get("document_text", "")
+        return transcript_file.read()
+
+
+def _score_pair(args) -> Dict[str, Any]:
+    page_id, reference_path, hypothesis_path, normalise_kwargs = args
+    result = error_rates(read_transcript(reference_path), read_transcript(hypothesis_path), **normalise_kwargs)
+    result["page_id"] = page_id
+    return result
+
+
+def pair_transcripts(reference_dir: str, hypothesis_dir: str) -> List[tuple]:
+    # Match <page_id>.txt ground truth with <page_id>.txt or <page_id>.json predictions
+    hypotheses = {}
+    for name in os.listdir(hypothesis_dir):
+        stem, ext = os.path.splitext(name)
+        if ext in (".txt", ".json"):
+            hypotheses.setdefault(stem, os.path.join(hypothesis_dir, name))
+    pairs = []
+    for name in sorted(os.listdir(reference_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext == ".txt" and stem in hypotheses:
+            pairs.append((stem, os.path.join(reference_dir, name), hypotheses[stem]))
+    return pairs
+
+
+def compare_directory(reference_dir: str, hypothesis_dir: str, max_workers: Optional[int] = None,
+                      **normalise_kwargs) -> Dict[str, Any]:
+    """
+    Score every ground-truth/prediction pair across a process pool.
+    Returns:
+        {"pages": per-page results, "aggregate": totals with corpus-level
+        (length-weighted) and mean per-page CER/WER}
+    """
+    pairs = pair_transcripts(reference_dir, hypothesis_dir)
+    tasks = [(page_id, ref, hyp, normalise_kwargs) for page_id, ref, hyp in pairs]
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        pages = list(pool.map(_score_pair, tasks, chunksize=4))
+
+    char_distance = sum(p["char_distance"] for p in pages)
+    reference_chars = sum(p["reference_chars"] for p in pages)
+    word_distance = sum(p["word_distance"] for p in pages)
+    reference_words = sum(p["reference_words"] for p in pages)
+    aggregate = {
+        "pages": len(pages),
+        "char_distance": char_distance,
+        "reference_chars": reference_chars,
+        "word_distance": word_distance,
+        "reference_words": reference_words,
+        "cer": char_distance / reference_chars if reference_chars else 0.0,
+        "wer": word_distance / reference_words if reference_words else 0.0,
+        "mean_page_cer": sum(p["cer"] for p in pages) / len(pages) if pages else 0.0,
+        "mean_page_wer": sum(p["wer"] for p in pages) / len(pages) if pages else 0.0,
+    }
+    return {"pages": pages, "aggregate": aggregate}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Character and word error rates of transcriptions against ground truth.")
+    parser.add_argument("reference_dir", help="Directory of <page_id>.txt ground-truth transcriptions")
+    parser.add_argument("hypothesis_dir", help="Directory of <page_id>.txt or <page_id>.json model outputs")
+    parser.add_argument("--output", default=None, help="Write the full JSON report here")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--keep-hyphenation", action="store_true")
+    parser.add_argument("--keep-archaic", action="store_true")
+    parser.add_argument("--case-sensitive", action="store_true")
+    args = parser.parse_args()
+
+    report = compare_directory(
+        args.reference_dir, args.hypothesis_dir, max_workers=args.workers,
+        dehyphenate=not args.keep_hyphenation,
+        archaic=None if args.keep_archaic else ARCHAIC_SPELLINGS,
+        lowercase=not args.case_sensitive,
+    )
+    for page in report["pages"]:
+        print(f"{page['page_id']}: CER {page['cer']:.2%}, WER {page['wer']:.2%}")
+    aggregate = report["aggregate"]
+    print(f"{aggregate['pages']} pages: CER {aggregate['cer']:.2%}, WER {aggregate['wer']:.2%}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, indent=4)
+
+
+# Washington's First Inaugural Address (1789): known text vs. the Claude transcription
+chunk1 = """
+    Fellow-Citizens of the Senate and of the House of Representatives: 
+    Among the vicissitudes incident to life no event could have filled me with greater anxieties than that of which the notification was transmitted
+     by your order, and received on the 14th day of the present month. On the one hand, I was summoned by my Country, 
+    whose voice I can never hear but with veneration and love, from a retreat which I had chosen with the fondest predilection, and, in my flattering hopes, with an immutable decision, as the asylum of my declining years--a retreat which was rendered every day more necessary as well as more dear to me by the addition of habit to inclination, and of frequent interruptions in my health to the gradual waste committed on it by time. On the other hand, the magnitude and difficulty of the trust to which the voice of my country called me, being sufficient to awaken in the wisest and most experienced of her citizens a distrustful scrutiny into his qualifications, could not but overwhelm with despondence one who (inheriting inferior endowments from nature and unpracticed in the duties of civil administration) ought to be peculiarly conscious of his own deficiencies. In this conflict of emotions all I dare aver is that it has been my faithful study to collect my duty from a just appreciation of every circumstance by which it might be affected. All I dare hope is that if, in executing this task, I have been too much swayed by a grateful remembrance of former instances, or by an affectionate sensibility to this transcendent proof of the confidence of my fellow-citizens, and have thence too little consulted my incapacity as well as disinclination for the weighty and untried cares before me, my error will be palliated by the motives which mislead me, and its consequences be judged by my country with some share of the partiality in which they originated.
+"""
+
+chunk2 = """
+Fellow-Citizens of the Senate and of the House of Representatives:
+Among  the  vicissitudes  incident  to  life  no  event  could  have  filled  me  with  greater  anxieties  than
+that of which the notification was transmitted by your order, and received on the 14th day of the present month. On the one hand, I was summoned by my Country, whose voice I can never hear
+but with veneration and love, from a retreat which I had chosen with the fondest predilection, and,
+in my flattering hopes, with an immutable decision, as the asylum of my declining years--a retreat which  was  rendered  every  day  more  necessary  as  well  as  more  dear  to  me  by  the  addition  of
+habit to inclination, and of frequent interruptions in my health to the gradual waste committed on it
+by time. On the other hand, the magnitude and difficulty of the trust to which the voice of my coun-
+try called me, being sufficient to awaken in the wisest and most experienced of her citizens a dis-
+trustful scrutiny into his qualifications, could not but overwhelm with despondence one who (inher-
+iting inferior endowments from nature and unpracticed in the duties of civil administration) ought to
+be peculiarly conscious of his own deficiencies. In this conflict of emotions all I dare aver is that it
+has  been  my  faithful  study  to  collect  my  duty  from  a  just  appreciation  of  every  circumstance  by
+which it might be affected. All I dare hope is that if, in executing this task, I have been too much
+swayed  by  a  grateful  remembrance  of  former  instances,  or  by  an  affectionate  sensibility  to  this
+transcendent proof of the confidence of my fellow-citizens, and have thence too little consulted my
+incapacity  as  well  as  disinclination  for  the  weighty  and  untried  cares  before  me,  my  error  will  be
+palliated by the motives which mislead me, and its consequences be judged by my country with
+some share of the partiality in which they originated.
+"""
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main()
+    else:
+        result = compare_transcripts(chunk1, chunk2)
+        print(f"Number of matching words: {result['matching_count']}")
+        print(f"Percentage of matching words: {result['matching_percentage']:.2f}%")
+        print(f"Words in chunk1 that do not match: {result['non_matching_words_chunk1']}")
+        print(f"Words in chunk2 that do not match: {result['non_matching_words_chunk2']}")
+        rates = error_rates(chunk1, chunk2)
+        print(f"Character error rate: {rates['cer']:.2%}, word error rate: {rates['wer']:.2%}")
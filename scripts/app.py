@@ -1,18 +1,51 @@
 import os
+import sys
 import streamlit as st
 from datetime import datetime
 from elasticsearch import Elasticsearch
 
+# Allow `streamlit run app.py` from inside scripts/ as well as from the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from scripts.search import PAGE_SIZE, ElasticsearchBackend, build_query
+from scripts.thumbnails import DEFAULT_CACHE_DIR, find_source, get_derivative
+
+# "elasticsearch" (Elastic Cloud) or "sqlite" (embedded index built by scripts/sqlite_index.py, works offline)
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "elasticsearch")
+SQLITE_INDEX = os.getenv("SQLITE_INDEX", "land_deeds.sqlite")
 # Connect to Elasticsearch
 ELASTIC_API_KEY = os.getenv("ELASTIC_API_KEY")
 CLOUD_ID = os.getenv("CLOUD_ID")
-
-# Connect to Elasticsearch
-client = Elasticsearch(
-    CLOUD_ID,
-    api_key=ELASTIC_API_KEY
-)
 INDEX_NAME = "land_deeds"
+# Original scans and their cached WebP derivatives
+IMAGE_DIR = os.getenv("IMAGE_DIR", "1")
+THUMBNAIL_DIR = os.getenv("THUMBNAIL_DIR", DEFAULT_CACHE_DIR)
+# Person and transfer index built by scripts/entities.py; the chain-of-title section is hidden without it
+ENTITY_INDEX = os.getenv("ENTITY_INDEX", "entities.npz")
+
+
+# Open the search backend once per server process rather than on every rerun
+@st.cache_resource
+def get_backend():
+    if SEARCH_BACKEND == "sqlite":
+        from scripts.sqlite_index import SQLiteBackend
+        return SQLiteBackend(SQLITE_INDEX)
+    client = Elasticsearch(
+        CLOUD_ID,
+        api_key=ELASTIC_API_KEY
+    )
+    return ElasticsearchBackend(client, INDEX_NAME)
+
+
+@st.cache_resource
+def get_entities():
+    if not os.path.exists(ENTITY_INDEX):
+        return None
+    from scripts.entities import EntityIndex
+    return EntityIndex.load(ENTITY_INDEX)
+
+
+backend = get_backend()
+entities = get_entities()
 
 # Streamlit UI
 st.title("📖 Historical Document Search")
@@ -30,66 +63,126 @@ end_date = st.sidebar.date_input("End Date", value=None)
 
 search_type = st.sidebar.radio("Search Type:", ["Match", "Fuzzy Match"])
 
-# Build Elasticsearch query
-def build_query(query, search_field, start_date, end_date, search_type):
-    search_fields_mapping = {
-        "Full Text": "document_text",
-        "Grantors": "grantors",
-        "Grantees": "grantees",
-        "Document Type": "document_type",
-        "City": "city",
-        "County": "county",
-        "Execution Date": "execution_date",
-        "Recording Date": "recording_date"
-    }
-    
-    if search_type == "Match":
-        search_filter = {"query": {"match": {search_fields_mapping[search_field]: query}}} if query else {"query": {"match_all": {}}}
-    else:  # Fuzzy Match
-        search_filter = {"query": {"fuzzy": {search_fields_mapping[search_field]: {"value": query, "fuzziness": "AUTO"}}}} if query else {"query": {"match_all": {}}}
-    
-    # Date filtering (set range between 1720-1780)
-    date_filter = {"range": {search_fields_mapping[search_field]: {
-        "gte": "1720-01-01",
-        "lte": "1780-12-31"
-    }}}
-    
-    if start_date or end_date:
-        if start_date:
-            date_filter["range"][search_fields_mapping[search_field]]["gte"] = start_date.strftime("%Y-%m-%d")
-        if end_date:
-            date_filter["range"][search_fields_mapping[search_field]]["lte"] = end_date.strftime("%Y-%m-%d")
-        search_filter["query"] = {"bool": {"must": [search_filter["query"], date_filter]}}
-    
-    return search_filter
+
+def start_search():
+    # cursors[i] is the search_after value that opens page i
+    st.session_state.query_body = build_query(query, search_field, start_date, end_date, search_type)
+    st.session_state.cursors = [None]
+    st.session_state.page = 0
+    st.session_state.open_texts = set()
+    st.session_state.open_previews = set()
+    st.session_state.open_images = set()
+
+
+def next_page(cursor):
+    if len(st.session_state.cursors) == st.session_state.page + 1:
+        st.session_state.cursors.append(cursor)
+    st.session_state.page += 1
+
+
+def previous_page():
+    st.session_state.page -= 1
+
+
+def open_text(doc_id):
+    st.session_state.open_texts.add(doc_id)
+
+
+def open_preview(doc_id):
+    st.session_state.open_previews.add(doc_id)
+
+
+def open_image(doc_id):
+    st.session_state.open_images.add(doc_id)
+
+
+@st.cache_data(show_spinner=False)
+def load_document_text(doc_id):
+    return backend.fetch_document_text(doc_id)
+
+
+@st.cache_data(show_spinner=False, max_entries=500)
+def load_derivative(doc_id, size_name):
+    return get_derivative(IMAGE_DIR, doc_id, size_name, THUMBNAIL_DIR)
+
 
 # Perform search
-if st.button("Search"):
-    query_body = build_query(query, search_field, start_date, end_date, search_type)
-    # response = client.search(index=INDEX_NAME, body=query_body)
-    response = client.search(index=INDEX_NAME, body=query_body, size=10000)
-    
+st.button("Search", on_click=start_search)
+
+if "query_body" in st.session_state:
+    page = st.session_state.page
+    results = backend.search_page(st.session_state.query_body, search_after=st.session_state.cursors[page])
+
     # Display results
-    if response["hits"]["hits"]:
-        st.write(f"### {len(response['hits']['hits'])} Results Found:")
-        # show_all = st.checkbox("Show All Results")
-        # results_to_show = response["hits"]["hits"] if show_all else response["hits"]["hits"][:20]
-        for hit in response["hits"]["hits"]:
-            doc_id = hit['_source']['document_id']
-            with st.expander(f"📜 Document ID: {doc_id}"):
-                st.image(f"1/{doc_id}.TIF", caption=f"Document Image {doc_id}")
-                st.write(f"**📜 Document Type:** {hit['_source'].get('document_type', 'N/A')}")
-                st.write(f"**🖊 Grantors:** {hit['_source'].get('grantors', 'N/A')}")
-                st.write(f"**🖊 Grantees:** {hit['_source'].get('grantees', 'N/A')}")
-                st.write(f"**🖊 Legal Authorities:** {hit['_source'].get('legal_authorities', 'N/A')}")
-                st.write(f"**📍  Acreage:** {hit['_source'].get('acreage', 'N/A')}")
-                st.write(f"**📍  Lot Information:** {hit['_source'].get('lot_info', 'N/A')}")
-                st.write(f"**📍  City:** {hit['_source'].get('city', 'N/A')}")
-                st.write(f"**📍  County:** {hit['_source'].get('county', 'N/A')}")
-                st.write(f"**📅 Execution Date:** {hit['_source'].get('execution_date', 'N/A')}")
-                st.write(f"**📅 Recording Date:** {hit['_source'].get('recording_date', 'N/A')}")
-                # st.write(f"**📖 Document Text:** {hit['_source']['document_text'][:500]}...")  # Truncate long text
-                st.write(f"**📖 Document Text:** {hit['_source']['document_text']}")
+    if results["hits"]:
+        first = page * PAGE_SIZE + 1
+        st.write(f"### {results['total']} Results Found (showing {first}-{first + len(results['hits']) - 1}):")
+        for hit in results["hits"]:
+            source = hit["_source"]
+            doc_id = source["document_id"]
+            # A thumbnail beside each result so pages can be told apart without opening them
+            thumb_col, detail_col = st.columns([1, 6])
+            thumb = load_derivative(doc_id, "thumb")
+            if thumb is not None:
+                thumb_col.image(thumb)
+            with detail_col.expander(f"📜 Document ID: {doc_id}"):
+                # An expander's body runs even while it is collapsed, so the preview and the
+                # full-resolution scan are only loaded when asked for
+                if doc_id in st.session_state.open_images:
+                    scan_path = find_source(IMAGE_DIR, doc_id)
+                    if scan_path is not None:
+                        st.image(scan_path, caption=f"Full resolution {doc_id}")
+                elif doc_id in st.session_state.open_previews:
+                    preview = load_derivative(doc_id, "preview")
+                    if preview is not None:
+                        st.image(preview, caption=f"Document Image {doc_id}")
+                        st.button("🔍 Full resolution", key=f"image-{doc_id}", on_click=open_image, args=(doc_id,))
+                elif thumb is not None:
+                    st.button("🖼 Show image", key=f"preview-{doc_id}", on_click=open_preview, args=(doc_id,))
+                st.write(f"**📜 Document Type:** {source.get('document_type', 'N/A')}")
+                st.write(f"**🖊 Grantors:** {source.get('grantors', 'N/A')}")
+                st.write(f"**🖊 Grantees:** {source.get('grantees', 'N/A')}")
+                st.write(f"**🖊 Legal Authorities:** {source.get('legal_authorities', 'N/A')}")
+                st.write(f"**📍  Acreage:** {source.get('acreage', 'N/A')}")
+                st.write(f"**📍  Lot Information:** {source.get('lot_info', 'N/A')}")
+                st.write(f"**📍  City:** {source.get('city', 'N/A')}")
+                st.write(f"**📍  County:** {source.get('county', 'N/A')}")
+                st.write(f"**📅 Execution Date:** {source.get('execution_date', 'N/A')}")
+                st.write(f"**📅 Recording Date:** {source.get('recording_date', 'N/A')}")
+                for fragment in hit.get("highlight", {}).get("document_text", []):
+                    st.write(f"… {fragment} …")
+                if doc_id in st.session_state.open_texts:
+                    st.write(f"**📖 Document Text:** {load_document_text(doc_id)}")
+                else:
+                    st.button("📖 Show full text", key=f"text-{doc_id}", on_click=open_text, args=(doc_id,))
                 st.write("---")
+
+        previous_col, next_col = st.columns(2)
+        previous_col.button("◀ Previous", on_click=previous_page, disabled=page == 0)
+        next_col.button("Next ▶", on_click=next_page, args=(results["next"],), disabled=results["next"] is None)
     else:
-        st.write("No results found.")
\ No newline at end of file
+        st.write("No results found.")
+
+# Parties resolved across documents, and the transfers that follow from them
+if entities is not None:
+    st.write("---")
+    st.write("### 👥 Chain of Title")
+    party = st.text_input("Grantor or grantee:")
+    if party:
+        matches = entities.lookup(party)
+        if matches:
+            person = st.selectbox("Person:", matches,
+                                  format_func=lambda m: f"{m['name']} ({m['documents']} documents)")
+            st.write(f"**Recorded as:** {', '.join(entities.variants(person['person_id']))}")
+            st.write("**Documents:**")
+            st.dataframe(entities.transfers(person["person_id"]), use_container_width=True)
+            direction = st.radio("Follow the title:", ["Forward to later owners", "Back to earlier owners"],
+                                 horizontal=True)
+            chain = entities.chain_of_title(person["person_id"], forward=direction.startswith("Forward"))
+            if chain:
+                st.dataframe(chain, use_container_width=True,
+                             column_order=["depth", "date", "grantor", "grantee", "place", "document_id"])
+            else:
+                st.write("No recorded transfers in that direction.")
+        else:
+            st.write("No matching party.")
@@ -0,0 +1,334 @@
+import os
+import time
+import random
+import argparse
+import threading
+import anthropic
+from pathlib import Path
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from scripts.cache import ResponseCache
+from scripts.parsing import ParseStats
+from scripts.extract import PropertyDocumentAnalyzer, get_file_id, is_already_processed, process_img
+from scripts.ledger import DEFAULT_LEASE_SECONDS, JobLedger, array_task
+from scripts.preprocess import DEFAULT_MAX_BYTES, DEFAULT_MAX_EDGE, iter_encoded_pages
+from scripts.telemetry import DEFAULT_METRICS_HOST, Telemetry
+
+# Status codes the API uses to ask us to slow down (rate limited / overloaded)
+THROTTLE_STATUS_CODES = (429, 529)
+IMAGE_SUFFIXES = (".tif", ".tiff")
+
+
+class AdaptiveLimiter:
+    """
+    Bounds the number of in-flight requests and adapts that bound to the API.
+
+    On a throttled response the limit is halved and every worker pauses for the
+    server's retry-after (or an exponentially growing delay); after a run of
+    successes the limit creeps back up by one, up to the configured maximum.
+    """
+
+    def __init__(self, max_in_flight: int, min_in_flight: int = 1,
+                 base_delay: float = 1.0, max_delay: float = 60.0):
+        self.max_in_flight = max_in_flight
+        self.min_in_flight = min_in_flight
+        self.limit = max_in_flight
+        self.in_flight = 0
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttled = 0
+        self._delay = base_delay
+        self._successes = 0
+        self._resume_at = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                pause = self._resume_at - time.monotonic()
+                if pause <= 0 and self.in_flight < self.limit:
+                    self.in_flight += 1
+                    return
+                self._cond.wait(timeout=pause if pause > 0 else None)
+
+    def release(self, throttled: bool = False, retry_after: Optional[float] = None):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                self._successes = 0
+                self.limit = max(self.min_in_flight, self.limit // 2)
+                delay = retry_after if retry_after else self._delay * random.uniform(0.5, 1.5)
+                self._delay = min(self.max_delay, self._delay * 2)
+                self._resume_at = max(self._resume_at, time.monotonic() + delay)
+            else:
+                self._delay = self.base_delay
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.max_in_flight:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+
+def is_throttled(error: Exception) -> bool:
+    # Works for anthropic.APIStatusError as well as stub exceptions carrying a status_code
+    return getattr(error, "status_code", None) in THROTTLE_STATUS_CODES
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_retries(limiter: AdaptiveLimiter, call: Callable[[], Any], max_retries: int,
+                      on_retry: Optional[Callable[[int], None]] = None) -> Any:
+    """
+    Run call() holding a limiter slot, retrying throttled (429/529) errors up to
+    max_retries times after the pause the limiter imposes.
+    Args:
+        on_retry: Called with the attempt number before each retry.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        try:
+            result = call()
+        except Exception as e:
+            if is_throttled(e) and attempt < max_retries:
+                limiter.release(throttled=True, retry_after=get_retry_after(e))
+                if on_retry is not None:
+                    on_retry(attempt + 1)
+                continue
+            limiter.release()
+            raise
+        limiter.release()
+        return result
+
+
+def list_images(input_dir) -> List[Path]:
+    return sorted(p for p in Path(input_dir).iterdir() if p.suffix.lower() in IMAGE_SUFFIXES)
+
+
+def process_directory(input_dir, output_dir, model: str, api_key: Optional[str] = None,
+                      max_in_flight: int = 8, max_retries: int = 5,
+                      client: Optional[Any] = None, report_every: int = 25,
+                      encode_workers: Optional[int] = None, max_edge: Optional[int] = DEFAULT_MAX_EDGE,
+                      max_bytes: Optional[int] = DEFAULT_MAX_BYTES, image_format: str = "PNG",
+                      cache_path: Optional[str] = None, crop: bool = False, bands: int = 1,
+                      run_dir: Optional[str] = None, metrics_port: Optional[int] = None,
+                      metrics_host: str = DEFAULT_METRICS_HOST,
+                      ledger: Optional[JobLedger] = None, resume: bool = False) -> Dict[str, Any]:
+    """
+    Process every TIF page in a directory with several requests in flight.
+    Pages are decoded, downscaled and encoded in a process pool and streamed
+    into the request threads as they become ready.
+    Args:
+        input_dir: Directory holding the page images.
+        output_dir: Directory the per-page JSON files are written to.
+        model: Model name passed to the API.
+        api_key: Anthropic API key, ignored when a client is supplied.
+        max_in_flight: Upper bound on concurrent requests.
+        max_retries: Throttled attempts allowed per page before giving up.
+        client: Optional client shared by all workers; any object exposing
+            messages.create (e.g. a stub for offline runs) works.
+        report_every: Print progress after this many completed pages.
+        encode_workers: Processes used for pre-processing, defaults to the CPU count.
+        max_edge, max_bytes, image_format, crop, bands: Passed to preprocess.encode_page.
+        cache_path: SQLite response cache; pages seen before with the same model
+            and prompt are answered from it without an API call.
+        run_dir: Directory for the telemetry span log (spans.jsonl) and summary.json.
+        metrics_port: Serve live metrics in the Prometheus text format on this port.
+        metrics_host: Interface of the metrics endpoint; loopback only by default.
+        ledger: Job ledger shared with the other tasks of an array job. Pages are
+            leased from it (this task's shard first, then expired leases of any
+            shard) instead of taken from the directory listing, and recorded as
+            done or failed.
+        resume: With a ledger, first make this shard's failed pages and expired leases pending again.
+    Returns:
+        A summary dictionary with page counts, failures, throughput and the
+        per-page encode time and payload size.
+    """
+    if bands > 1 and not crop:
+        raise ValueError("bands only applies to cropped pages; pass crop=True as well")
+    os.makedirs(output_dir, exist_ok=True)
+    if client is None:
+        # The limiter owns retries so that throttling is visible to every worker
+        client = anthropic.Anthropic(api_key=api_key, max_retries=0)
+    cache = ResponseCache(cache_path) if cache_path else None
+    telemetry = Telemetry(run_dir)
+    if metrics_port:
+        telemetry.serve(metrics_port, host=metrics_host)
+    parse_stats = ParseStats()
+    analyzer = PropertyDocumentAnalyzer(model, api_key, client=client, cache=cache, telemetry=telemetry,
+                                        parse_stats=parse_stats)
+    limiter = AdaptiveLimiter(max_in_flight)
+
+    pages = list_images(input_dir)
+    processed = {get_file_id(p) for p in pages if is_already_processed(get_file_id(p), output_dir)}
+    if ledger is not None:
+        ledger.register(pages, done=processed)
+        if resume:
+            print(f"Reset {ledger.resume()} failed or expired pages")
+        counts = ledger.counts(ledger.shard)
+        expected = counts["pending"]
+        # Leased lazily, so pages are only claimed as the encoder is ready for them
+        pending = (Path(file_path) for _, file_path in ledger.iter_leases(batch_size=max_in_flight))
+        ledger.start_heartbeat()
+        print(f"Found {len(pages)} pages; shard {ledger.shard + 1}/{ledger.num_shards}: {expected} pending, "
+              f"{counts['done']} done, {counts['failed']} failed")
+    else:
+        pending = [p for p in pages if get_file_id(p) not in processed]
+        expected = len(pending)
+        print(f"Found {len(pages)} pages, {len(pages) - len(pending)} already processed")
+
+    def run_page(page):
+        call_with_retries(limiter, lambda: process_img(page["file_path"], output_dir, model, api_key,
+                                                       analyzer=analyzer, encoded_page=page),
+                          max_retries,
+                          on_retry=lambda attempt: telemetry.event("retry", page=get_file_id(page["file_path"]),
+                                                                   attempt=attempt))
+
+    failed = {}
+    encode_stats = {}
+    lost_leases = []
+    done = 0
+    start = time.perf_counter()
+
+    def record(file_path, error=None):
+        nonlocal done
+        file_id = get_file_id(file_path)
+        if error is None:
+            done += 1
+            recorded = ledger is None or ledger.complete(file_id)
+        else:
+            failed[file_id] = error
+            recorded = ledger is None or ledger.fail(file_id, error)
+            telemetry.event("page_failed", page=file_id, error=error)
+            print(f"Error processing {Path(file_path).name}: {error}")
+        if not recorded:
+            # The lease expired while the page was in flight and another task took it over
+            lost_leases.append(file_id)
+            telemetry.event("lease_lost", page=file_id)
+            print(f"Lease on {file_id} was lost to another task; its outcome is left to that task")
+        finished = done + len(failed)
+        if report_every and finished % report_every == 0:
+            elapsed = time.perf_counter() - start
+            print(f"{finished}/{expected} pages, {done / elapsed * 60:.1f} pages/min, "
+                  f"{limiter.limit} in flight allowed")
+
+    def collect(futures, return_when):
+        finished, _ = wait(futures, return_when=return_when)
+        for future in finished:
+            file_path = futures.pop(future)
+            error = future.exception()
+            record(file_path, None if error is None else str(error))
+
+    encoded_pages = iter_encoded_pages(pending, max_workers=encode_workers, max_edge=max_edge,
+                                       max_bytes=max_bytes, image_format=image_format,
+                                       crop=crop, bands=bands)
+    futures = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for page in encoded_pages:
+                if "error" in page:
+                    record(page["file_path"], page["error"])
+                    continue
+                telemetry.record_span("encode", page["encode_seconds"], page=get_file_id(page["file_path"]),
+                                      payload_bytes=page["payload_bytes"], image_tokens=page["image_tokens"])
+                encode_stats[get_file_id(page["file_path"])] = {
+                    "encode_seconds": page["encode_seconds"],
+                    "payload_bytes": page["payload_bytes"],
+                    "image_tokens": page["image_tokens"],
+                }
+                # Backpressure: keep encoding at most one window ahead of the requests
+                while len(futures) >= max_in_flight * 2:
+                    collect(futures, FIRST_COMPLETED)
+                futures[executor.submit(run_page, page)] = page["file_path"]
+            if futures:
+                collect(futures, ALL_COMPLETED)
+    finally:
+        # Stop renewing even if the run dies, so the leases still held expire and other tasks take the pages
+        if ledger is not None:
+            ledger.stop_heartbeat()
+
+    elapsed = time.perf_counter() - start
+    summary = {
+        "pages": len(pages),
+        "skipped": len(processed),
+        "processed": done,
+        "failed": failed,
+        "throttled": limiter.throttled,
+        "elapsed_seconds": elapsed,
+        "pages_per_minute": done / elapsed * 60 if elapsed > 0 else 0.0,
+        "encode_seconds_total": sum(p["encode_seconds"] for p in encode_stats.values()),
+        "payload_bytes_total": sum(p["payload_bytes"] for p in encode_stats.values()),
+        "image_tokens_total": sum(p["image_tokens"] for p in encode_stats.values()),
+        "pages_encoded": encode_stats,
+        "parse": parse_stats.snapshot(),
+        "telemetry": telemetry.close(),
+    }
+    if ledger is not None:
+        summary["ledger"] = ledger.counts()
+        summary["lost_leases"] = lost_leases
+    if cache is not None:
+        summary["cache"] = cache.stats()
+        cache.close()
+    print(f"Processed {done} pages in {elapsed:.1f}s ({summary['pages_per_minute']:.1f} pages/min), "
+          f"{len(failed)} failed, {limiter.throttled} throttled responses, "
+          f"{summary['parse']['parse_failure_rate']:.1%} parse failures, "
+          f"${summary['telemetry']['estimated_cost_usd']:.2f} estimated cost")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe a directory of deed page images.")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--model", default="claude-3-7-sonnet-20250219")
+    parser.add_argument("--max-in-flight", type=int, default=8)
+    parser.add_argument("--max-retries", type=int, default=5)
+    parser.add_argument("--encode-workers", type=int, default=None)
+    parser.add_argument("--max-edge", type=int, default=DEFAULT_MAX_EDGE)
+    parser.add_argument("--max-bytes", type=int, default=DEFAULT_MAX_BYTES)
+    parser.add_argument("--image-format", default="PNG", choices=["PNG", "JPEG", "WEBP"])
+    parser.add_argument("--cache", default=None, help="Path of the SQLite response cache")
+    parser.add_argument("--crop", action="store_true", help="Crop each page to its text block")
+    parser.add_argument("--bands", type=int, default=1, help="With --crop, send each page as this many bands")
+    parser.add_argument("--run-dir", default=None, help="Write telemetry spans and a summary here")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-host", default=DEFAULT_METRICS_HOST,
+                        help="Interface for --metrics-port; 0.0.0.0 lets other nodes scrape it")
+    parser.add_argument("--ledger", default=None,
+                        help="SQLite job ledger shared by the tasks of an array job (e.g. on /projectnb)")
+    parser.add_argument("--shard", type=int, default=None, help="Shard of this task, defaults to SGE_TASK_ID")
+    parser.add_argument("--num-shards", type=int, default=None, help="Number of shards, defaults to the array size")
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS)
+    parser.add_argument("--resume", action="store_true", help="Retry this shard's failed pages and expired leases")
+    args = parser.parse_args()
+    if args.bands < 1:
+        parser.error("--bands must be at least 1")
+    if args.bands > 1 and not args.crop:
+        parser.error("--bands splits the cropped text block; pass --crop as well")
+
+    ledger = None
+    if args.ledger:
+        shard, num_shards = array_task()
+        ledger = JobLedger(args.ledger, shard if args.shard is None else args.shard,
+                           num_shards if args.num_shards is None else args.num_shards,
+                           lease_seconds=args.lease_seconds)
+
+    process_directory(args.input_dir, args.output_dir, args.model, os.getenv("API_KEY"),
+                      max_in_flight=args.max_in_flight, max_retries=args.max_retries,
+                      encode_workers=args.encode_workers, max_edge=args.max_edge,
+                      max_bytes=args.max_bytes, image_format=args.image_format,
+                      cache_path=args.cache, crop=args.crop, bands=args.bands,
+                      run_dir=args.run_dir, metrics_port=args.metrics_port, metrics_host=args.metrics_host,
+                      ledger=ledger, resume=args.resume)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import pandas as pd
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from elastic_transport import ApiResponseMeta, HttpHeaders, NodeConfig, Transport, TransportApiResponse
+from elasticsearch import Elasticsearch
+
+from scripts.batch import list_images, process_directory
+from scripts.entities import benchmark as bench_entity_queries, build_entities
+from scripts.mapIndex import bulk_index
+from scripts.preprocess import iter_encoded_pages
+from scripts.search import build_query
+from scripts.sqlite_index import BENCHMARK_QUERIES, SQLiteBackend, build_index
+
+SAMPLE_IMAGES = os.path.join("dataset", "sample-images")
+SAMPLE_TABLE = os.path.join("dataset", "standardized_land_deeds.csv")
+STUB_RESPONSE = {
+    "document_text": "Know all men by these presents that I John Miller of Springfield ...",
+    "document_type": "Deed",
+    "grantors": ["John Miller"],
+    "grantees": ["Jedidiah Bliss"],
+    "legal_authorities": [],
+    "property_description": {"acreage": "10 acres", "boundaries": [], "lot_info": ""},
+    "geographical_references": {"city": "Springfield", "county": "Hampshire", "streets": []},
+    "transaction_dates": {"execution_date": "March 29, 1757", "recording_date": "", "other_dates": []}
+}
+# Whether a larger value of a metric is better; metrics matching neither are not compared
+HIGHER_IS_BETTER = ("_per_second", "_per_minute")
+LOWER_IS_BETTER = ("_seconds", "_ms")
+
+
+class StubAPIError(Exception):
+    """A throttled response, shaped like anthropic.APIStatusError for batch.is_throttled."""
+
+    def __init__(self, status_code: int, retry_after: float):
+        super().__init__(f"stub status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)})
+
+
+class StubMessages:
+
+    def __init__(self, latency: float, jitter: float, throttle_rate: float, malformed_rate: float,
+                 retry_after: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.malformed_rate = malformed_rate
+        self.retry_after = retry_after
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def create(self, **params):
+        # Every draw is made under the lock: random.Random is not safe to share between threads
+        with self._lock:
+            self.calls += 1
+            latency = max(0.0, self._random.gauss(self.latency, self.jitter))
+            roll = self._random.random()
+            status = self._random.choice([429, 529])
+        time.sleep(latency)
+        if roll < self.throttle_rate:
+            raise StubAPIError(status, self.retry_after)
+        text = json.dumps(STUB_RESPONSE)
+        if roll < self.throttle_rate + self.malformed_rate:
+            # Prose around the object and a trailing comma, which the tolerant parser has to recover
+            text = "Here is the extracted information:\n```json\n" + text[:-1] + ",}\n```\nLet me know if you need more."
+        return SimpleNamespace(
+            content=[SimpleNamespace(type="text", text=text)],
+            stop_reason="end_turn",
+            usage=SimpleNamespace(input_tokens=1600, output_tokens=len(text) // 4,
+                                  cache_creation_input_tokens=0, cache_read_input_tokens=0)
+        )
+
+
+class StubAnthropic:
+    """
+    Offline stand-in for anthropic.Anthropic: messages.create sleeps for a
+    Gaussian latency, then raises a 429/529 with probability throttle_rate or
+    returns a canned extraction, malformed with probability malformed_rate.
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.1, throttle_rate: float = 0.05,
+                 malformed_rate: float = 0.05, retry_after: float = 0.05, seed: int = 0):
+        self.messages = StubMessages(latency, jitter, throttle_rate, malformed_rate, retry_after, seed)
+
+
+class StubTransport(Transport):
+    """elastic_transport transport that acknowledges every request without a network round trip."""
+
+    def perform_request(self, method, target, *, body=None, headers=None, **kwargs):
+        status = 200
+        if "_bulk" in target:
+            # The bulk helper passes the serialised NDJSON lines, action and source alternating
+            actions = [json.loads(line) for line in body[::2]]
+            items = [{"index": {"_id": action["index"]["_id"], "status": 201}} for action in actions]
+            response = {"took": 1, "errors": False, "items": items}
+        elif method == "HEAD":
+            response, status = {}, 404
+        else:
+            response = {"acknowledged": True}
+        meta = ApiResponseMeta(status=status, http_version="1.1", duration=0.0,
+                               headers=HttpHeaders({"x-elastic-product": "Elasticsearch",
+                                                    "content-type": "application/json"}),
+                               node=NodeConfig("http", "benchmark.invalid", 9200))
+        return TransportApiResponse(meta, response)
+
+
+def stub_elasticsearch() -> Elasticsearch:
+    return Elasticsearch("http://benchmark.invalid:9200", transport_class=StubTransport)
+
+
+def scale_table(table_path: str, rows: int, output_path: str, seed: int = 0) -> str:
+    """
+    Write a synthetic table of `rows` deeds built from the real one.
+    Rows are sampled with replacement and given new IDs, and the name, place
+    and date columns are shuffled independently so that the combinations (and
+    the index statistics) differ from row to row.
+    """
+    source = pd.read_csv(table_path, dtype=str)
+    table = source.sample(n=rows, replace=True, random_state=seed).reset_index(drop=True)
+    for column in ["Grantors", "Grantees", "City", "Execution Date", "Recording Date"]:
+        table[column] = table[column].sample(frac=1, random_state=seed + 1).to_numpy()
+    table["Document ID"] = [f"{900000 + i // 1000:06d}-{i % 1000 + 1:04d}" for i in range(rows)]
+    table.to_csv(output_path, index=False)
+    return output_path
+
+
+def sample_dir(image_dir: str, limit: int, work_dir: str) -> str:
+    # A directory of links to the first `limit` scans, so runs always see the same pages
+    target = os.path.join(work_dir, "images")
+    os.makedirs(target, exist_ok=True)
+    for path in list_images(image_dir)[:limit]:
+        os.symlink(os.path.abspath(path), os.path.join(target, path.name))
+    return target
+
+
+def bench_preprocess(image_dir: str, workers: Optional[int] = None) -> Dict[str, Any]:
+    start = time.perf_counter()
+    pages = [p for p in iter_encoded_pages(list_images(image_dir), max_workers=workers) if "error" not in p]
+    elapsed = time.perf_counter() - start
+    encode = sorted(p["encode_seconds"] for p in pages)
+    return {
+        "pages": len(pages),
+        "elapsed_seconds": elapsed,
+        "pages_per_second": len(pages) / elapsed if elapsed > 0 else 0.0,
+        "encode_p50_seconds": encode[len(encode) // 2] if encode else 0.0,
+        "payload_bytes_mean": sum(p["payload_bytes"] for p in pages) / len(pages) if pages else 0,
+    }
+
+
+def bench_transcription(image_dir: str, work_dir: str, max_in_flight: int = 8, **stub_kwargs) -> Dict[str, Any]:
+    client = StubAnthropic(**stub_kwargs)
+    output_dir = os.path.join(work_dir, "json")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    summary = process_directory(image_dir, output_dir, "claude-3-7-sonnet-20250219", client=client,
+                                max_in_flight=max_in_flight, report_every=0)
+    telemetry = summary["telemetry"]
+    return {
+        "pages": summary["processed"],
+        "failed": len(summary["failed"]),
+        "api_calls": client.messages.calls,
+        "throttled": summary["throttled"],
+        "recovered": summary["parse"]["recovered"],
+        "elapsed_seconds": summary["elapsed_seconds"],
+        "pages_per_minute": summary["pages_per_minute"],
+        "request_p50_seconds": telemetry["spans"].get("request", {}).get("p50_seconds", 0.0),
+        "request_p95_seconds": telemetry["spans"].get("request", {}).get("p95_seconds", 0.0),
+    }
+
+
+def bench_bulk_index(table_path: str, work_dir: str) -> Dict[str, Any]:
+    state_path = os.path.join(work_dir, "index_state.json")
+    stats = bulk_index(None, None, "land_deeds", table_path, client=stub_elasticsearch(),
+                       state_path=state_path, force=True)
+    # A second pass over an unchanged table should skip everything by content hash
+    start = time.perf_counter()
+    rerun = bulk_index(None, None, "land_deeds", table_path, client=stub_elasticsearch(), state_path=state_path)
+    return {
+        "documents": stats["indexed"],
+        "failed": stats["failed"],
+        "elapsed_seconds": stats["elapsed_seconds"],
+        "docs_per_second": stats["docs_per_second"],
+        "unchanged_rerun_seconds": time.perf_counter() - start,
+        "unchanged_skipped": rerun["skipped"],
+    }
+
+
+def bench_search(table_path: str, work_dir: str, repeat: int = 5) -> Dict[str, Any]:
+    db_path = os.path.join(work_dir, "search.sqlite")
+    build = build_index(table_path, db_path, force=True)
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        for args in BENCHMARK_QUERIES:
+            build_query(*args)
+    build_query_ms = (time.perf_counter() - start) * 1000 / (1000 * len(BENCHMARK_QUERIES))
+
+    backend = SQLiteBackend(db_path)
+    latencies = []
+    for args in BENCHMARK_QUERIES:
+        for _ in range(repeat):
+            query_start = time.perf_counter()
+            backend.search_page(build_query(*args))
+            latencies.append((time.perf_counter() - query_start) * 1000)
+    latencies.sort()
+    return {
+        "index_build_seconds": build["elapsed_seconds"],
+        "build_query_ms": build_query_ms,
+        "search_p50_ms": latencies[len(latencies) // 2],
+        "search_p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+    }
+
+
+def bench_entities(table_path: str, work_dir: str) -> Dict[str, Any]:
+    index_path = os.path.join(work_dir, "entities.npz")
+    build = build_entities(table_path, index_path)
+    return {"build_seconds": build["elapsed_seconds"], "persons": build["persons"], "edges": build["edges"],
+            **bench_entity_queries(index_path)}
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = 0.10) -> List[Dict[str, Any]]:
+    """
+    Compare the timing metrics of two result files.
+    Returns:
+        One entry per metric that got worse than the baseline by more than `tolerance`.
+    """
+    regressions = []
+    for name, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            before = baseline.get("results", {}).get(name, {}).get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(before, (int, float)) or before == 0:
+                continue
+            change = (value - before) / before
+            if metric.endswith(HIGHER_IS_BETTER):
+                worse = change < -tolerance
+            elif metric.endswith(LOWER_IS_BETTER):
+                worse = change > tolerance
+            else:
+                continue
+            if worse:
+                regressions.append({"benchmark": name, "metric": metric, "baseline": before,
+                                    "value": value, "change": change})
+    return regressions
+
+
+def run(only: Optional[List[str]] = None, rows: int = 100_000, images: int = 40,
+        image_dir: str = SAMPLE_IMAGES, table_path: str = SAMPLE_TABLE, seed: int = 0,
+        stub_latency: float = 0.5, throttle_rate: float = 0.05, malformed_rate: float = 0.05) -> Dict[str, Any]:
+    """
+    Run the selected benchmarks (preprocess, transcription, index, search, entities) in a scratch directory.
+    Returns:
+        {"meta": {...}, "results": {benchmark: {metric: value}}}
+    """
+    only = only or ["preprocess", "transcription", "index", "search", "entities"]
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="deeds-benchmark-") as work_dir:
+        pages_dir = sample_dir(image_dir, images, work_dir)
+        if "preprocess" in only:
+            results["preprocess"] = bench_preprocess(pages_dir)
+        if "transcription" in only:
+            results["transcription"] = bench_transcription(
+                pages_dir, work_dir, latency=stub_latency, jitter=stub_latency / 5,
+                throttle_rate=throttle_rate, malformed_rate=malformed_rate, seed=seed)
+        if "index" in only or "search" in only or "entities" in only:
+            scaled = scale_table(table_path, rows, os.path.join(work_dir, "deeds.csv"), seed=seed)
+            if "index" in only:
+                results["index"] = bench_bulk_index(scaled, work_dir)
+            if "search" in only:
+                results["search"] = bench_search(scaled, work_dir)
+            if "entities" in only:
+                results["entities"] = bench_entities(scaled, work_dir)
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "rows": rows,
+            "images": images,
+            "seed": seed,
+            "stub_latency": stub_latency,
+            "throttle_rate": throttle_rate,
+            "malformed_rate": malformed_rate,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the transcription, indexing and search paths.")
+    parser.add_argument("--only", default=None, help="Comma-separated subset of preprocess,transcription,index,search,entities")
+    parser.add_argument("--rows", type=int, default=100_000, help="Rows in the synthetic deeds table")
+    parser.add_argument("--images", type=int, default=40, help="Sample scans used for preprocess and transcription")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stub-latency", type=float, default=0.5, help="Mean seconds per stub API call")
+    parser.add_argument("--throttle-rate", type=float, default=0.05)
+    parser.add_argument("--malformed-rate", type=float, default=0.05)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--baseline", default=None, help="Compare against this earlier result file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed slowdown before a metric counts as a regression")
+    args = parser.parse_args()
+
+    results = run(only=args.only.split(",") if args.only else None, rows=args.rows, images=args.images,
+                  seed=args.seed, stub_latency=args.stub_latency, throttle_rate=args.throttle_rate,
+                  malformed_rate=args.malformed_rate)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+        settings = ("rows", "images", "seed", "stub_latency", "throttle_rate", "malformed_rate", "cpus")
+        differing = [k for k in settings if baseline.get("meta", {}).get(k) != results["meta"][k]]
+        if differing:
+            print(f"Warning: baseline was run with different settings ({', '.join(differing)})")
+        results["regressions"] = compare(results, baseline, args.tolerance)
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(results, output_file, indent=4)
+    print(json.dumps(results["results"], indent=4))
+
+    for regression in results.get("regressions", []):
+        print(f"REGRESSION {regression['benchmark']}.{regression['metric']}: "
+              f"{regression['baseline']:.4g} -> {regression['value']:.4g} ({regression['change']:+.0%})")
+    sys.exit(1 if results.get("regressions") else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+from scripts.extract import parse_components, store_json
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+# file_id of entries holding a multi-page response from scripts.packing, e.g. packed:000001-0001-000001-0004
+PACKED_ID_PREFIX = "packed:"
+
+
+class ResponseCache:
+    """
+    Content-addressed store of model responses in a single SQLite file.
+
+    Entries are keyed by a hash of everything that determines the response
+    (image bytes, model, prompt template, system prompt and max_tokens) and hold
+    both the raw response text and the JSON parsed from it, so a fixed parser
+    can be re-run over old responses without touching the API. Once the stored
+    responses exceed max_bytes the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                file_id TEXT,
+                raw_response TEXT NOT NULL,
+                parsed_json TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def make_key(image_data, model: str, prompt_template: str, max_tokens: int, system: str = "") -> str:
+        if isinstance(image_data, str):
+            image_data = image_data.encode("ascii")
+        digest = hashlib.sha256(image_data)
+        for part in (model, prompt_template, str(max_tokens), system):
+            # Length-prefix each part so that the boundaries cannot shift between fields
+            encoded = part.encode("utf-8")
+            digest.update(len(encoded).to_bytes(8, "big"))
+            digest.update(encoded)
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT file_id, raw_response, parsed_json FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            parsed = json.loads(row[2]) if row is not None else None
+            # Unparseable responses are kept for reparse but never replayed, so the page is requested again
+            if parsed is None or parsed.get("error"):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return {"file_id": row[0], "raw_response": row[1], "parsed": parsed}
+
+    def put(self, key: str, raw_response: str, parsed: Dict[str, Any], file_id: Optional[str] = None):
+        parsed_json = json.dumps(parsed, ensure_ascii=False)
+        size = len(raw_response.encode("utf-8")) + len(parsed_json.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, file_id, raw_response, parsed_json, size, now, now),
+            )
+            self._bytes += size - (old[0] if old else 0)
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def update_parsed(self, key: str, parsed: Dict[str, Any]):
+        parsed_json = json.dumps(parsed, ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "UPDATE responses SET parsed_json = ?, size = length(CAST(raw_response AS BLOB)) + ? WHERE key = ?",
+                (parsed_json, len(parsed_json.encode("utf-8")), key),
+            )
+
+    def _evict(self):
+        # Other processes may share the file, so trust the table rather than our running total
+        self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = int(self.max_bytes * 0.9)
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._bytes <= target:
+                break
+            evicted.append((key,))
+            self._bytes -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT key, file_id, raw_response FROM responses").fetchall()
+        for key, file_id, raw_response in rows:
+            yield {"key": key, "file_id": file_id, "raw_response": raw_response}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+def reparse(cache: ResponseCache, output_dir: Optional[str] = None) -> Dict[str, int]:
+    """
+    Re-run the response parser over every cached raw response, entirely offline.
+    The refreshed JSON is written back to the cache and, when output_dir is
+    given, to <file_id>.json there; responses that still fail to parse are
+    not written as page output.
+    """
+    counts = {"entries": 0, "failed": 0, "skipped": 0}
+    for entry in cache.entries():
+        if (entry["file_id"] or "").startswith(PACKED_ID_PREFIX):
+            counts["skipped"] += 1  # Multi-page responses have their own schema; rerun scripts.packing to refresh them
+            continue
+        parsed = parse_components(entry["raw_response"])
+        cache.update_parsed(entry["key"], parsed)
+        counts["entries"] += 1
+        if "error" in parsed:
+            counts["failed"] += 1
+        elif output_dir and entry["file_id"]:
+            store_json(entry["file_id"], output_dir, parsed)
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or replay the model response cache.")
+    parser.add_argument("cache_path")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats")
+    reparse_parser = subparsers.add_parser("reparse")
+    reparse_parser.add_argument("--output-dir", default=None)
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.cache_path)
+    if args.command == "stats":
+        print(json.dumps(cache.stats(), indent=4))
+    else:
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+        print(json.dumps(reparse(cache, args.output_dir), indent=4))
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import os
+import csv
+import re
+import json
+import shutil
+import hashlib
+import argparse
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from typing import Any, Dict, List, Optional
+
+from scripts.normalize import NORMALIZED_FIELDNAMES, categorize_document, normalize_table, standardize_deed
+
+RAW_FIELDNAMES = [
+    "Document ID", "Document Text", "Document Type", "Grantors", "Grantees", "Legal Authorities",
+    "Acreage", "Boundaries", "Lot Info", "City", "County", "Province/Colony",
+    "Execution Date", "Recording Date", "Deeds Standardized"
+]
+# The extracted columns as written by the model, then their normalised forms
+FIELDNAMES = RAW_FIELDNAMES + NORMALIZED_FIELDNAMES
+SCHEMA = pa.schema([(name, pa.float64() if name == "Acres" else pa.string()) for name in FIELDNAMES])
+PART_RE = re.compile(r"part-(\d+)\.parquet")
+
+
+def _join(value) -> str:
+    if isinstance(value, list):
+        return ", ".join(str(v) for v in value)
+    return "" if value is None else str(value)
+
+
+def flatten_record(json_data: Dict[str, Any], document_id: str) -> Dict[str, Optional[str]]:
+    """
+    Flatten one page of extracted JSON into a row of the consolidated table,
+    computing Deeds Standardized in the same pass.
+    """
+    property_description = json_data.get("property_description") or {}
+    geographical_references = json_data.get("geographical_references") or {}
+    transaction_dates = json_data.get("transaction_dates") or {}
+    document_type = _join(json_data.get("document_type", ""))
+    province = (geographical_references.get("province/colony")
+                or geographical_references.get("province_colony")
+                or geographical_references.get("province", ""))
+    return {
+        "Document ID": document_id,
+        "Document Text": _join(json_data.get("document_text", "")),
+        "Document Type": document_type,
+        "Grantors": _join(json_data.get("grantors", [])),
+        "Grantees": _join(json_data.get("grantees", [])),
+        "Legal Authorities": _join(json_data.get("legal_authorities", [])),
+        "Acreage": _join(property_description.get("acreage", "")),
+        "Boundaries": _join(property_description.get("boundaries", [])),
+        "Lot Info": _join(property_description.get("lot_info", "")),
+        "City": _join(geographical_references.get("city", "")),
+        "County": _join(geographical_references.get("county", "")),
+        "Province/Colony": _join(province),
+        "Execution Date": _join(transaction_dates.get("execution_date", "")),
+        "Recording Date": _join(transaction_dates.get("recording_date", "")),
+        "Deeds Standardized": standardize_deed(document_type),
+    }
+
+
+def load_manifest(manifest_path) -> Dict[str, Any]:
+    if manifest_path and os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    return {}
+
+
+def _write_atomic(path, write):
+    # The temp file is hidden so that a reader listing the Parquet directory never picks it up
+    tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.tmp")
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def list_parts(parquet_dir) -> List[str]:
+    # Part files in write order; hidden temp files are skipped
+    return sorted(name for name in os.listdir(parquet_dir) if PART_RE.fullmatch(name))
+
+
+def _read_json(path, content: bytes) -> Optional[Dict[str, Any]]:
+    try:
+        json_data = json.loads(content)
+    except json.JSONDecodeError:
+        print(f"Error reading JSON file: {path}")
+        return None
+    return None if "error" in json_data else json_data
+
+
+def _write_csv(csv_path, parquet_dir, parts: List[str]):
+    # Rebuilt from the parts, which already hold the normalised columns
+    def write(path):
+        header = True
+        for part in parts:
+            frame = pq.read_table(os.path.join(parquet_dir, part)).to_pandas()
+            frame.to_csv(path, mode="w" if header else "a", header=header, index=False, quoting=csv.QUOTE_MINIMAL)
+            header = False
+        if header:
+            pd.DataFrame(columns=FIELDNAMES).to_csv(path, index=False)
+    _write_atomic(csv_path, write)
+
+
+def consolidate(json_dir, parquet_path: str, csv_path: Optional[str] = None,
+                manifest_path: Optional[str] = None, full: bool = False) -> Dict[str, int]:
+    """
+    Build the consolidated deeds table from a directory of per-page JSON files.
+    The table is a directory of Parquet parts. Each file's mtime, size, content
+    hash and part are kept in a manifest; on later runs only new or changed
+    files are read, normalised and written as one new part, and only the parts
+    that held their old rows are rewritten. New rows are appended to the CSV,
+    which is only rebuilt (from the parts) when existing rows changed.
+    Args:
+        json_dir: Directory of <file_id>.json outputs.
+        parquet_path: Directory of Parquet parts, also the store of rows between runs.
+        csv_path: Optional CSV written alongside for compatibility.
+        manifest_path: Defaults to <parquet_path>.manifest.json.
+        full: Ignore the manifest and re-read every file into a single part.
+    Returns:
+        Counts of files read, reused, removed and skipped for errors.
+    """
+    manifest_path = manifest_path or f"{parquet_path}.manifest.json"
+    manifest = {} if full else load_manifest(manifest_path)
+    if not os.path.isdir(parquet_path) or "documents" not in manifest:
+        # First run, --full, or a table written before it was split into parts
+        manifest = {}
+        if os.path.isdir(parquet_path):
+            shutil.rmtree(parquet_path)
+        elif os.path.exists(parquet_path):
+            os.remove(parquet_path)
+    os.makedirs(parquet_path, exist_ok=True)
+    documents = manifest.get("documents", {})
+    # Parts not in the manifest were written by a run that stopped before saving it
+    known = {entry["part"] for entry in documents.values() if entry.get("part")}
+    for part in list_parts(parquet_path):
+        if part not in known:
+            os.remove(os.path.join(parquet_path, part))
+
+    rows = []
+    new_documents = {}
+    counts = {"read": 0, "reused": 0, "removed": 0, "errors": 0}
+    with os.scandir(json_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".json") or not entry.is_file():
+                continue
+            document_id = entry.name[:-len(".json")]
+            stat = entry.stat()
+            seen = documents.get(document_id)
+            if seen and seen["mtime_ns"] == stat.st_mtime_ns and seen["size"] == stat.st_size:
+                new_documents[document_id] = seen
+                counts["reused"] += 1 if seen.get("part") else 0
+                continue
+
+            with open(entry.path, "rb") as json_file:
+                content = json_file.read()
+            digest = hashlib.sha256(content).hexdigest()
+            if seen and seen.get("sha256") == digest:
+                # Touched but unchanged
+                new_documents[document_id] = {**seen, "mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+                counts["reused"] += 1 if seen.get("part") else 0
+                continue
+
+            json_data = _read_json(entry.path, content)
+            if json_data is None:
+                counts["errors"] += 1
+            else:
+                rows.append(flatten_record(json_data, document_id))
+                counts["read"] += 1
+            # The part is filled in once the new rows are written
+            new_documents[document_id] = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": digest,
+                                          "part": None}
+
+    # Rows whose part no longer holds the current version: changed, now unreadable, or deleted
+    stale = {}
+    for document_id, entry in documents.items():
+        if entry.get("part") and new_documents.get(document_id, {}).get("part") != entry["part"]:
+            stale.setdefault(entry["part"], set()).add(document_id)
+    counts["removed"] = sum(1 for document_id in documents
+                            if documents[document_id].get("part") and document_id not in new_documents)
+
+    parts = list_parts(parquet_path)
+    if rows:
+        # Only the new and changed rows are normalised; the parsers see each distinct value once
+        rows.sort(key=lambda row: row["Document ID"])
+        frame = normalize_table(pd.DataFrame(rows, columns=RAW_FIELDNAMES))
+        number = int(PART_RE.fullmatch(parts[-1]).group(1)) + 1 if parts else 0
+        new_part = f"part-{number:05d}.parquet"
+        table = pa.Table.from_pandas(frame[FIELDNAMES], schema=SCHEMA, preserve_index=False)
+        _write_atomic(os.path.join(parquet_path, new_part), lambda path: pq.write_table(table, path))
+        for row in rows:
+            new_documents[row["Document ID"]]["part"] = new_part
+
+    for part, document_ids in stale.items():
+        part_path = os.path.join(parquet_path, part)
+        table = pq.read_table(part_path)
+        keep = pc.invert(pc.is_in(table["Document ID"], value_set=pa.array(sorted(document_ids), pa.string())))
+        table = table.filter(keep)
+        if table.num_rows:
+            _write_atomic(part_path, lambda path: pq.write_table(table, path))
+        else:
+            os.remove(part_path)
+
+    csv_info = None
+    if csv_path:
+        previous_csv = manifest.get("csv") or {}
+        unchanged = (not stale and previous_csv.get("path") == os.path.abspath(csv_path)
+                     and os.path.exists(csv_path) and os.path.getsize(csv_path) == previous_csv.get("bytes"))
+        if unchanged and rows:
+            with open(csv_path, "a", encoding="utf-8", newline="") as csv_file:
+                frame[FIELDNAMES].to_csv(csv_file, header=False, index=False, quoting=csv.QUOTE_MINIMAL)
+        elif not unchanged:
+            _write_csv(csv_path, parquet_path, list_parts(parquet_path))
+        csv_info = {"path": os.path.abspath(csv_path), "bytes": os.path.getsize(csv_path)}
+
+    def write_manifest(path):
+        with open(path, "w", encoding="utf-8") as manifest_file:
+            json.dump({"documents": new_documents, "csv": csv_info}, manifest_file)
+    _write_atomic(manifest_path, write_manifest)
+
+    total = sum(1 for entry in new_documents.values() if entry["part"])
+    print(f"Consolidated {total} documents: {counts['read']} read, {counts['reused']} reused, "
+          f"{counts['removed']} removed, {counts['errors']} with errors")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Consolidate per-page JSON into Parquet and CSV.")
+    parser.add_argument("json_dir")
+    parser.add_argument("--parquet", default="standardized_land_deeds.parquet")
+    parser.add_argument("--csv", default="standardized_land_deeds.csv")
+    parser.add_argument("--manifest", default=None)
+    parser.add_argument("--full", action="store_true", help="Re-read every JSON file into a single part")
+    args = parser.parse_args()
+
+    consolidate(args.json_dir, args.parquet, args.csv, args.manifest, args.full)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+from scripts.normalize import NORMALIZED_FIELDNAMES, normalize_table
+
+# Consolidated table column -> index field
+FIELDS = {
+    "Document ID": "document_id",
+    "Document Text": "document_text",
+    "Document Type": "document_type",
+    "Document Category": "document_category",
+    "Grantors": "grantors",
+    "Grantees": "grantees",
+    "Legal Authorities": "legal_authorities",
+    "Acreage": "acreage",
+    "Acres": "acres",
+    "Boundaries": "boundaries",
+    "Lot Info": "lot_info",
+    "City": "city",
+    "County": "county",
+    "Province/Colony": "province_colony",
+    "Execution Date ISO": "execution_date",
+    "Recording Date ISO": "recording_date"
+}
+# Fields indexed as typed values rather than text
+TYPED_FIELDS = {"execution_date", "recording_date", "acres"}
+
+
+def read_chunks(path: str, chunk_size: int):
+    # Stream the consolidated table (CSV, a Parquet file or consolidate.py's directory of parts) in DataFrame chunks
+    path = str(path).rstrip("/")
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq  # Only needed for Parquet tables
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                     if name.endswith(".parquet") and not name.startswith((".", "_"))]
+        else:
+            files = [path]
+        for file_path in files:
+            for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunk_size):
+                yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str)
+
+
+def iter_documents(path: str, chunk_size: int = 5000):
+    # Index-ready documents from the consolidated table, shared by every search backend
+    for df in read_chunks(path, chunk_size):
+        # Tables consolidated before normalisation existed are normalised on the fly
+        if any(column not in df.columns for column in NORMALIZED_FIELDNAMES):
+            df = normalize_table(df)
+        df = df[list(FIELDS)].rename(columns=FIELDS)
+        df["execution_date"] = df["execution_date"].astype(object).where(df["execution_date"].notna(), None)
+        df["recording_date"] = df["recording_date"].astype(object).where(df["recording_date"].notna(), None)
+        acres = pd.to_numeric(df["acres"], errors="coerce")
+        df["acres"] = acres.astype(object).where(acres.notna(), None)
+        # Replace NaN values with empty strings where applicable
+        text_fields = [f for f in FIELDS.values() if f not in TYPED_FIELDS]
+        df[text_fields] = df[text_fields].fillna("")
+        yield from df.to_dict("records")
+
+
+def content_hash(source) -> str:
+    return hashlib.sha1(json.dumps(source, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
@@ -0,0 +1,519 @@
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from scripts.documents import read_chunks
+from scripts.normalize import GIVEN_NAMES, NORMALIZED_FIELDNAMES, canonical_name, normalize_table, split_names
+
+DEFAULT_INDEX = "entities.npz"
+GRANTOR, GRANTEE = 0, 1
+# Blocks larger than this (a very common surname start or ending) are skipped; the other keys still cover their names
+MAX_BLOCK_SIZE = 200
+SURNAME_THRESHOLD = 0.90
+GIVEN_THRESHOLD = 0.90
+# Spelling variants differ by a letter or two; a longer surname merely sharing a prefix is someone else
+MAX_SURNAME_LENGTH_DIFFERENCE = 2
+# Entries of a party cell that are not a person ("his heirs and assigns")
+NON_PERSON_WORDS = {
+    "his", "her", "their", "heirs", "heir", "assigns", "executors", "executor", "administrators",
+    "administrator", "successors", "others", "wife", "estate", "unknown", "specified", "not", "none",
+}
+# "John Ely of Springfield": the residence is dropped from the name
+RESIDENCE_RE = re.compile(r"\s+(?:late\s+)?of\s+.*$", re.IGNORECASE)
+SOUNDEX_CODES = {**dict.fromkeys("bfpv", "1"), **dict.fromkeys("cgjkqsxz", "2"), **dict.fromkeys("dt", "3"),
+                 "l": "4", **dict.fromkeys("mn", "5"), "r": "6"}
+
+
+def soundex(word: str) -> str:
+    # American Soundex: first letter plus three digits; h and w do not separate equal codes
+    word = re.sub(r"[^a-z]", "", word.lower())
+    if not word:
+        return ""
+    code, previous = word[0].upper(), SOUNDEX_CODES.get(word[0], "")
+    for char in word[1:]:
+        digit = SOUNDEX_CODES.get(char, "")
+        if digit and digit != previous:
+            code += digit
+            if len(code) == 4:
+                break
+        if char not in "hw":
+            previous = digit
+    return code.ljust(4, "0")
+
+
+def jaro_winkler(a: str, b: str, prefix_scale: float = 0.1) -> float:
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    window = max(0, max(len(a), len(b)) // 2 - 1)
+    matched_b = [False] * len(b)
+    matches_a = []
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len(b), i + window + 1)):
+            if not matched_b[j] and b[j] == char:
+                matched_b[j] = True
+                matches_a.append(char)
+                break
+    if not matches_a:
+        return 0.0
+    matches_b = [char for char, matched in zip(b, matched_b) if matched]
+    transpositions = sum(x != y for x, y in zip(matches_a, matches_b)) / 2
+    m = len(matches_a)
+    jaro = (m / len(a) + m / len(b) + (m - transpositions) / m) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+
+@lru_cache(maxsize=65536)
+def person_name(entry: str) -> Optional[str]:
+    """
+    Canonical name of one party entry, or None when it is not a person.
+    The residence clause is dropped ("John Ely of Springfield" -> "John Ely"),
+    except for bodies named by it ("Colony of Connecticut").
+    """
+    name = RESIDENCE_RE.sub("", entry)
+    if len(re.findall(r"[A-Za-z]+", name)) < 2:
+        name = entry
+    name = canonical_name(name)
+    words = name.lower().split()
+    if not words or all(word in NON_PERSON_WORDS for word in words):
+        return None
+    return name
+
+
+def name_parts(name: str) -> Tuple[str, str, str]:
+    # (given, surname, suffix) of a canonical name, lower-cased
+    words = name.lower().split()
+    suffix = words.pop() if len(words) > 1 and words[-1] in ("jr", "sr") else ""
+    return (words[0] if len(words) > 1 else ""), words[-1], suffix
+
+
+def blocking_keys(name: str) -> List[str]:
+    """
+    Candidate blocks of a name: the Soundex of the surname and its first and
+    last three letters, each combined with the first given-name initial. A
+    misspelling keeps at least one of them unless it changes both ends and the
+    sound of the name. Two names are only ever compared when they share a block.
+    """
+    given, surname, _ = name_parts(name)
+    initial = given[:1]
+    return [f"s:{initial}:{soundex(surname)}", f"p:{initial}:{surname[:3]}", f"e:{initial}:{surname[-3:]}"]
+
+
+def same_person(a: str, b: str) -> bool:
+    return _same_parts(name_parts(a), name_parts(b))
+
+
+def _same_parts(parts_a: Tuple[str, str, str], parts_b: Tuple[str, str, str]) -> bool:
+    given_a, surname_a, suffix_a = parts_a
+    given_b, surname_b, suffix_b = parts_b
+    if suffix_a != suffix_b or not given_a or not given_b:
+        return False
+    if abs(len(surname_a) - len(surname_b)) > MAX_SURNAME_LENGTH_DIFFERENCE:
+        return False
+    if jaro_winkler(surname_a, surname_b) < SURNAME_THRESHOLD:
+        return False
+    # An initial ("J Lyman") matches any given name it starts
+    if len(given_a) == 1 or len(given_b) == 1:
+        return given_a[0] == given_b[0]
+    given_a, given_b = (GIVEN_NAMES.get(g, g).lower() for g in (given_a, given_b))
+    return jaro_winkler(given_a, given_b) >= GIVEN_THRESHOLD
+
+
+class UnionFind:
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, x: int) -> int:
+        root = x
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[x] != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a: int, b: int):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+def resolve(names: List[str]) -> Tuple[np.ndarray, Dict[str, int]]:
+    """
+    Cluster distinct canonical names into people.
+    Names with a full given name are merged first. A name with only an initial
+    ("J Lyman") matches every given name with that letter, so it never joins
+    two clusters: it is attached only when all the full names it matches are
+    already one person, and otherwise kept apart (or grouped with other
+    initial-only names that match no full name).
+    Returns:
+        A cluster label per name (the index of its first member) and the number
+        of blocks and of name pairs compared.
+    """
+    blocks = defaultdict(list)
+    for i, name in enumerate(names):
+        for key in blocking_keys(name):
+            blocks[key].append(i)
+    parts = [name_parts(name) for name in names]
+    initial_only = [len(given) == 1 for given, _, _ in parts]
+    union_find = UnionFind(len(names))
+    full_matches = defaultdict(set)
+    initial_pairs = []
+    compared, seen = 0, set()
+    for members in blocks.values():
+        if len(members) < 2 or len(members) > MAX_BLOCK_SIZE:
+            continue
+        for x, i in enumerate(members):
+            for j in members[x + 1:]:
+                if (i, j) in seen:
+                    continue
+                seen.add((i, j))
+                compared += 1
+                if not _same_parts(parts[i], parts[j]):
+                    continue
+                if initial_only[i] and initial_only[j]:
+                    initial_pairs.append((i, j))
+                elif initial_only[i]:
+                    full_matches[i].add(j)
+                elif initial_only[j]:
+                    full_matches[j].add(i)
+                else:
+                    union_find.union(i, j)
+    for i, matched in full_matches.items():
+        roots = {union_find.find(j) for j in matched}
+        if len(roots) == 1:
+            union_find.union(i, roots.pop())
+    for i, j in initial_pairs:
+        if i not in full_matches and j not in full_matches:
+            union_find.union(i, j)
+    labels = np.array([union_find.find(i) for i in range(len(names))], dtype=np.int64)
+    return labels, {"blocks": len(blocks), "pairs_compared": compared}
+
+
+def _person_id(name: str) -> str:
+    return "P" + hashlib.sha1(name.encode("utf-8")).hexdigest()[:12]
+
+
+def assign_ids(names: List[str], labels: np.ndarray, previous: Dict[str, str]) -> Dict[int, str]:
+    """
+    A stable ID per cluster. A cluster keeps the ID its names had in the
+    previous index (the smallest, when clusters merged); a new cluster is
+    named by a hash of its alphabetically first name. When a cluster splits,
+    the part whose first name sorts first keeps the old ID.
+    """
+    clusters = defaultdict(list)
+    for i, label in enumerate(labels):
+        clusters[int(label)].append(names[i])
+    ids, taken = {}, set()
+    for label, members in sorted(clusters.items(), key=lambda item: min(item[1])):
+        old = sorted(previous[name] for name in members if name in previous)
+        person_id = next((pid for pid in old if pid not in taken), None) or _person_id(min(members))
+        ids[label] = person_id
+        taken.add(person_id)
+    return ids
+
+
+def _csr(rows: np.ndarray, size: int, *columns: np.ndarray) -> Tuple[np.ndarray, ...]:
+    # Compressed sparse rows: row r's entries are columns[k][indptr[r]:indptr[r + 1]]
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return (indptr,) + tuple(column[order] for column in columns)
+
+
+def read_parties(table_path: str, chunk_size: int = 5000) -> pd.DataFrame:
+    columns = ["Document ID", "Grantors", "Grantees", "Execution Date ISO", "Recording Date ISO", "City Canonical"]
+    frames = []
+    for df in read_chunks(table_path, chunk_size):
+        if any(column not in df.columns for column in NORMALIZED_FIELDNAMES):
+            df = normalize_table(df)
+        frames.append(df[columns])
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+def build_entities(table_path: str, index_path: str = DEFAULT_INDEX, chunk_size: int = 5000) -> Dict[str, Any]:
+    """
+    Resolve the grantors and grantees of the consolidated table into people and
+    write the transfer graph to an .npz index.
+    Args:
+        table_path: Consolidated CSV or Parquet written by consolidate.py.
+        index_path: Output index; person IDs of an existing index are carried over.
+        chunk_size: Rows read from the table at a time.
+    Returns:
+        Counts of documents, mentions, names, people, edges and comparisons, and the elapsed time.
+    """
+    start = time.perf_counter()
+    table = read_parties(table_path, chunk_size)
+    previous = {}
+    if os.path.exists(index_path):
+        old = EntityIndex.load(index_path)
+        previous = dict(zip(old.names.tolist(), old.person_ids[old.name_person].tolist()))
+
+    # One mention per (document, role, person name); distinct names are resolved once
+    mention_doc, mention_role, mention_name = [], [], []
+    for role, column in [(GRANTOR, "Grantors"), (GRANTEE, "Grantees")]:
+        codes, cells = pd.factorize(table[column])
+        cell_names = [list(dict.fromkeys(filter(None, map(person_name, split_names(cell))))) for cell in cells]
+        for doc, code in enumerate(codes):
+            if code >= 0:
+                for name in cell_names[code]:
+                    mention_doc.append(doc)
+                    mention_role.append(role)
+                    mention_name.append(name)
+    name_codes, names = pd.factorize(pd.Series(mention_name, dtype=object))
+    names = names.tolist()
+    labels, stats = resolve(names)
+
+    ids = assign_ids(names, labels, previous)
+    cluster_labels = sorted(ids, key=ids.get)
+    person_ids = np.array([ids[label] for label in cluster_labels])
+    person_of_cluster = {label: p for p, label in enumerate(cluster_labels)}
+    name_person = np.array([person_of_cluster[int(label)] for label in labels], dtype=np.int32)
+
+    mention_doc = np.array(mention_doc, dtype=np.int32)
+    mention_role = np.array(mention_role, dtype=np.int8)
+    mention_person = name_person[name_codes] if len(name_codes) else np.zeros(0, dtype=np.int32)
+    # The most frequent spelling names the person
+    counts = np.bincount(name_codes, minlength=len(names)) if len(name_codes) else np.zeros(0, dtype=np.int64)
+    display = {}
+    for i in np.argsort(-counts, kind="stable"):
+        display.setdefault(name_person[i], names[i])
+    person_names = np.array([display[p] for p in range(len(person_ids))], dtype=str)
+
+    # Every grantor of a document conveys to every grantee of it
+    by_doc = defaultdict(lambda: ([], []))
+    for doc, role, person in zip(mention_doc.tolist(), mention_role.tolist(), mention_person.tolist()):
+        by_doc[doc][role].append(person)
+    edges = np.array([(g, h, doc) for doc, (grantors, grantees) in by_doc.items()
+                      for g in grantors for h in grantees if g != h], dtype=np.int32).reshape(-1, 3)
+    edges = np.unique(edges, axis=0)
+
+    n_persons = len(person_ids)
+    out_indptr, out_person, out_doc = _csr(edges[:, 0], n_persons, edges[:, 1], edges[:, 2])
+    in_indptr, in_person, in_doc = _csr(edges[:, 1], n_persons, edges[:, 0], edges[:, 2])
+    mention_indptr, mention_docs, mention_roles = _csr(mention_person, n_persons, mention_doc, mention_role)
+    dates = table["Execution Date ISO"].fillna(table["Recording Date ISO"]).fillna("")
+
+    np.savez_compressed(
+        index_path,
+        person_ids=person_ids, person_names=person_names,
+        names=np.array(names, dtype=str), name_person=name_person,
+        doc_ids=table["Document ID"].astype(str).to_numpy(dtype=str),
+        doc_dates=dates.to_numpy(dtype="U10"),
+        doc_places=table["City Canonical"].fillna("").to_numpy(dtype=str),
+        out_indptr=out_indptr, out_person=out_person, out_doc=out_doc,
+        in_indptr=in_indptr, in_person=in_person, in_doc=in_doc,
+        mention_indptr=mention_indptr, mention_doc=mention_docs, mention_role=mention_roles,
+    )
+    stats.update({
+        "documents": len(table), "mentions": len(mention_doc), "names": len(names),
+        "persons": n_persons, "edges": len(edges), "elapsed_seconds": time.perf_counter() - start,
+    })
+    print(f"Resolved {stats['names']} names into {stats['persons']} people "
+          f"({stats['pairs_compared']} pairs compared), {stats['edges']} transfers "
+          f"in {stats['elapsed_seconds']:.1f}s")
+    return stats
+
+
+class EntityIndex:
+    """
+    Read side of the entity index: name lookup, a person's transfers and
+    chain-of-title walks over the grantor -> grantee graph. Neighbours of a
+    person are a slice of the CSR arrays, so lookups do not touch the table.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        for key, value in arrays.items():
+            setattr(self, key, value)
+        self.person_index = {pid: p for p, pid in enumerate(self.person_ids.tolist())}
+        self.name_index = {name: int(p) for name, p in zip(self.names.tolist(), self.name_person.tolist())}
+        self.blocks = defaultdict(list)
+        for name in self.name_index:
+            for key in blocking_keys(name) + [f"surname:{soundex(name_parts(name)[1])}"]:
+                self.blocks[key].append(name)
+
+    @classmethod
+    def load(cls, index_path: str) -> "EntityIndex":
+        with np.load(index_path, allow_pickle=False) as data:
+            return cls({key: data[key] for key in data.files})
+
+    def lookup(self, query: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """People whose recorded names match `query`, exact matches first, then by Jaro-Winkler score."""
+        name = person_name(query.strip()) if query and query.strip() else None
+        if not name:
+            return []
+        scores = {}
+        if name in self.name_index:
+            scores[self.name_index[name]] = 1.0
+        # A bare surname matches every person of that surname
+        surname_only = len(name.split()) == 1
+        keys = [f"surname:{soundex(name)}"] if surname_only else blocking_keys(name)
+        for key in keys:
+            for candidate in self.blocks.get(key, ()):
+                if surname_only:
+                    score = jaro_winkler(name.lower(), name_parts(candidate)[1])
+                    matched = score >= SURNAME_THRESHOLD
+                else:
+                    score = jaro_winkler(name.lower(), candidate.lower())
+                    matched = same_person(name, candidate)
+                if matched:
+                    person = self.name_index[candidate]
+                    scores[person] = max(scores.get(person, 0.0), score)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self.person_names[item[0]]))[:limit]
+        return [self.person(p, score=score) for p, score in ranked]
+
+    def person(self, p: int, **extra) -> Dict[str, Any]:
+        start, end = self.mention_indptr[p], self.mention_indptr[p + 1]
+        return {"person_id": str(self.person_ids[p]), "name": str(self.person_names[p]),
+                "documents": int(end - start), **extra}
+
+    def variants(self, person_id: str) -> List[str]:
+        p = self.person_index[person_id]
+        return self.names[self.name_person == p].tolist()
+
+    def _edges(self, p: int, forward: bool) -> Tuple[np.ndarray, np.ndarray]:
+        if forward:
+            return (self.out_person[self.out_indptr[p]:self.out_indptr[p + 1]],
+                    self.out_doc[self.out_indptr[p]:self.out_indptr[p + 1]])
+        return (self.in_person[self.in_indptr[p]:self.in_indptr[p + 1]],
+                self.in_doc[self.in_indptr[p]:self.in_indptr[p + 1]])
+
+    def _transfer(self, grantor: int, grantee: int, doc: int, **extra) -> Dict[str, Any]:
+        return {
+            "document_id": str(self.doc_ids[doc]), "date": str(self.doc_dates[doc]) or None,
+            "place": str(self.doc_places[doc]) or None,
+            "grantor_id": str(self.person_ids[grantor]), "grantor": str(self.person_names[grantor]),
+            "grantee_id": str(self.person_ids[grantee]), "grantee": str(self.person_names[grantee]),
+            **extra,
+        }
+
+    def transfers(self, person_id: str) -> List[Dict[str, Any]]:
+        """Every document naming the person, with their role, in date order (undated last)."""
+        p = self.person_index[person_id]
+        start, end = self.mention_indptr[p], self.mention_indptr[p + 1]
+        rows = []
+        for doc, role in zip(self.mention_doc[start:end].tolist(), self.mention_role[start:end].tolist()):
+            counterparts, docs = self._edges(p, forward=role == GRANTOR)
+            others = sorted({str(self.person_names[o]) for o in counterparts[docs == doc].tolist()})
+            rows.append({"document_id": str(self.doc_ids[doc]), "date": str(self.doc_dates[doc]) or None,
+                         "place": str(self.doc_places[doc]) or None,
+                         "role": "grantor" if role == GRANTOR else "grantee", "counterparties": ", ".join(others)})
+        return sorted(rows, key=lambda row: (row["date"] is None, row["date"] or "", row["document_id"]))
+
+    def chain_of_title(self, person_id: str, forward: bool = True, since: Optional[str] = None,
+                       max_depth: int = 10, max_steps: int = 1000) -> List[Dict[str, Any]]:
+        """
+        Follow conveyances breadth-first from a person.
+        Forward walks grantor -> grantee, keeping each step on or after the
+        date the previous party acquired; backward walks grantee -> grantor on
+        or before it. Undated documents are kept but do not move the date.
+        Each person is reached once, through the first transfer found.
+        Args:
+            person_id: Starting person.
+            forward: Direction of the walk.
+            since: ISO date bound for the first step.
+            max_depth, max_steps: Limits on the walk.
+        Returns:
+            One row per transfer with its depth in the chain.
+        """
+        start = self.person_index[person_id]
+        frontier, visited, steps = [(start, since or None)], {start}, []
+        for depth in range(1, max_depth + 1):
+            next_frontier = []
+            for p, bound in frontier:
+                people, docs = self._edges(p, forward)
+                dates = self.doc_dates[docs]
+                keep = np.ones(len(docs), dtype=bool)
+                if bound:
+                    keep = (dates == "") | ((dates >= bound) if forward else (dates <= bound))
+                for other, doc, doc_date in zip(people[keep].tolist(), docs[keep].tolist(), dates[keep].tolist()):
+                    if other in visited:
+                        continue
+                    visited.add(other)
+                    next_frontier.append((other, doc_date or bound))
+                    grantor, grantee = (p, other) if forward else (other, p)
+                    steps.append(self._transfer(grantor, grantee, doc, depth=depth))
+                    if len(steps) >= max_steps:
+                        return steps
+            if not next_frontier:
+                break
+            frontier = next_frontier
+        return steps
+
+
+def _sample(values: List[Any], count: int, seed: int = 0) -> List[Any]:
+    rng = np.random.default_rng(seed)
+    return [values[i] for i in rng.choice(len(values), size=min(count, len(values)), replace=False)]
+
+
+def benchmark(index_path: str, queries: int = 200) -> Dict[str, float]:
+    # Latency of name lookups and forward chains for a sample of recorded names
+    start = time.perf_counter()
+    index = EntityIndex.load(index_path)
+    results = {"load_seconds": time.perf_counter() - start}
+    names = _sample(index.names.tolist(), queries)
+    for label, run in [("lookup", lambda name: index.lookup(name)),
+                       ("chain", lambda name: index.chain_of_title(index.lookup(name)[0]["person_id"]))]:
+        timings = []
+        for name in names:
+            t = time.perf_counter()
+            run(name)
+            timings.append((time.perf_counter() - t) * 1000)
+        timings.sort()
+        results[f"{label}_p50_ms"] = timings[len(timings) // 2] if timings else 0.0
+        results[f"{label}_p95_ms"] = timings[int(len(timings) * 0.95)] if timings else 0.0
+    return results
+
+
+def _print_rows(rows: Iterable[Dict[str, Any]]):
+    for row in rows:
+        print("  " + ", ".join(f"{k}={v}" for k, v in row.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resolve deed parties into people and query the chain of title.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build the entity index from the consolidated table")
+    build_parser.add_argument("table")
+    build_parser.add_argument("--index", default=DEFAULT_INDEX)
+    lookup_parser = subparsers.add_parser("lookup", help="Show the people matching a name, their transfers and chain")
+    lookup_parser.add_argument("name")
+    lookup_parser.add_argument("--index", default=DEFAULT_INDEX)
+    lookup_parser.add_argument("--backward", action="store_true", help="Walk the chain back to earlier owners")
+    bench_parser = subparsers.add_parser("bench", help="Time lookups and chain-of-title walks")
+    bench_parser.add_argument("--index", default=DEFAULT_INDEX)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_entities(args.table, args.index)
+    elif args.command == "lookup":
+        index = EntityIndex.load(args.index)
+        matches = index.lookup(args.name)
+        if not matches:
+            print("No matching party")
+        for match in matches[:3]:
+            print(f"{match['name']} ({match['person_id']}, score {match['score']:.2f}): "
+                  f"{', '.join(index.variants(match['person_id']))}")
+            _print_rows(index.transfers(match["person_id"]))
+            print("  chain:")
+            _print_rows(index.chain_of_title(match["person_id"], forward=not args.backward))
+    else:
+        print(json.dumps(benchmark(args.index), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,19 @@
 import os
-import io
-import re
 import json
-import base64
+import uuid
 import anthropic
-from PIL import Image
 from typing import Dict, List, Optional, Any
 
-class PropertyDocumentAnalyzer:
-    
-    def __init__(self, model: str, api_key: str):
-        self.client = anthropic.Anthropic(api_key=api_key)
-        self.model = model
-    
-    def extract_components(self, file_path: str) -> Dict[str, Any]:
-        """
-        Extract key components from document image using a chain-of-thought approach.
-        Args:
-            file_path: The image path of the property document.
-        Returns:
-            A dictionary containing structured information about the document.
-        """
+from scripts.parsing import PARSE_STATS, ParseStats, parse_response
+from scripts.preprocess import encode_page, page_images
+from scripts.telemetry import Telemetry, usage_attrs
+
+SYSTEM_PROMPT = "You are an expert in real estate historical image document analysis. Extract information accurately and completely."
+MAX_TOKENS = 1500
+REPAIR_MAX_TOKENS = 4096
 
-        prompt = f"""
+# Kept as a template (not formatted per page) so it can be part of the response cache key
+EXTRACTION_PROMPT = """
         You are analyzing a image property document. I'll provide you with the image, and I need you to carefully extract the following content and components:
 
         1. Full Document Content from Image
@@ -90,59 +81,154 @@ class PropertyDocumentAnalyzer:
         }}
         ```
         """
-        
-        # Process the image document_id.TIF
-        with Image.open(file_path).convert('L') as image:
-            buffered = io.BytesIO()
-            image.save(buffered, format="PNG")
-            base64_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
 
-        # Make the API call
-        response = self.client.messages.create(
-            model=self.model,
-            max_tokens=1500,
-            temperature=0,
-            system="You are an expert in real estate historical image document analysis. Extract information accurately and completely.",
-            messages=[
+
+# Text-only follow-up for responses the parser cannot recover; far cheaper than re-sending the image
+REPAIR_PROMPT = """The text below was supposed to be a single JSON object with the keys document_text, document_type, grantors, grantees, legal_authorities, property_description (acreage, boundaries, lot_info), geographical_references (city, county, streets) and transaction_dates (execution_date, recording_date, other_dates), but it is not valid JSON. Return only the corrected JSON object, keeping all of its content, with no commentary.
+
+{raw_response}"""
+
+
+class ExtractionError(Exception):
+    """The response could not be parsed, even after a repair request; nothing is written for the page."""
+
+
+class PropertyDocumentAnalyzer:
+    
+    def __init__(self, model: str, api_key: str, client: Optional[Any] = None, cache: Optional[Any] = None,
+                 repair: bool = True, telemetry: Optional[Telemetry] = None,
+                 parse_stats: Optional[ParseStats] = None):
+        # Reuse a caller-supplied client (shared across a batch, or a stub in tests)
+        self.client = client if client is not None else anthropic.Anthropic(api_key=api_key)
+        self.model = model
+        # Optional cache.ResponseCache; a hit skips the API call entirely
+        self.cache = cache
+        # Send a text-only repair request when a response cannot be parsed or recovered
+        self.repair = repair
+        # Per-page spans and token usage; aggregated in memory only unless it has a run directory
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        # Parse outcome counters; a batch run passes its own so that its summary covers only its pages
+        self.parse_stats = parse_stats if parse_stats is not None else PARSE_STATS
+    
+    def build_request(self, file_path: str, encoded_page: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build the messages.create parameters for one encoded page. Shared by the
+        synchronous path and the Message Batches submission in message_batches.py.
+        """
+        prompt = EXTRACTION_PROMPT.format(file_path=file_path)
+        # A page split into bands is sent as several image blocks, top to bottom
+        content = [
+            {
+                "type": "image",
+                "source": {
+                    "type": "base64",
+                    "media_type": image["media_type"],
+                    "data": image["data"]
+                }
+            }
+            for image in page_images(encoded_page)
+        ]
+        content.append({
+            "type": "text",
+            "text": prompt
+        })
+        return {
+            "model": self.model,
+            "max_tokens": MAX_TOKENS,
+            "temperature": 0,
+            "system": SYSTEM_PROMPT,
+            "messages": [
                 {
                     "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/png",
-                                "data": base64_image
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ]
+                    "content": content
                 }
             ]
+        }
+
+    def extract_components(self, file_path: str, encoded_page: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Extract key components from document image using a chain-of-thought approach.
+        Args:
+            file_path: The image path of the property document.
+            encoded_page: Output of preprocess.encode_page for this page; the page is
+                encoded on the calling thread when omitted.
+        Returns:
+            A dictionary containing structured information about the document.
+        """
+
+        file_id = get_file_id(file_path)
+        telemetry = self.telemetry
+
+        # Process the image document_id.TIF
+        if encoded_page is None:
+            with telemetry.span("encode", page=file_id):
+                encoded_page = encode_page(file_path)
+
+        cache_key = None
+        if self.cache is not None:
+            image_data = "".join(image["data"] for image in page_images(encoded_page))
+            cache_key = self.cache.make_key(image_data, self.model, EXTRACTION_PROMPT,
+                                            MAX_TOKENS, SYSTEM_PROMPT)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                telemetry.event("cache_hit", page=file_id)
+                return cached["parsed"]
+            telemetry.event("cache_miss", page=file_id)
+
+        # Make the API call; upload and model time are one span since the response is not streamed
+        with telemetry.span("request", page=file_id, model=self.model) as span:
+            response = self.client.messages.create(**self.build_request(file_path, encoded_page))
+            span.update(usage_attrs(getattr(response, "usage", None), self.model))
+            span["stop_reason"] = getattr(response, "stop_reason", None)
+        raw_text = response_text(response)
+        with telemetry.span("parse", page=file_id) as span:
+            results = parse_components(raw_text, truncated=getattr(response, "stop_reason", None) == "max_tokens",
+                                       stats=self.parse_stats)
+            span["status"] = "failed" if "error" in results else "ok"
+        if "error" in results:
+            telemetry.event("parse_failure", page=file_id)
+            if self.repair and "{" in raw_text:
+                with telemetry.span("repair", page=file_id) as span:
+                    results = self.repair_components(raw_text, span=span)
+                    span["status"] = "failed" if "error" in results else "ok"
+        if self.cache is not None:
+            self.cache.put(cache_key, raw_text, results, file_id=get_file_id(file_path))
+        return results
+
+    def repair_components(self, raw_text: str, span: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Ask the model to turn an unparseable response back into valid JSON.
+        Returns the repaired dictionary, or the usual error dictionary holding
+        the original raw response when the repair fails as well.
+        The token usage of the repair request is added to `span` when given.
+        """
+        response = self.client.messages.create(
+            model=self.model,
+            max_tokens=REPAIR_MAX_TOKENS,
+            temperature=0,
+            messages=[{"role": "user", "content": REPAIR_PROMPT.format(raw_response=raw_text)}]
         )
-        
-        
-        # Extract the JSON from the response
-        try:
-            # Look for JSON structure in the response
-            json_match = re.search(r'```json\s*(.*?)\s*```', response.content, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-                return json.loads(json_str)
-            else:
-                # Try to find any JSON-like structure
-                json_match = re.search(r'({.*})', response.content, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group(1))
-                else:
-                    raise ValueError("No JSON found in response")
-        
-        except Exception as e:
-            return {"error": "Failed to parse response", "raw_response": response.content}
-        
+        if span is not None:
+            span.update(usage_attrs(getattr(response, "usage", None), self.model))
+        parsed = parse_response(response_text(response), stats=None)
+        if parsed["status"] == "failed":
+            self.parse_stats.record("repair_failed")
+            return {"error": parsed["error"], "raw_response": raw_text}
+        self.parse_stats.record("repaired")
+        return parsed["data"]
+
+
+def response_text(response) -> str:
+    # response.content is a list of content blocks, not a string
+    return "".join(getattr(block, "text", "") for block in response.content)
+
+
+def parse_components(raw_text: str, truncated: bool = False, stats: Optional[ParseStats] = PARSE_STATS) -> Dict[str, Any]:
+    # Extract the JSON from the response with the shared tolerant parser
+    parsed = parse_response(raw_text, truncated=truncated, stats=stats)
+    if parsed["status"] == "failed":
+        return {"error": parsed["error"], "raw_response": raw_text}
+    return parsed["data"]
 
 
 def extract_json_from_claude_response(raw_response):
@@ -150,19 +236,12 @@ def extract_json_from_claude_response(raw_response):
     # If raw_response is an object (e.g., TextBlock), extract its text attribute
     if hasattr(raw_response, 'text'):
         raw_response = raw_response.text  # Ensure it's a string
-    
-    # Use regex to find the JSON block inside triple backticks ```json ... ```
-    json_match = re.search(r'```json\n(.*?)\n```', raw_response, re.DOTALL)
-
-    if json_match:
-        json_string = json_match.group(1)  # Extract JSON content
-        try:
-            parsed_json = json.loads(json_string)  # Convert to dictionary
-            return parsed_json
-        except json.JSONDecodeError:
-            return {"error": "Invalid JSON format extracted."}
-    else:
-        return {"error": "No JSON content found in response."}
+
+    # Already counted when the response was first parsed
+    parsed = parse_response(raw_response, stats=None)
+    if parsed["status"] == "failed":
+        return {"error": parsed["error"]}
+    return parsed["data"]
 
     
 def get_file_id(file_path):
@@ -180,16 +259,30 @@ def is_already_processed(file_id, output_dir):
 
 def store_json(file_path, output_dir, direct_results):
 
-    raw_response = direct_results['raw_response']
-    if isinstance(raw_response, list) and raw_response: 
-        raw_response = raw_response[0]  # Extract first item if it's a list
-    parsed_data = extract_json_from_claude_response(raw_response) # Process response
+    if 'raw_response' in direct_results:
+        raw_response = direct_results['raw_response']
+        if isinstance(raw_response, list) and raw_response: 
+            raw_response = raw_response[0]  # Extract first item if it's a list
+        parsed_data = extract_json_from_claude_response(raw_response) # Process response
+    else:
+        parsed_data = direct_results  # Already parsed by extract_components
 
     file_id = get_file_id(file_path)
     json_file_path = os.path.join(output_dir, f"{file_id}.json")
 
-    with open(json_file_path, "w", encoding="utf-8") as json_file:
-        json.dump(parsed_data, json_file, indent=4, ensure_ascii=False)
+    # Write a uniquely named temp file and rename it into place, so a reader (or a
+    # second node writing the same page) never sees a half-written JSON file
+    tmp_path = os.path.join(output_dir, f".{file_id}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(tmp_path, "x", encoding="utf-8") as json_file:
+            json.dump(parsed_data, json_file, indent=4, ensure_ascii=False)
+            json_file.flush()
+            os.fsync(json_file.fileno())
+        os.replace(tmp_path, json_file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
     print(f"JSON saved in: {json_file_path}")
 
@@ -197,7 +290,7 @@ def store_json(file_path, output_dir, direct_results):
 #     print(json.dumps(parsed_data, indent=4, ensure_ascii=False))
     
 
-def process_img(file_path, output_dir, model, api_key):
+def process_img(file_path, output_dir, model, api_key, analyzer=None, encoded_page=None):
     
     file_id = get_file_id(file_path)
     
@@ -206,6 +299,12 @@ def process_img(file_path, output_dir, model, api_key):
         print(f"Skipping {file_id}: already processed")
         return
     
-    analyzer = PropertyDocumentAnalyzer(model, api_key)
-    direct_results = analyzer.extract_components(file_path)
-    store_json(file_path, output_dir, direct_results)
\ No newline at end of file
+    if analyzer is None:
+        analyzer = PropertyDocumentAnalyzer(model, api_key)
+    with analyzer.telemetry.span("page", page=file_id):
+        direct_results = analyzer.extract_components(file_path, encoded_page=encoded_page)
+        if "error" in direct_results:
+            # Left without output so that is_already_processed does not count it and a rerun tries again
+            raise ExtractionError(direct_results["error"])
+        with analyzer.telemetry.span("write", page=file_id):
+            store_json(file_path, output_dir, direct_results)
\ No newline at end of file
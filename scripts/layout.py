@@ -0,0 +1,176 @@
+import io
+import os
+import math
+import time
+import json
+import argparse
+import numpy as np
+from PIL import Image
+from typing import Any, Dict, List, Optional, Tuple
+
+# The API scales images to fit both of these before counting roughly one token per 750 pixels
+API_MAX_EDGE = 1568
+API_MAX_PIXELS = 1_150_000
+PIXELS_PER_TOKEN = 750
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    scale = min(1.0, API_MAX_EDGE / max(width, height), math.sqrt(API_MAX_PIXELS / (width * height)))
+    return math.ceil((width * scale) * (height * scale) / PIXELS_PER_TOKEN)
+
+
+def binarise(gray: np.ndarray) -> np.ndarray:
+    # Otsu threshold on the histogram; returns True where there is ink
+    histogram = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    weights = np.arange(256)
+    total = histogram.sum()
+    background = np.cumsum(histogram)
+    foreground = total - background
+    cumulative_mean = np.cumsum(histogram * weights)
+    mean_background = cumulative_mean / np.maximum(background, 1)
+    mean_foreground = (cumulative_mean[-1] - cumulative_mean) / np.maximum(foreground, 1)
+    between = background * foreground * (mean_background - mean_foreground) ** 2
+    threshold = int(np.argmax(between))
+    return gray <= threshold
+
+
+def _smooth(profile: np.ndarray, width: int) -> np.ndarray:
+    if width <= 1:
+        return profile
+    kernel = np.ones(width) / width
+    return np.convolve(profile, kernel, mode="same")
+
+
+def _span(profile: np.ndarray, floor: float) -> Optional[Tuple[int, int]]:
+    threshold = max(floor, 0.05 * profile.max()) if profile.size else floor
+    index = np.flatnonzero(profile > threshold)
+    if index.size == 0:
+        return None
+    return int(index[0]), int(index[-1]) + 1
+
+
+def text_block(ink: np.ndarray, min_density: float = 0.005, max_density: float = 0.5,
+               smooth: int = 25, margin: float = 0.015) -> Tuple[int, int, int, int]:
+    """
+    Locate the text block of a binarised page with projection profiles.
+    Rows and columns that are mostly ink (binding shadow, ruled borders, scanner
+    edges) are ignored, the remaining ink is projected onto each axis, and the
+    block is the span where the smoothed profile rises above the noise floor.
+    Returns:
+        (left, top, right, bottom) in pixels, padded by `margin` of the page size.
+    """
+    height, width = ink.shape
+    ink = ink.copy()
+    ink[:, ink.mean(axis=0) > max_density] = False
+    ink[ink.mean(axis=1) > max_density, :] = False
+
+    rows = _span(_smooth(ink.mean(axis=1), smooth), min_density)
+    cols = _span(_smooth(ink.mean(axis=0), smooth), min_density)
+    if rows is None or cols is None:
+        return 0, 0, width, height
+    pad_y, pad_x = int(height * margin), int(width * margin)
+    return (max(0, cols[0] - pad_x), max(0, rows[0] - pad_y),
+            min(width, cols[1] + pad_x), min(height, rows[1] + pad_y))
+
+
+def band_cuts(ink: np.ndarray, bands: int, overlap: float = 0.04, search: float = 0.08) -> List[Tuple[int, int]]:
+    """
+    Split rows into `bands` horizontal bands that overlap by `overlap` of the height.
+    Each cut is moved to the emptiest row within `search` of its ideal position
+    so that it falls between lines of handwriting where possible.
+    """
+    height = ink.shape[0]
+    if bands <= 1:
+        return [(0, height)]
+    profile = _smooth(ink.mean(axis=1), 9)
+    window = int(height * search)
+    cuts = [0]
+    for i in range(1, bands):
+        ideal = height * i // bands
+        low, high = max(cuts[-1] + 1, ideal - window), min(height - 1, ideal + window)
+        cuts.append(low + int(np.argmin(profile[low:high])) if high > low else ideal)
+    cuts.append(height)
+    pad = int(height * overlap / 2)
+    return [(max(0, top - pad), min(height, bottom + pad)) for top, bottom in zip(cuts[:-1], cuts[1:])]
+
+
+def crop_page(image: Image.Image, bands: int = 1, **block_kwargs) -> Dict[str, Any]:
+    """
+    Crop a grayscale page to its text block and optionally split it into bands.
+    Returns:
+        {"images": [PIL images], "bbox": (left, top, right, bottom), "bands": [(top, bottom), ...]}
+    """
+    gray = np.asarray(image.convert('L'))
+    ink = binarise(gray)
+    left, top, right, bottom = text_block(ink, **block_kwargs)
+    cropped = image.crop((left, top, right, bottom))
+    cuts = band_cuts(ink[top:bottom, left:right], bands)
+    images = [cropped] if len(cuts) == 1 else [cropped.crop((0, t, cropped.width, b)) for t, b in cuts]
+    return {"images": images, "bbox": (left, top, right, bottom), "bands": cuts}
+
+
+def _png_size(image: Image.Image, max_edge: Optional[int]) -> Tuple[int, Tuple[int, int]]:
+    image = image.copy()
+    if max_edge and max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    return len(buffered.getvalue()), image.size
+
+
+def measure_page(file_path, bands: int = 1, max_edge: Optional[int] = API_MAX_EDGE) -> Dict[str, Any]:
+    # Upload bytes and image tokens of a page before and after cropping/banding
+    with Image.open(file_path) as image:
+        image = image.convert('L')
+    start = time.perf_counter()
+    layout = crop_page(image, bands=bands)
+    crop_seconds = time.perf_counter() - start
+
+    full_bytes, full_size = _png_size(image, max_edge)
+    cropped = [_png_size(band, max_edge) for band in layout["images"]]
+    full_tokens = estimate_image_tokens(*full_size)
+    cropped_tokens = sum(estimate_image_tokens(*size) for _, size in cropped)
+    cropped_bytes = sum(size for size, _ in cropped)
+    return {
+        "file_path": str(file_path),
+        "bbox": layout["bbox"],
+        "area_kept": ((layout["bbox"][2] - layout["bbox"][0]) * (layout["bbox"][3] - layout["bbox"][1]))
+                     / (image.width * image.height),
+        "bytes_before": full_bytes,
+        "bytes_after": cropped_bytes,
+        "bytes_saved": full_bytes - cropped_bytes,
+        "tokens_before": full_tokens,
+        "tokens_after": cropped_tokens,
+        "tokens_saved": full_tokens - cropped_tokens,
+        "crop_seconds": crop_seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark text-block cropping on a directory of page scans.")
+    parser.add_argument("image_dir")
+    parser.add_argument("--bands", type=int, default=1)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--output", default=None, help="Write per-page results as JSON")
+    args = parser.parse_args()
+
+    names = sorted(n for n in os.listdir(args.image_dir) if n.lower().endswith((".tif", ".tiff")))[:args.limit]
+    results = [measure_page(os.path.join(args.image_dir, name), bands=args.bands) for name in names]
+    for r in results:
+        print(f"{os.path.basename(r['file_path'])}: kept {r['area_kept']:.0%} of the page, "
+              f"{r['bytes_saved'] / 1024:.0f} KiB and {r['tokens_saved']} tokens saved")
+    if results:
+        before = sum(r["bytes_before"] for r in results)
+        after = sum(r["bytes_after"] for r in results)
+        tokens_before = sum(r["tokens_before"] for r in results)
+        tokens_after = sum(r["tokens_after"] for r in results)
+        print(f"{len(results)} pages: {before / 2 ** 20:.1f} -> {after / 2 ** 20:.1f} MiB, "
+              f"{tokens_before} -> {tokens_after} image tokens, "
+              f"{sum(r['crop_seconds'] for r in results) / len(results) * 1000:.0f} ms/page to crop")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
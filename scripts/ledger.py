@@ -0,0 +1,376 @@
+import io
+import os
+import json
+import time
+import uuid
+import zlib
+import socket
+import sqlite3
+import argparse
+import tempfile
+import threading
+import multiprocessing
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from scripts.extract import get_file_id, store_json
+
+DEFAULT_LEASE_SECONDS = 900.0
+DEFAULT_MAX_ATTEMPTS = 3
+STATUSES = ("pending", "leased", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    file_id TEXT PRIMARY KEY,
+    file_path TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL
+);
+CREATE INDEX IF NOT EXISTS pages_shard_status ON pages(shard, status);
+CREATE INDEX IF NOT EXISTS pages_status_lease ON pages(status, lease_expires);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def shard_of(file_id: str, num_shards: int) -> int:
+    # A stable hash, unlike hash(), so every node and every run agrees on the owner of a page
+    return zlib.crc32(file_id.encode("utf-8")) % num_shards
+
+
+def array_task() -> Tuple[int, int]:
+    """
+    (shard, num_shards) of the current SGE array task, from SGE_TASK_ID,
+    SGE_TASK_FIRST, SGE_TASK_LAST and SGE_TASK_STEPSIZE; (0, 1) outside an array job.
+    """
+    task_id = os.getenv("SGE_TASK_ID")
+    if not task_id or task_id == "undefined":
+        return 0, 1
+    first = int(os.getenv("SGE_TASK_FIRST", "1"))
+    last = int(os.getenv("SGE_TASK_LAST", task_id))
+    step = int(os.getenv("SGE_TASK_STEPSIZE", "1"))
+    return (int(task_id) - first) // step, (last - first) // step + 1
+
+
+class JobLedger:
+    """
+    SQLite ledger of the pages of a book, shared by every task of an array
+    job. Each task leases pages of its own shard, renews its leases
+    while it works and marks each page done or failed; a lease that is not
+    renewed (the node died) expires and the page is handed out again.
+    A ledger covers one book and output directory: a task that takes over
+    another shard's expired lease writes that page to its own output_dir.
+    The database runs in WAL mode so that readers never block the writer. WAL
+    needs shared memory between the processes using it, so on a network
+    filesystem where that is not supported pass journal_mode="DELETE".
+    """
+
+    def __init__(self, db_path: str, shard: int = 0, num_shards: int = 1,
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS, max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+                 owner: Optional[str] = None, journal_mode: str = "WAL", timeout: float = 60.0):
+        if not 0 <= shard < num_shards:
+            raise ValueError(f"shard {shard} is outside 0..{num_shards - 1}")
+        self.db_path = db_path
+        self.shard = shard
+        self.num_shards = num_shards
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.journal_mode = journal_mode
+        self.timeout = timeout
+        self._local = threading.local()
+        self._heartbeat = None
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread; transactions are opened explicitly
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+            conn.execute(f"PRAGMA journal_mode={self.journal_mode}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, sql_steps):
+        # BEGIN IMMEDIATE takes the write lock up front, so two tasks never lease the same page
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = sql_steps(conn)
+            conn.execute("COMMIT")
+            return result
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def register(self, file_paths: Iterable, done: Optional[Set[str]] = None) -> int:
+        """
+        Add pages to the ledger; pages already in it are left as they are.
+        Args:
+            file_paths: Page images.
+            done: File IDs whose output already exists; they are recorded as done.
+        Returns:
+            The number of pages added.
+        """
+        done = done or set()
+        now = time.time()
+        # Absolute paths: tasks on other nodes start in other working directories
+        rows = [(get_file_id(p), os.path.abspath(p), shard_of(get_file_id(p), self.num_shards),
+                 "done" if get_file_id(p) in done else "pending", now) for p in file_paths]
+
+        def steps(conn):
+            stored = conn.execute("SELECT value FROM meta WHERE key = 'num_shards'").fetchone()
+            if stored is not None and int(stored[0]) != self.num_shards:
+                # The array was resized: re-shard, and leases held under the old layout stay valid until they expire
+                conn.create_function("shard_of", 2, shard_of, deterministic=True)
+                conn.execute("UPDATE pages SET shard = shard_of(file_id, ?)", (self.num_shards,))
+            conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('num_shards', ?)", (str(self.num_shards),))
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO pages(file_id, file_path, shard, status, updated) "
+                             "VALUES (?, ?, ?, ?, ?)", rows)
+            added = conn.total_changes - before
+            conn.executemany("UPDATE pages SET status = 'done', updated = ? WHERE file_id = ? AND status = 'pending'",
+                             [(now, file_id) for file_id in done])
+            return added
+        return self._transaction(steps)
+
+    def lease(self, limit: int = 1, steal: bool = True) -> List[Tuple[str, str]]:
+        """
+        Lease up to `limit` pages: pending pages of this task's shard first,
+        then, with `steal`, pages of any shard whose lease has expired. Pages
+        whose lease already expired max_attempts times are marked failed
+        instead of being handed out again.
+        Returns:
+            (file_id, file_path) pairs, empty once nothing is left to lease.
+        """
+        def steps(conn):
+            now = time.time()
+            conn.execute("UPDATE pages SET status = 'failed', error = 'lease expired ' || attempts || ' times', "
+                         "owner = NULL, updated = ? WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                         (now, now, self.max_attempts))
+            rows = conn.execute(
+                "SELECT file_id, file_path FROM pages WHERE shard = ? AND "
+                "(status = 'pending' OR (status = 'leased' AND lease_expires < ?)) ORDER BY file_id LIMIT ?",
+                (self.shard, now, limit)).fetchall()
+            if not rows and steal:
+                rows = conn.execute(
+                    "SELECT file_id, file_path FROM pages WHERE status = 'leased' AND lease_expires < ? "
+                    "ORDER BY lease_expires LIMIT ?", (now, limit)).fetchall()
+            conn.executemany(
+                "UPDATE pages SET status = 'leased', owner = ?, lease_expires = ?, attempts = attempts + 1, "
+                "updated = ? WHERE file_id = ?",
+                [(self.owner, now + self.lease_seconds, now, file_id) for file_id, _ in rows])
+            return rows
+        return self._transaction(steps)
+
+    def iter_leases(self, batch_size: int = 8, steal: bool = True) -> Iterator[Tuple[str, str]]:
+        # Lease pages a batch at a time until the shard (and any expired lease) is exhausted
+        while True:
+            rows = self.lease(batch_size, steal=steal)
+            if not rows:
+                return
+            yield from rows
+
+    def renew(self) -> int:
+        # Push back the expiry of every lease this owner holds
+        def steps(conn):
+            now = time.time()
+            return conn.execute("UPDATE pages SET lease_expires = ?, updated = ? WHERE owner = ? AND status = 'leased'",
+                                (now + self.lease_seconds, now, self.owner)).rowcount
+        return self._transaction(steps)
+
+    def complete(self, file_id: str) -> bool:
+        """
+        Mark a page this owner leased as done.
+        Returns:
+            False if the lease was lost (it expired and another task took the
+            page), in which case the page is left to that task.
+        """
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE pages SET status = 'done', owner = NULL, lease_expires = NULL, error = NULL, updated = ? "
+            "WHERE file_id = ? AND owner = ?", (time.time(), file_id, self.owner)).rowcount) == 1
+
+    def fail(self, file_id: str, error: str) -> bool:
+        """
+        Record a failed attempt at a page this owner leased (an API error, an
+        unparseable response). The page goes back to pending until it has been
+        leased max_attempts times, and is marked failed after that.
+        Returns:
+            False if the lease was lost to another task, as complete().
+        """
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE pages SET status = CASE WHEN attempts < ? THEN 'pending' ELSE 'failed' END, owner = NULL, "
+            "lease_expires = NULL, error = ?, updated = ? WHERE file_id = ? AND owner = ?",
+            (self.max_attempts, error, time.time(), file_id, self.owner)).rowcount) == 1
+
+    def resume(self, all_shards: bool = False) -> int:
+        """
+        Make failed pages and expired leases of this shard (or of every shard)
+        pending again with a fresh attempt count. Done pages are never redone.
+        Returns:
+            The number of pages reset.
+        """
+        def steps(conn):
+            now = time.time()
+            where = "(status = 'failed' OR (status = 'leased' AND lease_expires < ?))"
+            params = [now]
+            if not all_shards:
+                where += " AND shard = ?"
+                params.append(self.shard)
+            return conn.execute(f"UPDATE pages SET status = 'pending', owner = NULL, lease_expires = NULL, "
+                                f"attempts = 0, error = NULL, updated = ? WHERE {where}", [now] + params).rowcount
+        return self._transaction(steps)
+
+    def counts(self, shard: Optional[int] = None) -> Dict[str, int]:
+        query = "SELECT status, COUNT(*) FROM pages"
+        params = ()
+        if shard is not None:
+            query += " WHERE shard = ?"
+            params = (shard,)
+        counts = dict.fromkeys(STATUSES, 0)
+        counts.update(self._conn().execute(query + " GROUP BY status", params).fetchall())
+        return counts
+
+    def failures(self) -> List[Tuple[str, str]]:
+        return self._conn().execute("SELECT file_id, error FROM pages WHERE status = 'failed' ORDER BY file_id").fetchall()
+
+    def start_heartbeat(self, interval: Optional[float] = None):
+        """
+        Renew this owner's leases from a daemon thread every lease_seconds / 3
+        until stop_heartbeat(). A renewal that fails (the ledger stayed locked
+        past the timeout, a network filesystem hiccup) is reported and retried
+        at the next beat, so one bad moment does not cost every lease.
+        """
+        stop = threading.Event()
+        interval = interval or self.lease_seconds / 3
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    self.renew()
+                except sqlite3.OperationalError as e:
+                    print(f"Could not renew the leases of {self.owner}: {e}")
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        self._heartbeat = (stop, thread)
+
+    def stop_heartbeat(self):
+        if self._heartbeat is not None:
+            stop, thread = self._heartbeat
+            stop.set()
+            thread.join()
+            self._heartbeat = None
+
+
+def _simulated_worker(db_path: str, input_dir: str, output_dir: str, shard: int, num_shards: int,
+                      lease_seconds: float, work_seconds: float, calls_path: str, crash_after: Optional[int]):
+    # Stands in for a batch.py array task: every "API call" is appended to calls_path
+    ledger = JobLedger(db_path, shard, num_shards, lease_seconds=lease_seconds)
+    ledger.register(sorted(Path(input_dir).iterdir()))
+    ledger.start_heartbeat()
+    for count, (file_id, file_path) in enumerate(ledger.iter_leases(batch_size=2)):
+        with open(calls_path, "a", encoding="utf-8") as calls_file:
+            calls_file.write(f"{file_id}\n")
+        if crash_after is not None and count == crash_after:
+            os._exit(1)  # Dies mid-page, holding its leases
+        time.sleep(work_seconds)
+        with redirect_stdout(io.StringIO()):
+            store_json(file_path, output_dir, {"file_id": file_id, "owner": ledger.owner})
+        if not ledger.complete(file_id):
+            with open(calls_path + ".lost", "a", encoding="utf-8") as lost_file:
+                lost_file.write(f"{file_id}\n")
+    ledger.stop_heartbeat()
+
+
+def simulate(workers: int = 4, pages: int = 200, work_seconds: float = 0.01, lease_seconds: float = 2.0,
+             crash: int = 1) -> Dict[str, Any]:
+    """
+    Exercise the ledger with local multiprocessing workers, as an array job
+    on shared storage would. The first `crash` workers die part-way through;
+    once their leases expire the array is run again, which picks the stranded
+    pages up. Every page must end up done with exactly one complete JSON file.
+    Returns:
+        Page, call and output counts, and whether the run was consistent.
+    """
+    with tempfile.TemporaryDirectory(prefix="deeds-ledger-") as work_dir:
+        input_dir, output_dir = os.path.join(work_dir, "in"), os.path.join(work_dir, "out")
+        os.makedirs(input_dir)
+        os.makedirs(output_dir)
+        for i in range(pages):
+            Path(input_dir, f"000001-{i + 1:04d}.tif").touch()
+        db_path = os.path.join(work_dir, "ledger.sqlite")
+        calls_path = os.path.join(work_dir, "calls.log")
+        context = multiprocessing.get_context("spawn")
+
+        def run_array(crashing: int):
+            processes = [context.Process(target=_simulated_worker, args=(
+                db_path, input_dir, output_dir, shard, workers, lease_seconds, work_seconds, calls_path,
+                pages // workers // 3 if shard < crashing else None)) for shard in range(workers)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            return sum(process.exitcode != 0 for process in processes)
+
+        start = time.perf_counter()
+        crashed = run_array(crash)
+        time.sleep(lease_seconds * 1.5)
+        run_array(0)
+        elapsed = time.perf_counter() - start
+
+        ledger = JobLedger(db_path, 0, workers)
+        with open(calls_path, "r", encoding="utf-8") as calls_file:
+            calls = calls_file.read().split()
+        lost = []
+        if os.path.exists(calls_path + ".lost"):
+            with open(calls_path + ".lost", "r", encoding="utf-8") as lost_file:
+                lost = lost_file.read().split()
+        outputs = [name for name in os.listdir(output_dir) if name.endswith(".json")]
+        complete = 0
+        for name in outputs:
+            with open(os.path.join(output_dir, name), "r", encoding="utf-8") as output_file:
+                complete += json.load(output_file)["file_id"] == name[:-len(".json")]
+        counts = ledger.counts()
+        return {
+            "pages": pages, "workers": workers, "crashed_workers": crashed, "elapsed_seconds": elapsed,
+            "ledger": counts, "calls": len(calls), "repeated_calls": len(calls) - len(set(calls)),
+            "outputs": len(outputs), "complete_outputs": complete, "lost_leases": len(lost),
+            "temp_files_left": sum(name.endswith(".tmp") for name in os.listdir(output_dir)),
+            "consistent": counts["done"] == pages and complete == pages == len(set(calls)),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or reset the job ledger shared by array tasks.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    status_parser = subparsers.add_parser("status", help="Page counts per status, and the failed pages")
+    status_parser.add_argument("ledger")
+    resume_parser = subparsers.add_parser("resume", help="Make failed pages and expired leases pending again")
+    resume_parser.add_argument("ledger")
+    simulate_parser = subparsers.add_parser("simulate", help="Check the coordination with local worker processes")
+    simulate_parser.add_argument("--workers", type=int, default=4)
+    simulate_parser.add_argument("--pages", type=int, default=200)
+    simulate_parser.add_argument("--crash", type=int, default=1, help="Workers killed part-way through")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        ledger = JobLedger(args.ledger)
+        print(", ".join(f"{status} {count}" for status, count in ledger.counts().items()))
+        for file_id, error in ledger.failures():
+            print(f"  {file_id}: {error}")
+    elif args.command == "resume":
+        print(f"Reset {JobLedger(args.ledger).resume(all_shards=True)} pages to pending")
+    else:
+        result = simulate(workers=args.workers, pages=args.pages, crash=args.crash)
+        print(json.dumps(result, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,94 @@
 import os
-import re
 import json
-import streamlit
-import pandas as pd
-from datetime import datetime
+import time
 from elasticsearch import Elasticsearch, helpers
 
+from scripts.documents import content_hash, iter_documents
+from scripts.telemetry import Telemetry
 
-def bulk_index(cloud_id: str, api_key: str, index_name: str, csv_path: str):
 
-    # Connect to Elasticsearch Cloud
-    client = Elasticsearch(
-        cloud_id, api_key = api_key
-    ) 
-    index_name = index_name
-    # Load the dataset
-    file_path = csv_path
-    df = pd.read_csv(file_path)
+# Define index mapping
+mapping = {
+    "mappings": {
+        "properties": {
+            "document_id": {"type": "keyword"},
+            "document_text": {"type": "text"},
+            "document_type": {"type": "keyword"},
+            "document_category": {"type": "keyword"},
+            "grantors": {"type": "text"},
+            "grantees": {"type": "text"},
+            "legal_authorities": {"type": "text"},
+            "acreage": {"type": "text"},
+            "acres": {"type": "float"},
+            "boundaries": {"type": "text"},
+            "lot_info": {"type": "text"},
+            "city": {"type": "text"},
+            "county": {"type": "text"},
+            "province_colony": {"type": "text"},
+            "execution_date": {"type": "date", "format": "yyyy-MM-dd"},
+            "recording_date": {"type": "date", "format": "yyyy-MM-dd"}
+        }
+    }
+}
 
 
-    # Check connection
-    if client.ping():
-        print("Connected to Elasticsearch successfully!")
-    else:
-        print("Elasticsearch connection failed.")
+def load_index_state(state_path):
+    if state_path and os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as state_file:
+            return json.load(state_file)
+    return {}
 
 
-    # Define index mapping
-    mapping = {
-        "mappings": {
-            "properties": {
-                "document_id": {"type": "keyword"},
-                "document_text": {"type": "text"},
-                "document_type": {"type": "keyword"},
-                "grantors": {"type": "text"},
-                "grantees": {"type": "text"},
-                "legal_authorities": {"type": "text"},
-                "acreage": {"type": "text"},
-                "boundaries": {"type": "text"},
-                "lot_info": {"type": "text"},
-                "city": {"type": "text"},
-                "county": {"type": "text"},
-                "province_colony": {"type": "text"},
-                "execution_date": {"type": "date", "format": "yyyy-MM-dd"},
-                "recording_date": {"type": "date", "format": "yyyy-MM-dd"}
-            }
-        }
-    }
+def save_index_state(state_path, state):
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file)
+    os.replace(tmp_path, state_path)
 
 
-    # Function to clean and standardize date format
-    def clean_date(date_str):
-        if pd.isna(date_str) or "Not specified" in str(date_str):
-            return None  # Return None for missing or invalid dates
-        try:
-            return datetime.strptime(date_str, "%B %d, %Y").strftime("%Y-%m-%d")  # Convert to YYYY-MM-DD format
-        except ValueError:
-            return None  # Return None if format is unrecognized
+def item_document_id(item) -> str:
+    # The response item names the document, except for some transport-level failures; the action's source always does
+    doc_id = item.get("_id")
+    if doc_id is None and isinstance(item.get("data"), dict):
+        doc_id = item["data"].get("document_id")
+    return doc_id
 
-    # Apply cleaning functions to date columns
-    df["Execution Date"] = df["Execution Date"].apply(clean_date)
-    df["Recording Date"] = df["Recording Date"].apply(clean_date)
 
-    # Replace NaN values with empty strings where applicable
-    df.fillna("", inplace=True)
+def bulk_index(cloud_id: str, api_key: str, index_name: str, csv_path: str, client=None,
+               chunk_size: int = 500, thread_count: int = 4, max_chunk_bytes: int = 10 * 1024 * 1024,
+               read_chunk_size: int = 5000, state_path: str = None, force: bool = False,
+               telemetry: Telemetry = None):
+    """
+    Index the consolidated deeds table into Elasticsearch.
+    The table is read in chunks with dates converted per column, documents are
+    sent through helpers.parallel_bulk, and a content hash per document is kept
+    in a state file so that unchanged documents are skipped on the next run.
+    Args:
+        cloud_id, api_key: Elastic Cloud credentials, ignored when client is given.
+        index_name: Target index, created with the mapping above if missing.
+        csv_path: Consolidated CSV or Parquet file.
+        client: Optional Elasticsearch/OpenSearch client (local container or stub transport).
+        chunk_size, thread_count, max_chunk_bytes: Passed to helpers.parallel_bulk.
+        read_chunk_size: Rows read from the table at a time.
+        state_path: Content hash state, defaults to <csv_path>.<index_name>.state.json.
+        force: Re-send every document regardless of the saved state.
+        telemetry: Records the run as a "bulk_index" span with its counts, and an event per failed document.
+    Returns:
+        A dictionary with indexed/skipped/failed counts and throughput.
+    """
+
+    # Connect to Elasticsearch Cloud
+    if client is None:
+        client = Elasticsearch(
+            cloud_id, api_key = api_key
+        )
+
+
+    # Check connection
+    if client.ping():
+        print("Connected to Elasticsearch successfully!")
+    else:
+        print("Elasticsearch connection failed.")
 
 
     # Create index if it doesn't exist
@@ -73,30 +98,51 @@ def bulk_index(cloud_id: str, api_key: str, index_name: str, csv_path: str):
     else:
         print(f"Index '{index_name}' already exists.")
 
+    state_path = state_path or f"{csv_path}.{index_name}.state.json"
+    state = {} if force else load_index_state(state_path)
+    pending = {}
+    stats = {"indexed": 0, "skipped": 0, "failed": 0}
+    errors = []
+
     # Prepare documents for bulk indexing
-    def generate_docs(df):
-        for _, row in df.iterrows():
-            yield {
-                "_index": index_name,
-                "_id": row["Document ID"],
-                "_source": {
-                    "document_id": row["Document ID"],
-                    "document_text": row["Document Text"],
-                    "document_type": row["Document Type"],
-                    "grantors": row["Grantors"],
-                    "grantees": row["Grantees"],
-                    "legal_authorities": row["Legal Authorities"],
-                    "acreage": row["Acreage"],
-                    "boundaries": row["Boundaries"],
-                    "lot_info": row["Lot Info"],
-                    "city": row["City"],
-                    "county": row["County"],
-                    "province_colony": row["Province/Colony"],
-                    "execution_date": row["Execution Date"],
-                    "recording_date": row["Recording Date"]
-                }
-            }
+    def generate_docs():
+        for source in iter_documents(csv_path, read_chunk_size):
+            doc_id = source["document_id"]
+            digest = content_hash(source)
+            if state.get(doc_id) == digest:
+                stats["skipped"] += 1
+                continue
+            pending[doc_id] = digest
+            yield {"_index": index_name, "_id": doc_id, "_source": source}
 
     # Bulk upload data
-    helpers.bulk(client, generate_docs(df))
-    print("Data indexed successfully!")
\ No newline at end of file
+    start = time.perf_counter()
+    for ok, info in helpers.parallel_bulk(client, generate_docs(), thread_count=thread_count,
+                                          chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+                                          raise_on_error=False, raise_on_exception=False):
+        item = next(iter(info.values()))
+        doc_id = item_document_id(item)
+        if ok:
+            stats["indexed"] += 1
+            state[doc_id] = pending.pop(doc_id, None)
+        else:
+            stats["failed"] += 1
+            if doc_id is not None:
+                pending.pop(doc_id, None)
+            errors.append(item)
+            if telemetry is not None:
+                telemetry.event("index_failed", page=doc_id, error=str(item.get("error")))
+    elapsed = time.perf_counter() - start
+    save_index_state(state_path, state)
+
+    stats["elapsed_seconds"] = elapsed
+    stats["docs_per_second"] = stats["indexed"] / elapsed if elapsed > 0 else 0.0
+    if telemetry is not None:
+        telemetry.record_span("bulk_index", elapsed, index=index_name, **stats)
+    print(f"Indexed {stats['indexed']} documents in {elapsed:.1f}s ({stats['docs_per_second']:.0f} docs/s), "
+          f"{stats['skipped']} unchanged, {stats['failed']} failed")
+    for item in errors[:10]:
+        print(f"Failed to index {item_document_id(item)}: {item.get('error')}")
+    if not errors:
+        print("Data indexed successfully!")
+    return stats
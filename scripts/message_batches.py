@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import argparse
+import anthropic
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from scripts.batch import list_images
+from scripts.extract import PropertyDocumentAnalyzer, get_file_id, is_already_processed, parse_components, response_text, store_json
+from scripts.preprocess import DEFAULT_MAX_BYTES, DEFAULT_MAX_EDGE, iter_encoded_pages
+
+# API limits per batch are 100,000 requests and 256 MB; stay under the size limit with some headroom
+MAX_BATCH_REQUESTS = 100_000
+MAX_BATCH_BYTES = 200 * 1024 * 1024
+
+
+def load_manifest(manifest_path) -> Dict[str, Any]:
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r", encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+    return {"batches": []}
+
+
+def save_manifest(manifest_path, manifest: Dict[str, Any]):
+    # Write-then-rename so an interrupted worker never leaves a truncated manifest
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as manifest_file:
+        json.dump(manifest, manifest_file, indent=4)
+    os.replace(tmp_path, manifest_path)
+
+
+def submitted_ids(manifest: Dict[str, Any]) -> set:
+    # Pages that already sit in a live or collected batch, minus the ones that came back failed
+    ids = set()
+    for batch in manifest["batches"]:
+        ids.update(batch["pages"])
+        ids.difference_update(batch.get("failed", {}))
+    return ids
+
+
+def submit_book(input_dir, output_dir, manifest_path, model: str, api_key: Optional[str] = None,
+                client: Optional[Any] = None, max_batch_requests: int = MAX_BATCH_REQUESTS,
+                max_batch_bytes: int = MAX_BATCH_BYTES, max_edge: Optional[int] = DEFAULT_MAX_EDGE,
+                max_bytes: Optional[int] = DEFAULT_MAX_BYTES) -> List[str]:
+    """
+    Pack every unprocessed page of a book directory into Message Batches.
+    Pages already written to output_dir, or already submitted in a batch
+    recorded in the manifest, are skipped, so calling this again after a crash
+    or after failed results only submits what is still missing.
+    Returns:
+        The IDs of the batches created by this call.
+    """
+    client = client if client is not None else anthropic.Anthropic(api_key=api_key)
+    analyzer = PropertyDocumentAnalyzer(model, api_key, client=client)
+    manifest = load_manifest(manifest_path)
+    manifest.setdefault("input_dir", str(input_dir))
+    manifest.setdefault("model", model)
+
+    skip = submitted_ids(manifest)
+    pending = [p for p in list_images(input_dir)
+               if get_file_id(p) not in skip and not is_already_processed(get_file_id(p), output_dir)]
+    print(f"Submitting {len(pending)} pages from {input_dir}")
+
+    created = []
+    requests, pages, size = [], {}, 0
+
+    def flush():
+        nonlocal requests, pages, size
+        if not requests:
+            return
+        batch = client.messages.batches.create(requests=requests)
+        manifest["batches"].append({
+            "id": batch.id,
+            "pages": pages,
+            "status": batch.processing_status,
+            "collected": False,
+            "failed": {},
+        })
+        save_manifest(manifest_path, manifest)
+        created.append(batch.id)
+        print(f"Submitted batch {batch.id} with {len(requests)} pages")
+        requests, pages, size = [], {}, 0
+
+    encoded_pages = iter_encoded_pages(pending, max_edge=max_edge, max_bytes=max_bytes)
+    for page in encoded_pages:
+        if "error" in page:
+            print(f"Error processing {Path(page['file_path']).name}: {page['error']}")
+            continue
+        file_id = get_file_id(page["file_path"])
+        request = {"custom_id": file_id, "params": analyzer.build_request(page["file_path"], page)}
+        # base64 inflates the payload by 4/3; the prompt and JSON framing fit in the headroom
+        request_size = page["payload_bytes"] * 4 // 3 + 8192
+        if requests and (len(requests) >= max_batch_requests or size + request_size > max_batch_bytes):
+            flush()
+        requests.append(request)
+        pages[file_id] = page["file_path"]
+        size += request_size
+    flush()
+    return created
+
+
+def poll(manifest_path, client: Optional[Any] = None, api_key: Optional[str] = None) -> bool:
+    """
+    Refresh the processing status of every batch in the manifest.
+    Returns:
+        True once every batch has ended.
+    """
+    client = client if client is not None else anthropic.Anthropic(api_key=api_key)
+    manifest = load_manifest(manifest_path)
+    for batch in manifest["batches"]:
+        if batch["status"] != "ended":
+            batch["status"] = client.messages.batches.retrieve(batch["id"]).processing_status
+    save_manifest(manifest_path, manifest)
+    return all(batch["status"] == "ended" for batch in manifest["batches"])
+
+
+def collect(manifest_path, output_dir, client: Optional[Any] = None, api_key: Optional[str] = None) -> Dict[str, int]:
+    """
+    Write the results of every ended, not yet collected batch through store_json.
+    Pages whose result errored, expired or was canceled, or whose response could
+    not be parsed, are recorded as failed in the manifest so that the next
+    submit_book call resubmits them.
+    """
+    client = client if client is not None else anthropic.Anthropic(api_key=api_key)
+    manifest = load_manifest(manifest_path)
+    os.makedirs(output_dir, exist_ok=True)
+    counts = {"stored": 0, "failed": 0}
+    for batch in manifest["batches"]:
+        if batch["status"] != "ended" or batch["collected"]:
+            continue
+        for entry in client.messages.batches.results(batch["id"]):
+            file_path = batch["pages"].get(entry.custom_id, entry.custom_id)
+            if entry.result.type != "succeeded":
+                batch["failed"][entry.custom_id] = entry.result.type
+                counts["failed"] += 1
+                continue
+            message = entry.result.message
+            results = parse_components(response_text(message), truncated=message.stop_reason == "max_tokens")
+            if "error" in results:
+                # Never written as the page's output, so is_already_processed stays False as well
+                print(f"Error parsing {entry.custom_id}: {results['error']}")
+                batch["failed"][entry.custom_id] = results["error"]
+                counts["failed"] += 1
+                continue
+            store_json(file_path, output_dir, results)
+            counts["stored"] += 1
+        batch["collected"] = True
+        save_manifest(manifest_path, manifest)
+    print(f"Stored {counts['stored']} pages, {counts['failed']} failed")
+    return counts
+
+
+def run_book(input_dir, output_dir, manifest_path, model: str, api_key: Optional[str] = None,
+             client: Optional[Any] = None, poll_interval: float = 60.0, **submit_kwargs) -> Dict[str, int]:
+    # Submit, wait for every batch to end, then collect; safe to re-run at any point
+    client = client if client is not None else anthropic.Anthropic(api_key=api_key)
+    submit_book(input_dir, output_dir, manifest_path, model, client=client, **submit_kwargs)
+    while not poll(manifest_path, client=client):
+        time.sleep(poll_interval)
+    return collect(manifest_path, output_dir, client=client)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe a book through the Message Batches API.")
+    parser.add_argument("command", choices=["submit", "poll", "collect", "run"])
+    parser.add_argument("manifest")
+    parser.add_argument("--input-dir")
+    parser.add_argument("--output-dir")
+    parser.add_argument("--model", default="claude-3-7-sonnet-20250219")
+    parser.add_argument("--poll-interval", type=float, default=60.0)
+    args = parser.parse_args()
+    api_key = os.getenv("API_KEY")
+
+    if args.command == "submit":
+        submit_book(args.input_dir, args.output_dir, args.manifest, args.model, api_key)
+    elif args.command == "poll":
+        print("ended" if poll(args.manifest, api_key=api_key) else "in progress")
+    elif args.command == "collect":
+        collect(args.manifest, args.output_dir, api_key=api_key)
+    else:
+        run_book(args.input_dir, args.output_dir, args.manifest, args.model, api_key,
+                 poll_interval=args.poll_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+import re
+import ast
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import date
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+# Ordered: the first category with a matching keyword wins (a "mortgage deed" is a mortgage)
+DOCUMENT_CATEGORIES = [
+    ("Mortgages", ["mortgage"]),
+    ("Liens", ["lien"]),
+    ("Easements", ["easement", "agreement"]),
+    ("Plan Cards", ["plan", "map"]),
+    ("Deeds", ["deed", "conveyance", "sale", "partition", "gift", "property"]),
+]
+DEED_KEYWORDS = dict(DOCUMENT_CATEGORIES)["Deeds"]
+CATEGORY_RES = [(category, re.compile("|".join(keywords))) for category, keywords in DOCUMENT_CATEGORIES]
+
+# Columns normalize_table adds to the consolidated table
+NORMALIZED_FIELDNAMES = [
+    "Document Category", "Execution Date ISO", "Recording Date ISO", "Acres",
+    "Grantors Canonical", "Grantees Canonical", "City Canonical", "County Canonical"
+]
+
+UNITS = {
+    "zero": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+    "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15,
+    "sixteen": 16, "seventeen": 17, "eighteen": 18, "nineteen": 19,
+}
+TENS = {"twenty": 20, "thirty": 30, "forty": 40, "fourty": 40, "fifty": 50, "sixty": 60,
+        "seventy": 70, "eighty": 80, "ninety": 90}
+ORDINALS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6, "seventh": 7, "eighth": 8,
+    "ninth": 9, "tenth": 10, "eleventh": 11, "twelfth": 12, "thirteenth": 13, "fourteenth": 14,
+    "fifteenth": 15, "sixteenth": 16, "seventeenth": 17, "eighteenth": 18, "nineteenth": 19,
+    "twentieth": 20, "thirtieth": 30, "fortieth": 40, "fiftieth": 50, "sixtieth": 60,
+}
+FRACTIONS = {"half": 0.5, "quarter": 0.25, "½": 0.5, "¼": 0.25, "¾": 0.75}
+
+MONTHS = {}
+for number, spellings in enumerate([
+    "january jan jany janry janr", "february feb feby febr febry", "march mar mch marh",
+    "april apr apl aprl", "may", "june jun", "july jul", "august aug augt augst",
+    "september sep sept septr 7ber", "october oct octr octo 8ber", "november nov novr novm 9ber",
+    "december dec decr decm 10ber xber",
+], 1):
+    for spelling in spellings.split():
+        MONTHS[spelling] = number
+
+# Accession days (Old Style) of the sovereigns whose regnal years appear in the registry
+REIGNS = {
+    "william": date(1689, 2, 13),
+    "anne": date(1702, 3, 8),
+    "george i": date(1714, 8, 1),
+    "george ii": date(1727, 6, 11),
+    "george iii": date(1760, 10, 25),
+}
+REIGN_RE = re.compile(
+    r"(?P<ordinal>(?:[a-z]+[ -])?[a-z]+|\d+(?:st|nd|rd|th|d)?) year of (?:the reign of |his |her )?"
+    r"(?:(?:present |said )?(?:majesty|majestys|majesty's|sovereign|lord|lady|king|queen)\b)?"
+    r"(?P<rest>.*)"
+)
+SOVEREIGN_RE = re.compile(r"\b(george|geo|anne|william)\b\.?(?: the)? *(third|second|first|iii|ii|i|3d|2d|1st|3|2|1)?\b")
+ISO_DATE_RE = re.compile(r"(\d{4})-(\d{2})-(\d{2})")
+DATE_TOKEN_RE = re.compile(r"\d{4}\s*[/-]\s*\d{1,4}|(?:7|8|9|10)ber\b|\d+(?:\.\d+)?(?:st|nd|rd|th|d)?|[a-z]+|[½¼¾]")
+NUMBER_TOKEN_RE = re.compile(r"\d+(?:[.,]\d+)*|[a-z]+|[½¼¾]")
+
+# Square measure: 1 acre = 4 roods = 160 square rods (rods, poles and perches are the same unit)
+ACRE_UNITS = {
+    "acre": 1.0, "acres": 1.0, "acr": 1.0, "acrs": 1.0,
+    "rood": 0.25, "roods": 0.25,
+    "rod": 1 / 160, "rods": 1 / 160, "pole": 1 / 160, "poles": 1 / 160,
+    "perch": 1 / 160, "perches": 1 / 160, "perchs": 1 / 160, "pearch": 1 / 160,
+}
+
+TITLES = {
+    "mr", "mrs", "messrs", "capt", "captain", "lieut", "lieutenant", "lt", "col", "colonel", "maj", "major",
+    "dea", "deacon", "dr", "doctor", "rev", "revd", "reverend", "esq", "esqr", "esquire", "gent", "gentleman",
+    "yeoman", "widow", "ensign", "ens", "sergt", "sergeant", "serjt", "serjeant", "cornet", "hon", "honble",
+    "honourable", "honorable", "clerk", "husbandman", "cordwainer", "blacksmith", "joiner", "laborer", "labourer",
+}
+SUFFIXES = {"jr": "Jr", "jun": "Jr", "junr": "Jr", "junior": "Jr", "sr": "Sr", "sen": "Sr", "senr": "Sr", "senior": "Sr"}
+# Abbreviated given names common in the deeds
+GIVEN_NAMES = {
+    "jno": "John", "jos": "Joseph", "joseph": "Joseph", "benj": "Benjamin", "benja": "Benjamin",
+    "benjn": "Benjamin", "saml": "Samuel", "sam": "Samuel", "wm": "William", "willm": "William",
+    "thos": "Thomas", "tho": "Thomas", "jas": "James", "chas": "Charles", "eben": "Ebenezer",
+    "ebenr": "Ebenezer", "nathl": "Nathaniel", "nath": "Nathaniel", "nathll": "Nathaniel",
+    "jona": "Jonathan", "jonan": "Jonathan", "jonathn": "Jonathan", "danl": "Daniel", "richd": "Richard",
+    "edwd": "Edward", "geo": "George", "robt": "Robert", "elisha": "Elisha", "zach": "Zachariah",
+    "hezh": "Hezekiah", "jedh": "Jedidiah", "eliphl": "Eliphalet", "ephm": "Ephraim", "josh": "Joshua",
+    "matt": "Matthew", "stepn": "Stephen", "christr": "Christopher", "abm": "Abraham", "abrm": "Abraham",
+}
+PLACE_SUFFIX_RE = re.compile(r"\b(county|co|town|township|district|precinct)\b\.?", re.IGNORECASE)
+NAME_SPLIT_RE = re.compile(r"\s*(?:,|;|&|\band\b|\bwith\b)\s*", re.IGNORECASE)
+PARENTHETICAL_RE = re.compile(r"\([^)]*\)|\[[^\]]*\]")
+
+
+def normalize_column(values: pd.Series, parser: Callable) -> pd.Series:
+    """
+    Apply `parser` to a column once per distinct value and broadcast the results back.
+    Missing values map to None. The parsers below are also memoised, so a value
+    seen in an earlier chunk or column is not parsed again either.
+    """
+    codes, uniques = pd.factorize(values)
+    # Code -1 (missing) picks the trailing None
+    parsed = np.empty(len(uniques) + 1, dtype=object)
+    parsed[:-1] = [parser(value) for value in uniques]
+    parsed[-1] = None
+    return pd.Series(parsed[codes], index=values.index, dtype=object)
+
+
+def _number_words(tokens: List[str]) -> Optional[float]:
+    # "one thousand five hundred and thirty" -> 1530, "forty five" -> 45, "3.5" -> 3.5
+    total, current, seen = 0.0, 0.0, False
+    for token in tokens:
+        if token in ("and", "&"):
+            continue
+        if token[0].isdigit():
+            current += float(token.replace(",", ""))
+        elif token in UNITS:
+            current += UNITS[token]
+        elif token in TENS:
+            current += TENS[token]
+        elif token == "hundred":
+            current = (current or 1) * 100
+        elif token == "thousand":
+            total += (current or 1) * 1000
+            current = 0
+        elif token in ("a", "an"):
+            current += 1
+        else:
+            return None
+        seen = True
+    return total + current if seen else None
+
+
+def _is_number_token(token: str) -> bool:
+    return (token[0].isdigit() or token in UNITS or token in TENS
+            or token in ("hundred", "thousand", "a", "an") or token in FRACTIONS)
+
+
+@lru_cache(maxsize=65536)
+def parse_acreage(text: str) -> Optional[float]:
+    """
+    Total area in acres of a free-text acreage: "four acres three roods and
+    Eight pole" -> 4.8. Quantities may be digits or number words; roods are a
+    quarter acre and rods, poles and perches 1/160 acre. Parenthetical restatements
+    are dropped so "Six Hundred & forty acres (640 acres)" is not counted twice,
+    and several parcels are summed. Returns None when no unit is found.
+    """
+    if not isinstance(text, str):
+        return None
+    tokens = NUMBER_TOKEN_RE.findall(PARENTHETICAL_RE.sub(" ", text.lower()))
+    total, found = 0.0, False
+    number = []
+    last_factor = None
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token in ACRE_UNITS:
+            factor = ACRE_UNITS[token]
+            fraction = 0.0
+            if number and number[0] in FRACTIONS:
+                # "half an acre", "half a rood"
+                fraction, number = FRACTIONS[number[0]], number[1:]
+                quantity = fraction * (_number_words(number) or 1)
+            else:
+                quantity = _number_words(number) if number else None
+            if quantity is not None:
+                total += quantity * factor
+                found = True
+                last_factor = factor
+            number = []
+            # "two acres and a half"
+            if tokens[i + 1:i + 4] == ["and", "a", "half"] and last_factor:
+                total += 0.5 * last_factor
+                i += 3
+        elif _is_number_token(token) or (token in ("and", "&") and number and i + 1 < len(tokens)
+                                         and _is_number_token(tokens[i + 1]) and tokens[i + 1] not in ("a", "an")):
+            number.append(token)
+        else:
+            number = []
+        i += 1
+    return round(total, 4) if found else None
+
+
+def _ordinal(words: str) -> Optional[int]:
+    # "thirty second" / "thirty-second" / "32d" / "first" -> int
+    words = words.strip().replace("-", " ")
+    match = re.fullmatch(r"(\d+)(?:st|nd|rd|th|d)?", words)
+    if match:
+        return int(match.group(1))
+    parts = words.split()
+    if len(parts) == 1 and parts[0] in ORDINALS:
+        return ORDINALS[parts[0]]
+    if len(parts) == 2 and parts[0] in TENS and parts[1] in ORDINALS and ORDINALS[parts[1]] < 10:
+        return TENS[parts[0]] + ORDINALS[parts[1]]
+    return None
+
+
+def _sovereign(text: str) -> Optional[str]:
+    match = SOVEREIGN_RE.search(text)
+    if not match:
+        return None
+    name = "george" if match.group(1) in ("george", "geo") else match.group(1)
+    if name != "george":
+        return name
+    number = {"third": "iii", "iii": "iii", "3d": "iii", "3": "iii",
+              "second": "ii", "ii": "ii", "2d": "ii", "2": "ii",
+              "first": "i", "i": "i", "1st": "i", "1": "i"}.get(match.group(2) or "")
+    return f"george {number}" if number else None
+
+
+def _regnal_year(text: str, month: int, day: int) -> Optional[int]:
+    """Calendar year of `day`/`month` in "the thirty second year of His Majesty's reign, George the Second"."""
+    match = REIGN_RE.search(text)
+    if not match:
+        return None
+    # The ordinal is the last one or two words before "year of"
+    words = match.group("ordinal").split()
+    year_of_reign = _ordinal(" ".join(words[-2:])) or _ordinal(words[-1])
+    sovereign = _sovereign(match.group("rest")) or _sovereign(text)
+    if not year_of_reign or sovereign not in REIGNS:
+        return None
+    accession = REIGNS[sovereign]
+    # Regnal years run from the accession day, so dates before its anniversary fall in the next calendar year
+    before_anniversary = (month, day) < (accession.month, accession.day)
+    return accession.year + year_of_reign - 1 + (1 if before_anniversary else 0)
+
+
+@lru_cache(maxsize=65536)
+def parse_date(text: str) -> Optional[str]:
+    """
+    Parse a colonial-era date to YYYY-MM-DD.
+    Handles "May 8, 1759", "3d day of May 1754", "the twenty third of Feby 1758/9"
+    (Old Style dual years give the New Style year), abbreviated and "7ber" months,
+    years written in words ("one thousand seven hundred and fifty four") and
+    regnal years ("the 32d year of His Majesty's reign" with George I-III, Anne
+    or William named). A month and year without a day give the first of the
+    month. Dates already in YYYY-MM-DD form are returned as they are, so
+    normalising twice is harmless. Dates are kept in the calendar they were
+    written in; there is no Julian to Gregorian conversion. Returns None when
+    no date can be read.
+    """
+    if not isinstance(text, str):
+        return None
+    iso = ISO_DATE_RE.fullmatch(text.strip())
+    if iso:
+        # Already normalised; checked for a real day but, unlike pandas Timestamps, any year is allowed
+        try:
+            return date(*(int(part) for part in iso.groups())).isoformat()
+        except ValueError:
+            return None
+    lowered = text.lower().replace("'", "")
+    tokens = DATE_TOKEN_RE.findall(lowered)
+
+    month = next((MONTHS[t] for t in tokens if t in MONTHS), None)
+    if month is None:
+        return None
+
+    year = None
+    for token in tokens:
+        dual = re.fullmatch(r"(\d{4})\s*[/-]\s*(\d{1,4})", token)
+        if dual:
+            first, second = int(dual.group(1)), dual.group(2)
+            # 1758/9 or 1758/59: the second year is the New Style year
+            if str(first + 1).endswith(second):
+                year = first + 1
+            else:
+                year = first
+            break
+        if re.fullmatch(r"\d{4}", token) and 1600 <= int(token) <= 1899:
+            year = int(token)
+            break
+
+    if year is None:
+        # Year in words, e.g. "Anno Domini one thousand seven hundred and fifty four"
+        words = re.findall(r"[a-z]+", lowered)
+        for start, word in enumerate(words):
+            if word == "thousand" and start > 0 and words[start - 1] == "one":
+                run = ["one"]
+                for following in words[start:]:
+                    if following in UNITS or following in TENS or following in ("hundred", "thousand", "and"):
+                        run.append(following)
+                    else:
+                        break
+                value = _number_words(run)
+                if value and 1600 <= value <= 1899:
+                    year = int(value)
+                break
+
+    # The regnal ordinal ("the 2d year of ...") and the sovereign's number ("George the third") are not the day
+    day_tokens = tokens
+    reign = REIGN_RE.search(lowered)
+    if reign:
+        day_text = SOVEREIGN_RE.sub(" ", lowered[:reign.start("ordinal")] + " " + reign.group("rest"))
+        day_tokens = DATE_TOKEN_RE.findall(day_text)
+
+    day = None
+    for i, token in enumerate(day_tokens):
+        match = re.fullmatch(r"(\d{1,2})(?:st|nd|rd|th|d)?", token)
+        if match and 1 <= int(match.group(1)) <= 31:
+            day = int(match.group(1))
+            break
+        if token in ORDINALS or token in TENS:
+            # "third", "twenty third"; stop before the regnal ordinal ("... year of")
+            following = day_tokens[i + 1] if i + 1 < len(day_tokens) else ""
+            pair = f"{token} {following}"
+            value = _ordinal(pair) if token in TENS else ORDINALS[token]
+            after = day_tokens[i + (2 if token in TENS else 1):i + (4 if token in TENS else 3)]
+            if value and 1 <= value <= 31 and "year" not in after:
+                day = value
+                break
+
+    if year is None:
+        year = _regnal_year(lowered, month, day or 1)
+    if year is None:
+        return None
+    try:
+        return date(year, month, day or 1).isoformat()
+    except ValueError:
+        return None
+
+
+@lru_cache(maxsize=65536)
+def categorize_document(doc_type) -> str:
+    # Bucket a free-text document type into the categories used for the search filters
+    if not doc_type or not isinstance(doc_type, str):
+        return "Unknown"
+    doc_type = doc_type.lower()
+    return next((category for category, pattern in CATEGORY_RES if pattern.search(doc_type)), "Other")
+
+
+def standardize_deed(doc_type):
+    # Separate column for standardizing only Deeds (keeping "Document Type" intact)
+    if doc_type and any(word in doc_type.lower() for word in DEED_KEYWORDS):
+        return "Deeds"
+    return None
+
+
+def split_names(text: str) -> List[str]:
+    """
+    Split a party or place cell into single entries. Cells come as "A, B and C",
+    "A & B" or a stringified Python list; a trailing ", Jr." stays with its name
+    and parenthetical notes are dropped.
+    """
+    if not isinstance(text, str) or not text.strip():
+        return []
+    text = text.strip()
+    if text.startswith("["):
+        try:
+            items = ast.literal_eval(text)
+            if isinstance(items, (list, tuple)):
+                return [part for item in items for part in split_names(str(item))]
+        except (ValueError, SyntaxError):
+            text = text.strip("[]")
+    names = []
+    for part in NAME_SPLIT_RE.split(PARENTHETICAL_RE.sub(" ", text)):
+        part = part.strip(" .'\"")
+        if not part:
+            continue
+        if names and part.lower().rstrip(".") in SUFFIXES:
+            names[-1] = f"{names[-1]} {part}"
+        else:
+            names.append(part)
+    return names
+
+
+@lru_cache(maxsize=65536)
+def canonical_name(name: str) -> str:
+    """
+    Canonical form of one person's name: titles, ranks and trades dropped,
+    abbreviated given names expanded (Jno -> John, Saml -> Samuel), Junior and
+    Senior as Jr/Sr, and consistent capitalisation.
+    """
+    tokens = re.findall(r"[A-Za-z][A-Za-z']*", name)
+    words, suffix = [], None
+    for token in tokens:
+        lowered = token.lower()
+        if lowered in TITLES:
+            continue
+        if lowered in SUFFIXES:
+            suffix = SUFFIXES[lowered]
+            continue
+        if not words and lowered in GIVEN_NAMES:
+            words.append(GIVEN_NAMES[lowered])
+        else:
+            words.append(token[0].upper() + token[1:].lower())
+    if suffix and words:
+        words.append(suffix)
+    return " ".join(words)
+
+
+@lru_cache(maxsize=65536)
+def canonical_names(text: str) -> Optional[str]:
+    # A party cell as canonical names joined by ", "
+    names = [canonical_name(name) for name in split_names(text)]
+    names = [name for name in dict.fromkeys(names) if name]
+    return ", ".join(names) or None
+
+
+@lru_cache(maxsize=65536)
+def canonical_places(text: str) -> Optional[str]:
+    # "['Hampshire County', 'Hartford County']" -> "Hampshire, Hartford"
+    places = []
+    for place in split_names(text):
+        place = re.sub(r"\s+", " ", PLACE_SUFFIX_RE.sub(" ", place)).strip(" ,.")
+        if place and place.lower() not in ("not specified", "unknown", "n/a", "none"):
+            places.append(" ".join(word[0].upper() + word[1:].lower() for word in place.split()))
+    places = list(dict.fromkeys(places))
+    return ", ".join(places) or None
+
+
+def normalize_dates(dates: pd.Series) -> pd.Series:
+    return normalize_column(dates, parse_date)
+
+
+def normalize_table(table: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the NORMALIZED_FIELDNAMES columns to a consolidated table. Each source
+    column is parsed once per distinct value, so the cost follows the number of
+    distinct towns, parties and dates rather than the number of rows.
+    """
+    table = table.copy()
+    table["Document Category"] = normalize_column(table["Document Type"], categorize_document)
+    table["Execution Date ISO"] = normalize_dates(table["Execution Date"])
+    table["Recording Date ISO"] = normalize_dates(table["Recording Date"])
+    table["Acres"] = normalize_column(table["Acreage"], parse_acreage)
+    table["Grantors Canonical"] = normalize_column(table["Grantors"], canonical_names)
+    table["Grantees Canonical"] = normalize_column(table["Grantees"], canonical_names)
+    table["City Canonical"] = normalize_column(table["City"], canonical_places)
+    table["County Canonical"] = normalize_column(table["County"], canonical_places)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report how many values of a consolidated table normalise.")
+    parser.add_argument("table", help="Consolidated CSV or Parquet")
+    args = parser.parse_args()
+
+    table = pd.read_parquet(args.table) if args.table.endswith(".parquet") else pd.read_csv(args.table, dtype=str)
+    normalized = normalize_table(table)
+    for target, source in [("Execution Date ISO", "Execution Date"), ("Recording Date ISO", "Recording Date"),
+                           ("Acres", "Acreage")]:
+        present = table[source].notna().sum()
+        parsed = normalized[target].notna().sum()
+        print(f"{source}: {parsed}/{present} parsed")
+    for column in ["Grantors", "Grantees", "City", "County"]:
+        print(f"{column}: {table[column].nunique()} distinct values -> "
+              f"{normalized[f'{column} Canonical'].nunique()} canonical")
+
+
+if __name__ == "__main__":
+    main()
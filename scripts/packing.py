@@ -0,0 +1,379 @@
+import os
+import re
+import copy
+import json
+import argparse
+import anthropic
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from scripts.batch import AdaptiveLimiter, call_with_retries, list_images
+from scripts.cache import PACKED_ID_PREFIX, ResponseCache
+from scripts.extract import SYSTEM_PROMPT, MAX_TOKENS, get_file_id, is_already_processed, response_text, store_json
+from scripts.parsing import ParseStats, parse_response, validate
+from scripts.preprocess import DEFAULT_MAX_BYTES, DEFAULT_MAX_EDGE, iter_encoded_pages, page_images
+from scripts.telemetry import Telemetry, usage_attrs
+
+# Scan names are <book>-<page>, e.g. 000001-0002.TIF
+FILE_ID_RE = re.compile(r"^(\d+)-(\d+)$")
+DEFAULT_WINDOW = 4
+# Output budget grows with the window, up to this cap
+MAX_PACKED_TOKENS = 16000
+DEFAULT_MAX_RETRIES = 5
+
+# Identical for every request so it can be served from the prompt cache. Together with
+# SYSTEM_PROMPT it must stay above the minimum cacheable prefix (1024 tokens on Sonnet
+# and Opus, 2048 on Haiku); shorter prefixes are silently sent uncached.
+MIN_CACHEABLE_TOKENS = 1024
+PACKED_INSTRUCTIONS = """
+You will be given several consecutive page images from one book of a colonial Massachusetts registry of deeds. Each image is preceded by a label with its page ID. A single deed may start part-way down one page and continue onto the next, and one page may hold the end of one deed and the start of another.
+
+For each page:
+STEP 0: Extract the full text of the handwritten page exactly as written, preserving the original spelling.
+
+Then, reading the pages together, for each document (deed, easement, mortgage, lien, plan card, etc.) that appears on them:
+STEP 1: Determine the Document Type. Look for key terms that indicate if this is a deed, easement, mortgage, lien, plan card, etc.
+STEP 2: Identify Grantors & Grantees, typically found near phrases like "conveyed by," "granted to," "transferred from."
+STEP 3: Identify Legal Authorities: judges, witnesses, notaries, registers or other officials, especially in signature blocks and acknowledgements.
+STEP 4: Extract Property Descriptions: acreage, boundaries, lot numbers, often in surveyor's language.
+STEP 5: Collect Geographical References: cities, counties, streets and other location identifiers.
+STEP 6: Extract Transaction Dates: execution date, recording date and any other significant dates.
+STEP 7: Note which page IDs the document spans, whether it begins before the first page shown (continues_from_previous) and whether it runs past the last page shown (continues_on_next).
+
+Reading the hand:
+- The long s (ſ) is an s: "poſseſsion" is "possession". Write it as s.
+- "ye", "yt", "ym" and "wch" are "the", "that", "them" and "which"; keep them as written in document_text but use the full words when they form part of a name or place.
+- Abbreviated given names are common: Jno (John), Wm (William), Saml (Samuel), Thos (Thomas), Benja or Benjn (Benjamin), Jona (Jonathan), Nathl (Nathaniel), Ebenr (Ebenezer), Danl (Daniel), Richd (Richard), Edwd (Edward), Robt (Robert). Give names as written in the text and in the party lists.
+- Superscript endings ("Esqr", "Junr", "recd") belong to the word before them.
+- Months may be written 7ber, 8ber, 9ber and 10ber for September to December. Years may be dual ("1745/6") between 1 January and 25 March; copy both parts.
+- Dates are often given in words and by the reign: "the fifth day of June in the first year of His Majesty's Reign, Anno Domini 1761". Record the date as written.
+- Land is measured in acres, roods (a quarter acre) and rods, poles or perches (a hundred and sixtieth of an acre). Boundaries run by compass points, rods and marked trees or stakes and stones; keep every call in order.
+- The recording note ("Recd & Recorded ... Edw. Pynchon, Regr") usually closes a deed and gives the recording date and the register; the acknowledgement before a Justice of the Peace usually precedes it.
+- Marginal notes (book and page references, the grantee's name) are not part of the deed text unless they continue it.
+- Where a word cannot be read, write [illegible] rather than guessing; where a page is blank, give an empty document_text.
+
+How pages and documents relate:
+- Every page shown gets one entry in "pages", in the order shown, with exactly the page ID from its label.
+- A deed that starts on page A and ends on page B is one document with "pages": [A, B], not two.
+- The first page often begins mid-deed: that fragment is a document with continues_from_previous true. Fill in whatever parties, dates and boundaries it shows; leave the rest empty.
+- The last page often ends mid-deed: set continues_on_next true for that document.
+- Do not merge two deeds because they share parties; a new deed starts with its own opening ("Know all men by these presents", "To all people to whom these presents shall come", "This Indenture").
+
+For example, two pages where a deed from John Ely to Caleb Ely begins at the foot of the first page and ends on the second, after the end of an earlier deed, would be answered with:
+```json
+{
+    "pages": [
+        {"file_id": "000001-0096", "document_text": "...and Recorded March 3d 1756 Edw. Pynchon Regr. Know all men by these presents that I John Ely of Springfield..."},
+        {"file_id": "000001-0097", "document_text": "...bounded Northerly on Land of Sam'l Ely... Recd & Recorded May 17th 1758 Edw. Pynchon Regr."}
+    ],
+    "documents": [
+        {"pages": ["000001-0096"], "continues_from_previous": true, "continues_on_next": false, "document_text": "...and Recorded March 3d 1756 Edw. Pynchon Regr.", "document_type": "", "grantors": [], "grantees": [], "legal_authorities": ["Edw. Pynchon, Register"], "property_description": {"acreage": "", "boundaries": [], "lot_info": ""}, "geographical_references": {"city": "", "county": "", "streets": []}, "transaction_dates": {"execution_date": "", "recording_date": "March 3, 1756", "other_dates": []}},
+        {"pages": ["000001-0096", "000001-0097"], "continues_from_previous": false, "continues_on_next": false, "document_text": "Know all men by these presents that I John Ely of Springfield... Recd & Recorded May 17th 1758 Edw. Pynchon Regr.", "document_type": "Deed of Conveyance", "grantors": ["John Ely"], "grantees": ["Caleb Ely"], "legal_authorities": ["Edw. Pynchon, Register"], "property_description": {"acreage": "Ten acres", "boundaries": ["Northerly on Land of Sam'l Ely"], "lot_info": ""}, "geographical_references": {"city": "Springfield", "county": "Hampshire", "streets": []}, "transaction_dates": {"execution_date": "", "recording_date": "May 17, 1758", "other_dates": []}}
+    ]
+}
+```
+
+Respond with only a JSON object of this form:
+```json
+{
+    "pages": [
+        {"file_id": "", "document_text": ""}
+    ],
+    "documents": [
+        {
+            "pages": [],
+            "continues_from_previous": false,
+            "continues_on_next": false,
+            "document_text": "",
+            "document_type": "",
+            "grantors": [],
+            "grantees": [],
+            "legal_authorities": [],
+            "property_description": {"acreage": "", "boundaries": [], "lot_info": ""},
+            "geographical_references": {"city": "", "county": "", "streets": []},
+            "transaction_dates": {"execution_date": "", "recording_date": "", "other_dates": []}
+        }
+    ]
+}
+```
+"""
+
+
+def parse_file_id(file_id: str) -> Optional[Tuple[int, int]]:
+    match = FILE_ID_RE.match(file_id)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def build_page_index(file_paths) -> Dict[Any, List[Tuple[int, Any]]]:
+    """
+    Order scans by (book, page) from their file IDs.
+    Returns {book: [(page, path), ...]} with pages sorted; files whose names do
+    not follow the <book>-<page> pattern each get a book of their own.
+    """
+    index = {}
+    for file_path in file_paths:
+        file_id = get_file_id(file_path)
+        parsed = parse_file_id(file_id)
+        book, page = parsed if parsed else (file_id, 0)
+        index.setdefault(book, []).append((page, file_path))
+    for pages in index.values():
+        pages.sort()
+    return index
+
+
+def page_windows(file_paths, window: int = DEFAULT_WINDOW) -> Iterator[List[Any]]:
+    # Groups of up to `window` adjacent pages; a missing page number always starts a new group
+    for _, pages in sorted(build_page_index(file_paths).items(), key=lambda item: str(item[0])):
+        group, previous = [], None
+        for page, file_path in pages:
+            if group and (len(group) == window or page != previous + 1):
+                yield group
+                group = []
+            group.append(file_path)
+            previous = page
+        if group:
+            yield group
+
+
+def build_packed_request(model: str, encoded_pages: List[Dict[str, Any]]) -> Dict[str, Any]:
+    content = []
+    for page in encoded_pages:
+        content.append({"type": "text", "text": f"Page {get_file_id(page['file_path'])}:"})
+        for image in page_images(page):
+            content.append({
+                "type": "image",
+                "source": {"type": "base64", "media_type": image["media_type"], "data": image["data"]}
+            })
+    content.append({"type": "text", "text": f"Transcribe the {len(encoded_pages)} pages above and extract their documents."})
+    return {
+        "model": model,
+        "max_tokens": min(MAX_PACKED_TOKENS, MAX_TOKENS * len(encoded_pages) + 1000),
+        "temperature": 0,
+        "system": [
+            {
+                "type": "text",
+                "text": SYSTEM_PROMPT + "\n" + PACKED_INSTRUCTIONS,
+                "cache_control": {"type": "ephemeral"}
+            }
+        ],
+        "messages": [{"role": "user", "content": content}],
+    }
+
+
+def split_packed_response(data: Dict[str, Any], file_ids: List[str]) -> Tuple[Dict[str, Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Turn a packed response into per-page records and document-level records.
+    Each page record carries the fields of the first document that lists the
+    page, with document_text replaced by that page's own transcription and the
+    document's page span in document_pages.
+    """
+    documents = [d for d in data.get("documents") or [] if isinstance(d, dict)]
+    for document in documents:
+        validate(document)
+        if not isinstance(document.get("pages"), list):
+            document["pages"] = []
+    texts = {p.get("file_id"): p.get("document_text", "") for p in data.get("pages") or [] if isinstance(p, dict)}
+
+    pages = {}
+    for file_id in file_ids:
+        if file_id not in texts:
+            continue  # Dropped by the model or lost to truncation; left for a later run
+        owner = next((d for d in documents if file_id in d["pages"]), None)
+        record = copy.deepcopy(owner) if owner else {}
+        validate(record)
+        record["document_text"] = texts[file_id]
+        record["document_pages"] = record.pop("pages", [file_id])
+        record.pop("continues_from_previous", None)
+        record.pop("continues_on_next", None)
+        pages[file_id] = record
+    return pages, documents
+
+
+def continues(previous: Dict[str, Any], document: Dict[str, Any]) -> bool:
+    # The model's flags alone are not enough: a failed window in between, or a new book, must not be bridged
+    if not (previous.get("continues_on_next") and document.get("continues_from_previous")):
+        return False
+    if not previous["pages"] or not document["pages"]:
+        return False
+    last, first = parse_file_id(previous["pages"][-1]), parse_file_id(document["pages"][0])
+    return last is not None and first is not None and last[0] == first[0] and first[1] == last[1] + 1
+
+
+def merge_continued(documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Join documents cut at a window boundary: one that continues_on_next followed on the adjacent page of
+    # the same book by one that continues_from_previous
+    merged = []
+    for document in documents:
+        if merged and continues(merged[-1], document):
+            previous = merged[-1]
+            previous["document_text"] = f"{previous['document_text']} {document['document_text']}".strip()
+            previous["pages"] = previous["pages"] + [p for p in document["pages"] if p not in previous["pages"]]
+            for key in ("grantors", "grantees", "legal_authorities"):
+                previous[key] = previous[key] + [v for v in document[key] if v not in previous[key]]
+            for section in ("property_description", "geographical_references", "transaction_dates"):
+                for key, value in document[section].items():
+                    if value and not previous[section].get(key):
+                        previous[section][key] = value
+            previous["continues_on_next"] = document.get("continues_on_next", False)
+        else:
+            merged.append(document)
+    return merged
+
+
+def request_window(client, model: str, window_pages: List[Dict[str, Any]], file_ids: List[str],
+                   telemetry: Telemetry, cache: Optional[ResponseCache] = None,
+                   parse_stats: Optional[ParseStats] = None, limiter: Optional[AdaptiveLimiter] = None,
+                   max_retries: int = DEFAULT_MAX_RETRIES) -> Dict[str, Any]:
+    """
+    Send one window of pages and parse the packed response, or replay it from
+    the response cache when the same pages were sent before with the same model
+    and instructions. Throttled requests are retried through the limiter, as
+    in batch.py.
+    Returns:
+        The parse_response result for the window.
+    """
+    request = build_packed_request(model, window_pages)
+    first = file_ids[0]
+    cache_key = None
+    if cache is not None:
+        image_data = "".join(image["data"] for page in window_pages for image in page_images(page))
+        cache_key = cache.make_key(image_data, model, PACKED_INSTRUCTIONS + "\n".join(file_ids),
+                                   request["max_tokens"], SYSTEM_PROMPT)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            telemetry.event("cache_hit", page=first, pages=file_ids)
+            return cached["parsed"]
+        telemetry.event("cache_miss", page=first, pages=file_ids)
+
+    limiter = limiter if limiter is not None else AdaptiveLimiter(1)
+    with telemetry.span("request", page=first, pages=file_ids, model=model) as span:
+        response = call_with_retries(limiter, lambda: client.messages.create(**request), max_retries,
+                                     on_retry=lambda attempt: telemetry.event("retry", page=first, attempt=attempt))
+        span.update(usage_attrs(getattr(response, "usage", None), model))
+        span["stop_reason"] = getattr(response, "stop_reason", None)
+    raw_text = response_text(response)
+    with telemetry.span("parse", page=first, pages=file_ids) as span:
+        parsed = parse_response(raw_text, truncated=response.stop_reason == "max_tokens", stats=parse_stats,
+                                validate_fields=False)
+        span["status"] = parsed["status"]
+    if cache is not None and parsed["status"] != "failed":
+        cache.put(cache_key, raw_text, parsed, file_id=f"{PACKED_ID_PREFIX}{first}-{file_ids[-1]}")
+    return parsed
+
+
+def process_packed(input_dir, output_dir, model: str, api_key: Optional[str] = None,
+                   window: int = DEFAULT_WINDOW, client: Optional[Any] = None,
+                   max_edge: Optional[int] = DEFAULT_MAX_EDGE, max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+                   cache_path: Optional[str] = None, run_dir: Optional[str] = None,
+                   max_retries: int = DEFAULT_MAX_RETRIES) -> Dict[str, Any]:
+    """
+    Transcribe a book directory sending `window` adjacent pages per request.
+    Per-page JSON goes through store_json as usual; merged document-level
+    records are written to <output_dir>/documents/<first page ID>.json.
+    Args:
+        cache_path: SQLite response cache; windows sent before with the same
+            pages and model are replayed without an API call.
+        run_dir: Directory for the telemetry span log (spans.jsonl) and summary.json.
+        max_retries: Retries of a window whose request was throttled (429/529).
+    Returns:
+        Request, page and token counts, including input tokens per page, the
+        windows that failed, and the telemetry summary.
+    """
+    if client is None:
+        # The limiter owns retries, as in batch.py
+        client = anthropic.Anthropic(api_key=api_key, max_retries=0)
+    # Windows go out one at a time, so the limiter only paces retries after throttling
+    limiter = AdaptiveLimiter(1)
+    cache = ResponseCache(cache_path) if cache_path else None
+    telemetry = Telemetry(run_dir)
+    parse_stats = ParseStats()
+    os.makedirs(os.path.join(output_dir, "documents"), exist_ok=True)
+    pending = [p for p in list_images(input_dir) if not is_already_processed(get_file_id(p), output_dir)]
+    windows = list(page_windows(pending, window))
+    encoded = {}
+    encoded_pages = iter_encoded_pages([p for w in windows for p in w], max_edge=max_edge, max_bytes=max_bytes)
+
+    stats = {"requests": 0, "pages": 0, "input_tokens": 0, "cache_read_input_tokens": 0, "output_tokens": 0,
+             "failed": {}}
+    documents = []
+    for group in windows:
+        # Pull encoded pages off the pool until the whole window is ready
+        wanted = [str(p) for p in group]
+        while not all(p in encoded for p in wanted):
+            page = next(encoded_pages)
+            encoded[page["file_path"]] = page
+            if "error" not in page:
+                telemetry.record_span("encode", page["encode_seconds"], page=get_file_id(page["file_path"]),
+                                      payload_bytes=page["payload_bytes"], image_tokens=page["image_tokens"])
+        window_pages = [encoded.pop(p) for p in wanted]
+        for page in window_pages:
+            if "error" in page:
+                telemetry.event("page_failed", page=get_file_id(page["file_path"]), error=page["error"])
+        window_pages = [p for p in window_pages if "error" not in p]
+        if not window_pages:
+            continue
+
+        file_ids = [get_file_id(p["file_path"]) for p in window_pages]
+        with telemetry.span("window", page=file_ids[0], pages=file_ids) as window_span:
+            try:
+                parsed = request_window(client, model, window_pages, file_ids, telemetry, cache=cache,
+                                        parse_stats=parse_stats, limiter=limiter, max_retries=max_retries)
+            except Exception as e:
+                window_span["status"] = "failed"
+                stats["failed"][f"{file_ids[0]}-{file_ids[-1]}"] = str(e)
+                print(f"Error processing pages {file_ids[0]}-{file_ids[-1]}: {e}")
+                continue
+            if parsed["status"] == "failed":
+                window_span["status"] = "failed"
+                stats["failed"][f"{file_ids[0]}-{file_ids[-1]}"] = parsed["error"]
+                telemetry.event("parse_failure", page=file_ids[0], pages=file_ids)
+                print(f"Error processing pages {file_ids[0]}-{file_ids[-1]}: {parsed['error']}")
+                continue
+            pages, window_documents = split_packed_response(parsed["data"], file_ids)
+            for file_id, record in pages.items():
+                with telemetry.span("write", page=file_id):
+                    store_json(file_id, output_dir, record)
+        # A window is several pages in one request, so its time is shared out as one page span each
+        for file_id in pages:
+            telemetry.record_span("page", window_span["seconds"] / len(pages), page=file_id, packed=True)
+        stats["pages"] += len(pages)
+        documents.extend(window_documents)
+
+    for document in merge_continued(documents):
+        if document["pages"]:
+            # Same atomic write as the per-page JSON
+            store_json(document["pages"][0], os.path.join(output_dir, "documents"), document)
+
+    stats["parse"] = parse_stats.snapshot()
+    stats["telemetry"] = telemetry.close()
+    stats["requests"] = len(telemetry.durations["request"])
+    stats["throttled"] = limiter.throttled
+    for key in ("input_tokens", "cache_read_input_tokens", "output_tokens"):
+        stats[key] = telemetry.tokens[key]
+    if stats["pages"]:
+        stats["input_tokens_per_page"] = (stats["input_tokens"] + stats["cache_read_input_tokens"]) / stats["pages"]
+    if cache is not None:
+        stats["cache"] = cache.stats()
+        cache.close()
+    print(f"Transcribed {stats['pages']} pages in {stats['requests']} requests")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transcribe a book sending several adjacent pages per request.")
+    parser.add_argument("input_dir")
+    parser.add_argument("output_dir")
+    parser.add_argument("--model", default="claude-3-7-sonnet-20250219")
+    parser.add_argument("--window", type=int, default=DEFAULT_WINDOW)
+    parser.add_argument("--cache", default=None, help="Path of the SQLite response cache")
+    parser.add_argument("--run-dir", default=None, help="Write telemetry spans and a summary here")
+    parser.add_argument("--max-retries", type=int, default=DEFAULT_MAX_RETRIES,
+                        help="Retries of a window whose request was throttled (429/529)")
+    args = parser.parse_args()
+
+    print(json.dumps(process_packed(args.input_dir, args.output_dir, args.model, os.getenv("API_KEY"),
+                                    window=args.window, cache_path=args.cache, run_dir=args.run_dir,
+                                    max_retries=args.max_retries), indent=4))
+
+
+if __name__ == "__main__":
+    main()
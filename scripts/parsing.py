@@ -0,0 +1,191 @@
+import re
+import json
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# JSON paths behind the 14 columns of the consolidated table (Document ID comes from the file name)
+OUTPUT_FIELDS = [
+    ("document_text",),
+    ("document_type",),
+    ("grantors",),
+    ("grantees",),
+    ("legal_authorities",),
+    ("property_description", "acreage"),
+    ("property_description", "boundaries"),
+    ("property_description", "lot_info"),
+    ("geographical_references", "city"),
+    ("geographical_references", "county"),
+    ("geographical_references", "province"),
+    ("transaction_dates", "execution_date"),
+    ("transaction_dates", "recording_date"),
+]
+LIST_FIELDS = {("grantors",), ("grantees",), ("legal_authorities",), ("property_description", "boundaries")}
+# The prompt does not ask for a province, so its absence is not a schema failure
+OPTIONAL_FIELDS = {("geographical_references", "province")}
+
+FENCE_RE = re.compile(r"```[ \t]*(?:json|JSON|javascript)?[ \t]*\n?(.*?)```", re.DOTALL)
+OPEN_FENCE_RE = re.compile(r"```[ \t]*(?:json|JSON|javascript)?[ \t]*\n?")
+TRAILING_COMMA_RE = re.compile(r",(\s*[}\]])")
+
+
+class ParseStats:
+    """Thread-safe counters of parse outcomes, shared by every caller of parse_response."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {"ok": 0, "recovered": 0, "failed": 0, "repaired": 0, "repair_failed": 0}
+
+    def record(self, outcome: str):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    @property
+    def parse_failure_rate(self) -> float:
+        # Share of responses that needed a repair request (i.e. could not be parsed or recovered locally)
+        total = self.counts["ok"] + self.counts["recovered"] + self.counts["failed"]
+        return self.counts["failed"] / total if total else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            snapshot = dict(self.counts)
+        snapshot["parse_failure_rate"] = self.parse_failure_rate
+        return snapshot
+
+
+PARSE_STATS = ParseStats()
+
+
+def _candidates(text: str) -> List[str]:
+    # Fenced blocks first, then an unterminated fence (truncated output), then the bare text
+    candidates = [match.group(1) for match in FENCE_RE.finditer(text)]
+    if not candidates:
+        opening = list(OPEN_FENCE_RE.finditer(text))
+        if opening:
+            candidates.append(text[opening[-1].end():])
+    candidates.append(text)
+    return candidates
+
+
+def _close_truncated(fragment: str) -> Optional[Any]:
+    """
+    Recover the longest valid prefix of a JSON object cut off mid-way.
+    Tracks string and bracket state while scanning, then tries closing the
+    structure at the end, and failing that at each earlier comma.
+    """
+    stack = []
+    in_string = escape = False
+    cut_points = []
+    for i, char in enumerate(fragment):
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+            continue
+        if char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if stack:
+                stack.pop()
+        elif char == ",":
+            cut_points.append((i, "".join(reversed(stack))))
+
+    tail = fragment
+    if in_string:
+        tail += '"'
+    attempts = [tail + "".join(reversed(stack))]
+    attempts += [fragment[:i] + closers for i, closers in reversed(cut_points[-50:])]
+    for attempt in attempts:
+        try:
+            return json.loads(TRAILING_COMMA_RE.sub(r"\1", attempt))
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def _decode(candidate: str) -> Tuple[Optional[Any], bool]:
+    # Returns (value, recovered); raw_decode ignores any prose after the object
+    start = candidate.find("{")
+    if start < 0:
+        return None, False
+    fragment = candidate[start:]
+    try:
+        return json.JSONDecoder().raw_decode(fragment)[0], False
+    except json.JSONDecodeError:
+        pass
+    try:
+        return json.JSONDecoder().raw_decode(TRAILING_COMMA_RE.sub(r"\1", fragment))[0], True
+    except json.JSONDecodeError:
+        pass
+    return _close_truncated(fragment), True
+
+
+def validate(data: Dict[str, Any]) -> List[str]:
+    """
+    Check the parsed object against the output fields, coercing in place:
+    missing fields are filled with empty values and single strings in list
+    fields are wrapped. Returns the dotted paths of required fields that were missing.
+    """
+    missing = []
+    for path in OUTPUT_FIELDS:
+        node = data
+        for key in path[:-1]:
+            if not isinstance(node.get(key), dict):
+                node[key] = {}
+            node = node[key]
+        key = path[-1]
+        empty = [] if path in LIST_FIELDS else ""
+        if key not in node or node[key] is None:
+            node[key] = empty
+            if path not in OPTIONAL_FIELDS:
+                missing.append(".".join(path))
+        elif path in LIST_FIELDS and not isinstance(node[key], list):
+            node[key] = [node[key]] if node[key] else []
+    return missing
+
+
+def parse_response(text: str, truncated: bool = False, stats: Optional[ParseStats] = PARSE_STATS,
+                   validate_fields: bool = True) -> Dict[str, Any]:
+    """
+    Extract the JSON object from a model response.
+    Handles ```json / ``` / ```JSON fences or none at all, prose before and after
+    the object, trailing commas, and output cut off at max_tokens (brackets and
+    strings are closed and the incomplete tail dropped).
+    Args:
+        text: The response text.
+        truncated: The response stopped at max_tokens; any result is marked recovered.
+        stats: Counters to update, None to leave them untouched.
+        validate_fields: Check the object against OUTPUT_FIELDS; callers with a
+            different top-level shape (e.g. packed multi-page responses) validate
+            the nested records themselves.
+    Returns:
+        {"status": "ok" | "recovered" | "failed", "data": dict or None,
+         "missing": required fields that were absent, "error": reason on failure}
+    """
+    data, recovered = None, False
+    for candidate in _candidates(text or ""):
+        data, recovered = _decode(candidate)
+        if isinstance(data, dict):
+            break
+        data = None
+
+    if data is None:
+        result = {"status": "failed", "data": None, "missing": [], "error": "No JSON object found in response"}
+    elif not validate_fields:
+        result = {"status": "recovered" if recovered or truncated else "ok", "data": data, "missing": [], "error": None}
+    else:
+        missing = validate(data)
+        if "document_text" in missing:
+            # Without a transcription the page is worth a repair request
+            result = {"status": "failed", "data": data, "missing": missing, "error": "Missing document_text"}
+        else:
+            status = "recovered" if recovered or truncated or missing else "ok"
+            result = {"status": status, "data": data, "missing": missing, "error": None}
+
+    if stats is not None:
+        stats.record(result["status"])
+    return result
@@ -0,0 +1,137 @@
+import os
+import io
+import time
+import base64
+from functools import partial
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from scripts.layout import crop_page, estimate_image_tokens
+
+# The API downsizes anything with a longer edge than this, so sending more only costs upload time
+DEFAULT_MAX_EDGE = 1568
+# Per-image size limit of the API
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+MEDIA_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+
+
+def _save(image, image_format: str, quality: int) -> bytes:
+    buffered = io.BytesIO()
+    if image_format == "PNG":
+        image.save(buffered, format="PNG", optimize=False)
+    else:
+        image.save(buffered, format=image_format, quality=quality)
+    return buffered.getvalue()
+
+
+def _encode_image(image, max_edge: Optional[int], max_bytes: Optional[int],
+                  image_format: str, quality: int):
+    if max_edge and max(image.size) > max_edge:
+        image = image.copy()
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    data = _save(image, image_format, quality)
+
+    # Same approach as the notebook compress_image loop, applied to any format
+    while max_bytes and len(data) > max_bytes:
+        width, height = image.size
+        image = image.resize((int(width * 0.7), int(height * 0.7)), Image.LANCZOS)
+        data = _save(image, image_format, quality)
+    return data, image.size
+
+
+def page_images(encoded_page: Dict[str, Any]) -> List[Dict[str, Any]]:
+    # Image blocks of an encoded page: one per band when the page was split, else the page itself
+    return encoded_page.get("images") or [encoded_page]
+
+
+def encode_page(file_path, max_edge: Optional[int] = DEFAULT_MAX_EDGE,
+                max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+                image_format: str = "PNG", quality: int = 85,
+                crop: bool = False, bands: int = 1) -> Dict[str, Any]:
+    """
+    Decode a page image, downscale it to the size budget and base64 encode it.
+    Args:
+        file_path: The image path of the property document.
+        max_edge: Longest edge in pixels after downscaling, None to keep the scan size.
+        max_bytes: Largest encoded image allowed; the page is shrunk by 30% until it fits.
+        image_format: PNG, JPEG or WEBP.
+        quality: Encoder quality for the lossy formats.
+        crop: Crop to the text block found by layout.crop_page, dropping margins,
+            binding shadow and ruled borders.
+        bands: With crop, split dense pages into this many overlapping horizontal
+            bands, each sent as its own image block (listed under "images").
+    Returns:
+        A dictionary with the base64 payload, its media type and encode statistics.
+    """
+    start = time.perf_counter()
+    with Image.open(file_path) as image:
+        image = image.convert('L')
+    original_size = image.size
+
+    crop_box = None
+    parts = [image]
+    if crop:
+        layout = crop_page(image, bands=bands)
+        crop_box = layout["bbox"]
+        parts = layout["images"]
+
+    media_type = MEDIA_TYPES[image_format]
+    images = []
+    for part in parts:
+        data, size = _encode_image(part, max_edge, max_bytes, image_format, quality)
+        images.append({
+            "media_type": media_type,
+            "data": base64.b64encode(data).decode('utf-8'),
+            "size": size,
+            "payload_bytes": len(data),
+        })
+
+    encoded_page = {
+        "file_path": str(file_path),
+        "media_type": media_type,
+        "data": images[0]["data"],
+        "original_size": original_size,
+        "size": images[0]["size"],
+        "crop_box": crop_box,
+        "payload_bytes": sum(i["payload_bytes"] for i in images),
+        "image_tokens": sum(estimate_image_tokens(*i["size"]) for i in images),
+        "encode_seconds": time.perf_counter() - start,
+    }
+    if len(images) > 1:
+        encoded_page["images"] = images
+    return encoded_page
+
+
+def _encode_or_error(file_path, **encode_kwargs) -> Dict[str, Any]:
+    # Keep one bad scan from tearing down the whole pool
+    try:
+        return encode_page(file_path, **encode_kwargs)
+    except Exception as e:
+        return {"file_path": str(file_path), "error": str(e)}
+
+
+def iter_encoded_pages(file_paths: Iterable, max_workers: Optional[int] = None,
+                       prefetch: Optional[int] = None, **encode_kwargs) -> Iterator[Dict[str, Any]]:
+    """
+    Encode pages in a process pool and yield them as soon as each one is ready.
+    At most `prefetch` pages are encoded ahead of the consumer so that a slow
+    request stage does not pile encoded payloads up in memory. Pages that fail
+    to decode are yielded as {"file_path": ..., "error": ...}.
+    """
+    file_paths = iter(file_paths)
+    max_workers = max_workers or os.cpu_count() or 1
+    prefetch = prefetch or max_workers * 2
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        encode = partial(_encode_or_error, **encode_kwargs)
+        pending = set()
+        for file_path in file_paths:
+            pending.add(pool.submit(encode, file_path))
+            if len(pending) >= prefetch:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
@@ -0,0 +1,112 @@
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional
+
+# Fields shown in the result list; document_text is only fetched when a result is opened
+SUMMARY_FIELDS = [
+    "document_id", "document_type", "grantors", "grantees", "legal_authorities",
+    "acreage", "lot_info", "city", "county", "execution_date", "recording_date"
+]
+PAGE_SIZE = 20
+
+search_fields_mapping = {
+    "Full Text": "document_text",
+    "Grantors": "grantors",
+    "Grantees": "grantees",
+    "Document Type": "document_type",
+    "City": "city",
+    "County": "county",
+    "Execution Date": "execution_date",
+    "Recording Date": "recording_date"
+}
+
+
+# Build Elasticsearch query
+def build_query(query, search_field, start_date, end_date, search_type):
+
+    if search_type == "Match":
+        search_filter = {"query": {"match": {search_fields_mapping[search_field]: query}}} if query else {"query": {"match_all": {}}}
+    else:  # Fuzzy Match
+        search_filter = {"query": {"fuzzy": {search_fields_mapping[search_field]: {"value": query, "fuzziness": "AUTO"}}}} if query else {"query": {"match_all": {}}}
+
+    # Date filtering (set range between 1720-1780)
+    date_filter = {"range": {search_fields_mapping[search_field]: {
+        "gte": "1720-01-01",
+        "lte": "1780-12-31"
+    }}}
+
+    if start_date or end_date:
+        if start_date:
+            date_filter["range"][search_fields_mapping[search_field]]["gte"] = start_date.strftime("%Y-%m-%d")
+        if end_date:
+            date_filter["range"][search_fields_mapping[search_field]]["lte"] = end_date.strftime("%Y-%m-%d")
+        search_filter["query"] = {"bool": {"must": [search_filter["query"], date_filter]}}
+
+    return search_filter
+
+
+def search_page(client, index_name: str, query_body: Dict[str, Any], page_size: int = PAGE_SIZE,
+                search_after: Optional[List[Any]] = None) -> Dict[str, Any]:
+    """
+    Fetch one page of results with search_after pagination.
+    Only the summary fields are returned in _source; matches in the full text
+    come back as highlight fragments instead of the whole document body.
+    Returns:
+        {"hits": [...], "total": int, "next": sort values to pass as search_after, or None}
+    """
+    body = dict(query_body)
+    # document_id breaks score ties so that search_after is stable between pages
+    body["sort"] = [{"_score": "desc"}, {"document_id": "asc"}]
+    body["_source"] = SUMMARY_FIELDS
+    body["highlight"] = {
+        "fields": {"document_text": {"fragment_size": 160, "number_of_fragments": 3}},
+        "pre_tags": ["**"],
+        "post_tags": ["**"]
+    }
+    body["track_total_hits"] = True
+    if search_after:
+        body["search_after"] = search_after
+
+    # One hit more than the page shows, so that an exactly full last page gets no cursor
+    response = client.search(index=index_name, body=body, size=page_size + 1)
+    hits = response["hits"]["hits"]
+    return {
+        "hits": hits[:page_size],
+        "total": response["hits"]["total"]["value"],
+        "next": hits[page_size - 1]["sort"] if len(hits) > page_size else None,
+    }
+
+
+def fetch_document_text(client, index_name: str, doc_id: str) -> str:
+    # Lazily load the full transcription for a single opened result
+    response = client.get(index=index_name, id=doc_id, _source_includes=["document_text"])
+    return response["_source"].get("document_text", "")
+
+
+class SearchBackend(ABC):
+    """
+    What the app needs from a search engine. Backends take the query bodies
+    produced by build_query and return hits shaped like Elasticsearch hits
+    ({"_id", "_score", "_source", "highlight", "sort"}).
+    """
+
+    @abstractmethod
+    def search_page(self, query_body: Dict[str, Any], page_size: int = PAGE_SIZE,
+                    search_after: Optional[List[Any]] = None) -> Dict[str, Any]:
+        """One page of hits: {"hits": [...], "total": int, "next": search_after cursor or None}."""
+
+    @abstractmethod
+    def fetch_document_text(self, doc_id: str) -> str:
+        """The full document_text of one document, or "" if it is not indexed."""
+
+
+class ElasticsearchBackend(SearchBackend):
+
+    def __init__(self, client, index_name: str):
+        self.client = client
+        self.index_name = index_name
+
+    def search_page(self, query_body, page_size=PAGE_SIZE, search_after=None):
+        return search_page(self.client, self.index_name, query_body, page_size, search_after)
+
+    def fetch_document_text(self, doc_id):
+        return fetch_document_text(self.client, self.index_name, doc_id)
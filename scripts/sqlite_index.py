@@ -0,0 +1,413 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from scripts.documents import FIELDS, content_hash, iter_documents
+from scripts.search import PAGE_SIZE, SUMMARY_FIELDS, SearchBackend, build_query
+from scripts.Transcriptcompare import levenshtein
+
+DATE_COLUMNS = ("execution_date", "recording_date")
+# Columns of the full-text index; the remaining text fields are stored but only searchable through these
+FTS_COLUMNS = ["document_text", "grantors", "grantees", "legal_authorities", "document_type", "city", "county"]
+TOKEN_RE = re.compile(r"\w+")
+# Elasticsearch fuzzy queries expand to at most this many terms by default
+MAX_EXPANSIONS = 50
+# Terms up to this length also get a deletion neighbourhood: enough for every one-edit variant of a 5-character query
+MAX_DELETES_LENGTH = 6
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS documents (
+    rowid INTEGER PRIMARY KEY,
+    {", ".join(f"{field} {'REAL' if field == 'acres' else 'TEXT'}" + (" UNIQUE NOT NULL" if field == "document_id" else "")
+              for field in FIELDS.values())},
+    content_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_execution_date ON documents(execution_date);
+CREATE INDEX IF NOT EXISTS documents_recording_date ON documents(recording_date);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+    {", ".join(FTS_COLUMNS)},
+    content='documents', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS documents_ai AFTER INSERT ON documents BEGIN
+    INSERT INTO documents_fts(rowid, {", ".join(FTS_COLUMNS)})
+    VALUES (new.rowid, {", ".join("new." + c for c in FTS_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS documents_ad AFTER DELETE ON documents BEGIN
+    INSERT INTO documents_fts(documents_fts, rowid, {", ".join(FTS_COLUMNS)})
+    VALUES ('delete', old.rowid, {", ".join("old." + c for c in FTS_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS documents_au AFTER UPDATE ON documents BEGIN
+    INSERT INTO documents_fts(documents_fts, rowid, {", ".join(FTS_COLUMNS)})
+    VALUES ('delete', old.rowid, {", ".join("old." + c for c in FTS_COLUMNS)});
+    INSERT INTO documents_fts(rowid, {", ".join(FTS_COLUMNS)})
+    VALUES (new.rowid, {", ".join("new." + c for c in FTS_COLUMNS)});
+END;
+
+-- Every indexed term, with a trigram index over the terms for fuzzy expansion
+CREATE VIRTUAL TABLE IF NOT EXISTS documents_vocab USING fts5vocab(documents_fts, 'row');
+CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS terms_trigram USING fts5(term, tokenize='trigram');
+-- Short terms by themselves and with each character deleted; two terms one edit apart share a row
+CREATE TABLE IF NOT EXISTS term_deletes (variant TEXT, term TEXT, PRIMARY KEY (variant, term)) WITHOUT ROWID;
+"""
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    # Indexes built before a field was added gain the column; their content hashes differ, so the next build fills it
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(documents)")}
+    for field in FIELDS.values():
+        if field not in existing:
+            conn.execute(f"ALTER TABLE documents ADD COLUMN {field} {'REAL' if field == 'acres' else 'TEXT'}")
+    # Likewise the deletion neighbourhood of an index built before it existed
+    if not conn.execute("SELECT 1 FROM term_deletes LIMIT 1").fetchone():
+        with conn:
+            _add_deletes(conn, conn.execute("SELECT term FROM terms").fetchall())
+    return conn
+
+
+def deletes(term: str) -> set:
+    # The term and every string left by deleting one character from it
+    return {term} | {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _add_deletes(conn: sqlite3.Connection, terms: List[Tuple[str]]):
+    conn.executemany("INSERT OR IGNORE INTO term_deletes(variant, term) VALUES (?, ?)",
+                     ((variant, term) for (term,) in terms if len(term) <= MAX_DELETES_LENGTH
+                      for variant in deletes(term)))
+
+
+def _refresh_terms(conn: sqlite3.Connection) -> int:
+    # Add terms new to the full-text index; terms of deleted documents stay and simply match nothing
+    new_terms = conn.execute(
+        "SELECT v.term FROM documents_vocab v LEFT JOIN terms t ON t.term = v.term WHERE t.term IS NULL"
+    ).fetchall()
+    conn.executemany("INSERT INTO terms(term) VALUES (?)", new_terms)
+    conn.executemany("INSERT INTO terms_trigram(term) VALUES (?)", new_terms)
+    _add_deletes(conn, new_terms)
+    return len(new_terms)
+
+
+def build_index(table_path: str, db_path: str, read_chunk_size: int = 5000, force: bool = False) -> Dict[str, Any]:
+    """
+    Build or update the SQLite search index from the consolidated CSV or Parquet table.
+    Documents are compared by the same content hash mapIndex uses, so only new
+    or changed rows are written; rows no longer in the table are deleted.
+    Args:
+        table_path: Consolidated table written by consolidate.py.
+        db_path: SQLite database, created if missing.
+        read_chunk_size: Rows read from the table at a time.
+        force: Rewrite every document.
+    Returns:
+        Indexed/skipped/deleted counts and the elapsed time.
+    """
+    start = time.perf_counter()
+    conn = connect(db_path)
+    hashes = {} if force else dict(conn.execute("SELECT document_id, content_hash FROM documents"))
+    seen = set()
+    stats = {"indexed": 0, "skipped": 0, "deleted": 0}
+
+    fields = list(FIELDS.values())
+    upsert = (f"INSERT INTO documents({', '.join(fields)}, content_hash) "
+              f"VALUES ({', '.join('?' * (len(fields) + 1))}) "
+              f"ON CONFLICT(document_id) DO UPDATE SET "
+              + ", ".join(f"{f} = excluded.{f}" for f in fields[1:] + ["content_hash"]))
+    rows = []
+    for source in iter_documents(table_path, read_chunk_size):
+        doc_id = source["document_id"]
+        seen.add(doc_id)
+        digest = content_hash(source)
+        if hashes.get(doc_id) == digest:
+            stats["skipped"] += 1
+            continue
+        rows.append([source[f] for f in fields] + [digest])
+        if len(rows) >= read_chunk_size:
+            with conn:
+                conn.executemany(upsert, rows)
+            stats["indexed"] += len(rows)
+            rows = []
+    with conn:
+        conn.executemany(upsert, rows)
+        stats["indexed"] += len(rows)
+        removed = [(doc_id,) for doc_id in hashes if doc_id not in seen]
+        conn.executemany("DELETE FROM documents WHERE document_id = ?", removed)
+        stats["deleted"] = len(removed)
+
+    if stats["indexed"] or stats["deleted"]:
+        with conn:
+            stats["new_terms"] = _refresh_terms(conn)
+            conn.execute("INSERT INTO documents_fts(documents_fts) VALUES ('optimize')")
+            conn.execute("INSERT INTO terms_trigram(terms_trigram) VALUES ('optimize')")
+    conn.close()
+
+    stats["elapsed_seconds"] = time.perf_counter() - start
+    print(f"Indexed {stats['indexed']} documents in {stats['elapsed_seconds']:.1f}s, "
+          f"{stats['skipped']} unchanged, {stats['deleted']} deleted")
+    return stats
+
+
+def auto_fuzziness(term: str) -> int:
+    # Elasticsearch "AUTO": exact up to 2 characters, one edit up to 5, two beyond
+    return 0 if len(term) <= 2 else 1 if len(term) <= 5 else 2
+
+
+def damerau_levenshtein(a: str, b: str) -> int:
+    # Optimal string alignment distance: edits plus adjacent transpositions, as Elasticsearch counts them
+    previous2, previous = None, list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def _clauses(query_body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    query = query_body.get("query", {"match_all": {}})
+    return query["bool"]["must"] if "bool" in query else [query]
+
+
+class SQLiteBackend(SearchBackend):
+    """
+    Embedded search over the index written by build_index.
+    Translates the Elasticsearch bodies produced by build_query: match queries
+    become FTS5 queries ranked by BM25, fuzzy queries are expanded to indexed
+    terms within the AUTO edit distance, and date ranges use the indexed date
+    columns. Fuzzy expansion finds every variant of a term of up to five
+    characters; a longer variant is found only if it shares a trigram with the
+    query, so one whose two edits touch every trigram is missed.
+    """
+
+    def __init__(self, db_path: str):
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"No search index at {db_path}; build it with `python -m scripts.sqlite_index build`")
+        self.db_path = db_path
+        # sqlite3 connections are per thread; Streamlit serves sessions from several
+        self._local = threading.local()
+        if not self.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'term_deletes'").fetchone():
+            raise RuntimeError(f"The search index at {db_path} predates fuzzy term deletes; "
+                               f"update it with `python -m scripts.sqlite_index build`")
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if not hasattr(self._local, "conn"):
+            self._local.conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+        return self._local.conn
+
+    def expand_fuzzy(self, term: str) -> List[str]:
+        """Indexed terms within the AUTO edit distance of `term`, closest first."""
+        term = term.lower()
+        distance = auto_fuzziness(term)
+        if distance == 0:
+            return [term]
+        trigrams = {term[i:i + 3] for i in range(len(term) - 2)}
+        candidates = set(self.conn.execute(
+            "SELECT term FROM terms_trigram WHERE terms_trigram MATCH ? ORDER BY rank LIMIT 1000",
+            (" OR ".join(f'"{t}"' for t in trigrams),)
+        ).fetchall())
+        if len(term) < MAX_DELETES_LENGTH:
+            # A one-edit variant of a short term can share no trigram with it (smith, smyth)
+            variants = deletes(term)
+            candidates.update(self.conn.execute(
+                f"SELECT DISTINCT term FROM term_deletes WHERE variant IN ({', '.join('?' * len(variants))})",
+                list(variants)
+            ).fetchall())
+        scored = []
+        for (candidate,) in candidates:
+            if abs(len(candidate) - len(term)) > distance:
+                continue
+            # The bit-parallel distance settles most candidates; transpositions can at best halve it
+            edits = levenshtein(term, candidate)
+            if distance < edits <= 2 * distance:
+                edits = damerau_levenshtein(term, candidate)
+            if edits <= distance:
+                scored.append((edits, candidate))
+        scored.sort()
+        return [candidate for _, candidate in scored[:MAX_EXPANSIONS]] or [term]
+
+    def _where(self, query_body: Dict[str, Any]) -> Tuple[Optional[str], str, List[Any], Optional[str]]:
+        # Returns (FTS5 MATCH expression, SQL conditions on documents, parameters, searched column)
+        match, conditions, params, column = None, [], [], None
+        for clause in _clauses(query_body):
+            if "match_all" in clause:
+                continue
+            if "range" in clause:
+                field, bounds = next(iter(clause["range"].items()))
+                # A range on a text field (build_query applies it to the searched field) filters on either date
+                columns = [field] if field in DATE_COLUMNS else list(DATE_COLUMNS)
+                conditions.append("(" + " OR ".join(f"d.{c} BETWEEN ? AND ?" for c in columns) + ")")
+                for _ in columns:
+                    params += [bounds.get("gte", "0000-01-01"), bounds.get("lte", "9999-12-31")]
+                continue
+            kind = "match" if "match" in clause else "fuzzy"
+            field, value = next(iter(clause[kind].items()))
+            text = value["value"] if isinstance(value, dict) else value
+            if field in DATE_COLUMNS or field not in FTS_COLUMNS:
+                conditions.append(f"d.{field} = ?")
+                params.append(text)
+                continue
+            tokens = [t.lower() for t in TOKEN_RE.findall(text or "")]
+            if kind == "fuzzy":
+                tokens = [expanded for t in tokens for expanded in self.expand_fuzzy(t)]
+            if not tokens:
+                conditions.append("0")
+                continue
+            column = field
+            match = "{%s} : (%s)" % (field, " OR ".join(f'"{t}"' for t in dict.fromkeys(tokens)))
+        return match, " AND ".join(conditions), params, column
+
+    def search_page(self, query_body, page_size=PAGE_SIZE, search_after=None):
+        match, conditions, params, column = self._where(query_body)
+        # Score ties break on rowid, so the search_after cursor is [score, rowid] rather than a document ID
+        if match:
+            # The join is only needed when the date or equality conditions look at the documents table
+            source = "documents_fts f" + (" JOIN documents d ON d.rowid = f.rowid" if conditions else "")
+            where = ["documents_fts MATCH ?"] + ([conditions] if conditions else [])
+            params = [match] + params
+            score, order = "-f.rank", "f.rank, f.rowid"
+            cursor = "(f.rank > ? OR (f.rank = ? AND f.rowid > ?))"
+            cursor_params = lambda after: [-after[0], -after[0], after[1]]
+        else:
+            source = "documents d"
+            where = [conditions] if conditions else []
+            score, order = "1.0", "d.rowid"
+            cursor = "d.rowid > ?"
+            cursor_params = lambda after: [after[1]]
+
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        total = self.conn.execute(f"SELECT count(*) FROM {source} {where_sql}", params).fetchone()[0]
+
+        page_where, page_params = list(where), list(params)
+        if search_after:
+            page_where.append(cursor)
+            page_params += cursor_params(search_after)
+        page_where_sql = f"WHERE {' AND '.join(page_where)}" if page_where else ""
+        rowid = "f.rowid" if match else "d.rowid"
+        # One row more than the page shows, as in search.search_page
+        ranked = self.conn.execute(
+            f"SELECT {rowid}, {score} FROM {source} {page_where_sql} ORDER BY {order} LIMIT ?",
+            page_params + [page_size + 1]
+        ).fetchall()
+        has_next = len(ranked) > page_size
+        ranked = ranked[:page_size]
+
+        # Fields and snippets are read for the page only, not for every match
+        rowids = [r for r, _ in ranked]
+        marks = ", ".join("?" * len(rowids))
+        fields = {row[0]: row[1:] for row in self.conn.execute(
+            f"SELECT rowid, {', '.join(SUMMARY_FIELDS)} FROM documents WHERE rowid IN ({marks})", rowids)}
+        snippets = {}
+        if column == "document_text" and rowids:
+            snippets = dict(self.conn.execute(
+                f"SELECT rowid, snippet(documents_fts, 0, '**', '**', '…', 24) FROM documents_fts "
+                f"WHERE documents_fts MATCH ? AND rowid IN ({marks})", [match] + rowids))
+
+        hits = []
+        for rowid, hit_score in ranked:
+            source_fields = dict(zip(SUMMARY_FIELDS, fields[rowid]))
+            hit = {"_id": source_fields["document_id"], "_score": hit_score, "_source": source_fields,
+                   "sort": [hit_score, rowid]}
+            if snippets.get(rowid):
+                hit["highlight"] = {"document_text": [snippets[rowid]]}
+            hits.append(hit)
+        return {
+            "hits": hits,
+            "total": total,
+            "next": hits[-1]["sort"] if has_next else None,
+        }
+
+    def fetch_document_text(self, doc_id):
+        row = self.conn.execute("SELECT document_text FROM documents WHERE document_id = ?", (doc_id,)).fetchone()
+        return row[0] if row else ""
+
+
+# (query, search field, start date, end date, search type) as entered in the app
+BENCHMARK_QUERIES = [
+    ("Springfield", "Full Text", None, None, "Match"),
+    ("Sprinfeild", "Full Text", None, None, "Fuzzy Match"),
+    ("Bliss", "Grantors", None, None, "Match"),
+    ("Blis", "Grantees", None, None, "Fuzzy Match"),
+    ("deed", "Document Type", None, None, "Match"),
+    ("Hampshire", "County", None, None, "Match"),
+    ("land meadow", "Full Text", date(1750, 1, 1), date(1770, 12, 31), "Match"),
+    ("", "Execution Date", date(1755, 1, 1), date(1760, 12, 31), "Match"),
+]
+
+
+def benchmark(backends: Dict[str, SearchBackend], queries=BENCHMARK_QUERIES, repeat: int = 5,
+              pages: int = 2) -> Dict[str, Any]:
+    """
+    Time the app's first `pages` result pages for each query on every backend.
+    Returns per-backend p50/p95 latency in milliseconds, per-query totals and,
+    with more than one backend, the overlap of each backend's first page with the first backend's.
+    """
+    results = {name: {"latencies_ms": [], "queries": []} for name in backends}
+    first_pages = {}
+    for args in queries:
+        query_body = build_query(*args)
+        for name, backend in backends.items():
+            for _ in range(repeat):
+                cursor = None
+                for page in range(pages):
+                    start = time.perf_counter()
+                    response = backend.search_page(query_body, search_after=cursor)
+                    results[name]["latencies_ms"].append((time.perf_counter() - start) * 1000)
+                    if page == 0:
+                        first_pages[(args, name)] = [hit["_id"] for hit in response["hits"]]
+                        total = response["total"]
+                    cursor = response["next"]
+                    if cursor is None:
+                        break
+            entry = {"query": args[0], "field": args[1], "type": args[4], "total": total}
+            reference = first_pages[(args, next(iter(backends)))]
+            if reference and name != next(iter(backends)):
+                entry["overlap"] = len(set(reference) & set(first_pages[(args, name)])) / len(reference)
+            results[name]["queries"].append(entry)
+
+    for result in results.values():
+        latencies = sorted(result["latencies_ms"])
+        result["p50_ms"] = latencies[len(latencies) // 2]
+        result["p95_ms"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        del result["latencies_ms"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedded SQLite FTS5 search index for the deeds table.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Create or update the index from the consolidated table")
+    build_parser.add_argument("table", help="Consolidated CSV or Parquet")
+    build_parser.add_argument("db")
+    build_parser.add_argument("--force", action="store_true")
+    bench_parser = subparsers.add_parser("bench", help="Time the app's queries, against Elasticsearch too if CLOUD_ID is set")
+    bench_parser.add_argument("db")
+    bench_parser.add_argument("--repeat", type=int, default=5)
+    bench_parser.add_argument("--index", default="land_deeds")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.table, args.db, force=args.force)
+    else:
+        backends = {"sqlite": SQLiteBackend(args.db)}
+        if os.getenv("CLOUD_ID"):
+            from elasticsearch import Elasticsearch
+            from scripts.search import ElasticsearchBackend
+            client = Elasticsearch(os.getenv("CLOUD_ID"), api_key=os.getenv("ELASTIC_API_KEY"))
+            backends["elasticsearch"] = ElasticsearchBackend(client, args.index)
+        print(json.dumps(benchmark(backends, repeat=args.repeat), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import argparse
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional
+
+SPANS_FILE = "spans.jsonl"
+SUMMARY_FILE = "summary.json"
+TOKEN_FIELDS = ("input_tokens", "output_tokens", "cache_creation_input_tokens", "cache_read_input_tokens")
+# The metrics endpoint has no authentication, so it is not exposed beyond this machine unless asked
+DEFAULT_METRICS_HOST = "127.0.0.1"
+
+# USD per million tokens: input, output, cache write, cache read (list prices, synchronous API)
+PRICES = {
+    "claude-3-7-sonnet": (3.00, 15.00, 3.75, 0.30),
+    "claude-3-5-sonnet": (3.00, 15.00, 3.75, 0.30),
+    "claude-sonnet-4": (3.00, 15.00, 3.75, 0.30),
+    "claude-3-5-haiku": (0.80, 4.00, 1.00, 0.08),
+    "claude-3-haiku": (0.25, 1.25, 0.30, 0.03),
+    "claude-3-opus": (15.00, 75.00, 18.75, 1.50),
+    "claude-opus-4": (15.00, 75.00, 18.75, 1.50),
+}
+
+
+def estimate_cost(model: Optional[str], tokens: Dict[str, int]) -> Optional[float]:
+    # None for models missing from PRICES rather than a guess
+    prices = next((p for prefix, p in PRICES.items() if model and model.startswith(prefix)), None)
+    if prices is None:
+        return None
+    return sum(tokens.get(field, 0) * price for field, price in zip(TOKEN_FIELDS, prices)) / 1_000_000
+
+
+def usage_attrs(usage, model: Optional[str] = None) -> Dict[str, Any]:
+    # Token counts of a response.usage object, plus their estimated cost, as span attributes
+    attrs = {field: getattr(usage, field, 0) or 0 for field in TOKEN_FIELDS}
+    cost = estimate_cost(model, attrs)
+    if cost is not None:
+        attrs["cost_usd"] = cost
+    return attrs
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class Telemetry:
+    """
+    Structured spans and counters for one pipeline run.
+    Every span (a timed stage of one page: encode, request, parse, write, ...)
+    and event (retry, cache hit, parse failure, ...) is appended as a JSON line
+    to <run_dir>/spans.jsonl when a run directory is given, and aggregated in
+    memory for summary() and the Prometheus endpoint either way.
+    """
+
+    def __init__(self, run_dir: Optional[str] = None):
+        self.run_dir = run_dir
+        self._lock = threading.Lock()
+        self._file = None
+        if run_dir:
+            os.makedirs(run_dir, exist_ok=True)
+            self._file = open(os.path.join(run_dir, SPANS_FILE), "a", encoding="utf-8")
+        self.durations = defaultdict(list)
+        self.events = Counter()
+        self.tokens = Counter()
+        self.cost_usd = 0.0
+        self.started = None
+        self.finished = None
+        self._server = None
+
+    def _aggregate(self, record: Dict[str, Any]):
+        if "span" in record:
+            # Failed attempts (e.g. a throttled request) are counted, not timed, so pages and latency reflect completed work
+            if record.get("error"):
+                self.events[f"{record['span']}_error"] += 1
+            else:
+                self.durations[record["span"]].append(record["seconds"])
+            end = record["ts"] + record["seconds"]
+        else:
+            self.events[record["event"]] += 1
+            end = record["ts"]
+        for field in TOKEN_FIELDS:
+            self.tokens[field] += record.get(field, 0)
+        self.cost_usd += record.get("cost_usd", 0.0)
+        self.started = record["ts"] if self.started is None else min(self.started, record["ts"])
+        self.finished = end if self.finished is None else max(self.finished, end)
+
+    def emit(self, record: Dict[str, Any]):
+        with self._lock:
+            self._aggregate(record)
+            if self._file is not None:
+                self._file.write(json.dumps(record, default=str) + "\n")
+
+    @contextmanager
+    def span(self, name: str, page: Optional[str] = None, **attrs) -> Iterator[Dict[str, Any]]:
+        """
+        Time a block. The yielded record can be given more attributes (token
+        counts, a parse status) before it is emitted; an exception is recorded
+        on the span and re-raised.
+        """
+        record = {"span": name, "page": page, "ts": time.time(), **attrs}
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record["error"] = repr(e)
+            raise
+        finally:
+            record["seconds"] = time.perf_counter() - start
+            self.emit(record)
+
+    def record_span(self, name: str, seconds: float, page: Optional[str] = None, **attrs):
+        # For stages timed elsewhere, e.g. encoding in a worker process
+        self.emit({"span": name, "page": page, "ts": time.time() - seconds, "seconds": seconds, **attrs})
+
+    def event(self, name: str, page: Optional[str] = None, **attrs):
+        self.emit({"event": name, "page": page, "ts": time.time(), **attrs})
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self.durations.items()}
+            events = dict(self.events)
+            tokens = dict(self.tokens)
+            elapsed = (self.finished - self.started) if self.started is not None else 0.0
+            cost = self.cost_usd
+        pages = len(durations.get("page", []))
+        return {
+            "pages": pages,
+            "elapsed_seconds": elapsed,
+            "pages_per_minute": pages / elapsed * 60 if elapsed > 0 else 0.0,
+            "spans": {
+                name: {"count": len(values), "total_seconds": sum(values),
+                       "p50_seconds": percentile(values, 0.50), "p95_seconds": percentile(values, 0.95)}
+                for name, values in durations.items()
+            },
+            "events": events,
+            "tokens": tokens,
+            "estimated_cost_usd": cost,
+        }
+
+    def prometheus(self) -> str:
+        """The summary in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = [
+            "# TYPE deeds_pages_total counter",
+            f"deeds_pages_total {summary['pages']}",
+            "# TYPE deeds_pages_per_minute gauge",
+            f"deeds_pages_per_minute {summary['pages_per_minute']}",
+            "# TYPE deeds_span_seconds summary",
+        ]
+        for name, stats in summary["spans"].items():
+            lines.append(f'deeds_span_seconds{{span="{name}",quantile="0.5"}} {stats["p50_seconds"]}')
+            lines.append(f'deeds_span_seconds{{span="{name}",quantile="0.95"}} {stats["p95_seconds"]}')
+            lines.append(f'deeds_span_seconds_sum{{span="{name}"}} {stats["total_seconds"]}')
+            lines.append(f'deeds_span_seconds_count{{span="{name}"}} {stats["count"]}')
+        lines.append("# TYPE deeds_events_total counter")
+        lines += [f'deeds_events_total{{event="{name}"}} {count}' for name, count in summary["events"].items()]
+        lines.append("# TYPE deeds_tokens_total counter")
+        lines += [f'deeds_tokens_total{{type="{name}"}} {count}' for name, count in summary["tokens"].items()]
+        lines.append("# TYPE deeds_estimated_cost_usd_total counter")
+        lines.append(f"deeds_estimated_cost_usd_total {summary['estimated_cost_usd']}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = DEFAULT_METRICS_HOST):
+        """
+        Expose prometheus() at http://host:port/metrics from a daemon thread.
+        Only this machine can reach it by default; pass host="0.0.0.0" for a
+        scraper on another node.
+        """
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = telemetry.prometheus().encode("utf-8")
+                self.send_response(200 if self.path == "/metrics" else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self._server
+
+    def close(self) -> Dict[str, Any]:
+        # Flush the span log, write summary.json next to it and stop the endpoint
+        summary = self.summary()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        if self.run_dir:
+            with open(os.path.join(self.run_dir, SUMMARY_FILE), "w", encoding="utf-8") as summary_file:
+                json.dump(summary, summary_file, indent=4)
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+        return summary
+
+
+def load_run(run_dir: str) -> Telemetry:
+    # Rebuild the aggregates of a run from its span log
+    telemetry = Telemetry()
+    with open(os.path.join(run_dir, SPANS_FILE), "r", encoding="utf-8") as spans_file:
+        for line in spans_file:
+            if line.strip():
+                telemetry._aggregate(json.loads(line))
+    return telemetry
+
+
+def report(run_dir: str) -> str:
+    summary = load_run(run_dir).summary()
+    lines = [
+        f"{summary['pages']} pages in {summary['elapsed_seconds']:.1f}s ({summary['pages_per_minute']:.1f} pages/min)",
+        f"{'stage':<14}{'count':>8}{'p50 s':>10}{'p95 s':>10}{'total s':>12}",
+    ]
+    for name, stats in sorted(summary["spans"].items()):
+        lines.append(f"{name:<14}{stats['count']:>8}{stats['p50_seconds']:>10.3f}"
+                     f"{stats['p95_seconds']:>10.3f}{stats['total_seconds']:>12.1f}")
+    tokens = ", ".join(f"{k} {v}" for k, v in summary["tokens"].items() if v)
+    lines.append(f"tokens: {tokens or 'none'}")
+    lines.append(f"estimated cost: ${summary['estimated_cost_usd']:.2f}")
+    if summary["events"]:
+        lines.append("events: " + ", ".join(f"{k} {v}" for k, v in sorted(summary["events"].items())))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the telemetry of a pipeline run.")
+    parser.add_argument("command", choices=["report"])
+    parser.add_argument("run_dir")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON instead of a table")
+    args = parser.parse_args()
+
+    if args.json:
+        print(json.dumps(load_run(args.run_dir).summary(), indent=4))
+    else:
+        print(report(args.run_dir))
+
+
+if __name__ == "__main__":
+    main()
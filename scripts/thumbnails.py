@@ -0,0 +1,149 @@
+import os
+import uuid
+import argparse
+import threading
+from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+# Longest edge in pixels of each derivative
+SIZES = {"thumb": 256, "preview": 1024}
+IMAGE_FORMAT = "WEBP"
+IMAGE_EXTENSION = ".webp"
+DEFAULT_CACHE_DIR = ".thumbnails"
+DEFAULT_MAX_CACHE_BYTES = 1024 ** 3
+SOURCE_SUFFIXES = (".TIF", ".tif", ".TIFF", ".tiff")
+
+# Running size of each cache directory, so a miss does not have to list the whole cache
+_cache_bytes = {}
+_cache_bytes_lock = threading.Lock()
+
+
+def derivative_path(cache_dir, doc_id: str, size_name: str) -> str:
+    return os.path.join(cache_dir, size_name, f"{doc_id}{IMAGE_EXTENSION}")
+
+
+def find_source(image_dir, doc_id: str) -> Optional[str]:
+    for suffix in SOURCE_SUFFIXES:
+        path = os.path.join(image_dir, f"{doc_id}{suffix}")
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def make_derivatives(image_path, cache_dir, sizes: Dict[str, int] = SIZES, quality: int = 80) -> Dict[str, str]:
+    """
+    Decode a scan once and write every derivative size for it.
+    Sizes are produced largest first, each one downscaled from the previous,
+    and written via a temp file so a reader never sees a partial image.
+    """
+    doc_id = os.path.basename(str(image_path)).split('.')[0]
+    written = {}
+    with Image.open(image_path) as image:
+        image = image.convert('L')
+    for size_name, edge in sorted(sizes.items(), key=lambda item: -item[1]):
+        image.thumbnail((edge, edge), Image.LANCZOS)
+        path = derivative_path(cache_dir, doc_id, size_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per call: app threads in one process may render the same page at once
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            image.save(tmp_path, format=IMAGE_FORMAT, quality=quality)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        written[size_name] = path
+    return written
+
+
+def evict(cache_dir, max_bytes: int = DEFAULT_MAX_CACHE_BYTES) -> int:
+    # Drop the least recently used derivatives (by mtime, bumped on every read) down to 90% of the budget
+    files = []
+    for size_name in os.listdir(cache_dir) if os.path.isdir(cache_dir) else []:
+        with os.scandir(os.path.join(cache_dir, size_name)) as entries:
+            for entry in entries:
+                if entry.name.endswith(IMAGE_EXTENSION):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    removed = 0
+    if total > max_bytes:
+        for _, size, path in sorted(files):
+            if total <= max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+    # Other processes (pregenerate, another app server) may write to the cache too, so each scan resets the total
+    with _cache_bytes_lock:
+        _cache_bytes[os.path.abspath(cache_dir)] = total
+    return removed
+
+
+def _record_write(cache_dir, written: Dict[str, str]) -> Optional[int]:
+    # Add newly written derivatives to the running total; None until the directory has been scanned once
+    added = sum(os.path.getsize(path) for path in written.values())
+    with _cache_bytes_lock:
+        key = os.path.abspath(cache_dir)
+        if key not in _cache_bytes:
+            return None
+        _cache_bytes[key] += added
+        return _cache_bytes[key]
+
+
+def get_derivative(image_dir, doc_id: str, size_name: str = "preview", cache_dir=DEFAULT_CACHE_DIR,
+                   max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES) -> Optional[bytes]:
+    """
+    Return the encoded derivative of a page, generating it on a cache miss.
+    Returns None when no source scan exists for doc_id.
+    """
+    path = derivative_path(cache_dir, doc_id, size_name)
+    if not os.path.exists(path):
+        source = find_source(image_dir, doc_id)
+        if source is None:
+            return None
+        total = _record_write(cache_dir, make_derivatives(source, cache_dir))
+        # Only list the cache when it may have outgrown the budget, and once to learn its size
+        if total is None or total > max_cache_bytes:
+            evict(cache_dir, max_cache_bytes)
+    try:
+        os.utime(path)  # Mark as recently used for eviction
+        with open(path, "rb") as image_file:
+            return image_file.read()
+    except FileNotFoundError:
+        return None
+
+
+def pregenerate(image_dir, cache_dir=DEFAULT_CACHE_DIR, max_workers: Optional[int] = None) -> int:
+    # Build derivatives for every scan that does not have a complete set yet
+    sources = []
+    for name in sorted(os.listdir(image_dir)):
+        if not name.endswith(SOURCE_SUFFIXES):
+            continue
+        doc_id = name.split('.')[0]
+        if not all(os.path.exists(derivative_path(cache_dir, doc_id, s)) for s in SIZES):
+            sources.append(os.path.join(image_dir, name))
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        for _ in pool.map(make_derivatives, sources, [cache_dir] * len(sources), chunksize=8):
+            pass
+    print(f"Generated derivatives for {len(sources)} pages in {cache_dir}")
+    return len(sources)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate thumbnail and preview derivatives of deed scans.")
+    parser.add_argument("image_dir")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    pregenerate(args.image_dir, args.cache_dir, args.workers)
+
+
+if __name__ == "__main__":
+    main()
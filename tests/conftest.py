@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules import each other as `scripts.<name>`; make that work under a bare `pytest` too
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,198 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from PIL import Image
+
+from scripts.batch import AdaptiveLimiter, process_directory
+from scripts.ledger import JobLedger
+
+RESPONSE = {
+    "document_text": "Know all men by these presents",
+    "document_type": "Deed",
+    "grantors": ["John Miller"],
+    "grantees": ["Jedidiah Bliss"],
+    "legal_authorities": [],
+    "property_description": {"acreage": "", "boundaries": [], "lot_info": ""},
+    "geographical_references": {"city": "Springfield", "county": "Hampshire"},
+    "transaction_dates": {"execution_date": "", "recording_date": ""},
+}
+
+
+class Throttled(Exception):
+    # Shaped like anthropic.APIStatusError: a status code and a response carrying headers
+
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={"retry-after": str(retry_after)} if retry_after is not None else {})
+
+
+class ScriptedClient:
+    """messages.create raises the scripted errors in turn, then answers every later call."""
+
+    def __init__(self, errors=(), text=json.dumps(RESPONSE)):
+        self.errors = list(errors)
+        self.text = text
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        self.messages = self
+
+    def create(self, **params):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            error = self.errors.pop(0) if self.errors else None
+        try:
+            time.sleep(0.01)
+            if error is not None:
+                raise error
+            return SimpleNamespace(content=[SimpleNamespace(type="text", text=self.text)], stop_reason="end_turn",
+                                   usage=SimpleNamespace(input_tokens=100, output_tokens=50))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def make_scans(directory, count):
+    directory.mkdir()
+    for i in range(count):
+        Image.new("L", (64, 80), 255).save(directory / f"000001-{i + 1:04d}.tif")
+    return directory
+
+
+def run(tmp_path, client, pages=4, **kwargs):
+    return process_directory(make_scans(tmp_path / "in", pages), tmp_path / "out", "claude-3-7-sonnet-20250219",
+                             client=client, report_every=0, encode_workers=1, **kwargs)
+
+
+def test_limiter_halves_on_throttling_down_to_the_minimum():
+    limiter = AdaptiveLimiter(8, min_in_flight=2, base_delay=0.0)
+    for expected in (4, 2, 2):
+        limiter.acquire()
+        limiter.release(throttled=True, retry_after=0.001)
+        assert limiter.limit == expected
+    assert limiter.throttled == 3
+
+
+def test_limiter_waits_for_retry_after():
+    limiter = AdaptiveLimiter(4)
+    limiter.acquire()
+    limiter.release(throttled=True, retry_after=0.2)
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_limiter_recovers_one_slot_per_run_of_successes():
+    limiter = AdaptiveLimiter(4, base_delay=0.0)
+    limiter.acquire()
+    limiter.release(throttled=True, retry_after=0.001)
+    assert limiter.limit == 2
+    for _ in range(2 + 3):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 4  # 2 successes at limit 2, 3 at limit 3
+    for _ in range(10):
+        limiter.acquire()
+        limiter.release()
+    assert limiter.limit == 4  # Never past the configured maximum
+
+
+def test_limiter_bounds_in_flight_requests():
+    limiter = AdaptiveLimiter(3)
+    peak, current, lock = [0], [0], threading.Lock()
+
+    def work():
+        limiter.acquire()
+        with lock:
+            current[0] += 1
+            peak[0] = max(peak[0], current[0])
+        time.sleep(0.02)
+        with lock:
+            current[0] -= 1
+        limiter.release()
+
+    threads = [threading.Thread(target=work) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert peak[0] == 3
+
+
+def test_process_directory_transcribes_every_page(tmp_path):
+    client = ScriptedClient()
+    summary = run(tmp_path, client, pages=6, max_in_flight=3)
+    assert summary["processed"] == 6 and not summary["failed"]
+    assert client.calls == 6 and client.max_in_flight <= 3
+    assert json.loads((tmp_path / "out" / "000001-0001.json").read_text())["grantors"] == ["John Miller"]
+
+    # A rerun skips what is already written
+    rerun = process_directory(tmp_path / "in", tmp_path / "out", "claude-3-7-sonnet-20250219",
+                              client=client, report_every=0)
+    assert rerun["skipped"] == 6 and client.calls == 6
+
+
+def test_throttled_requests_are_retried(tmp_path):
+    client = ScriptedClient([Throttled(429, retry_after=0.01), Throttled(529, retry_after=0.01)])
+    summary = run(tmp_path, client, max_in_flight=4)
+    assert summary["processed"] == 4 and not summary["failed"]
+    assert summary["throttled"] == 2
+    assert client.calls == 6
+    assert summary["telemetry"]["events"]["retry"] == 2
+
+
+def test_pages_fail_once_max_retries_is_exhausted(tmp_path):
+    client = ScriptedClient([Throttled(429, retry_after=0.01)] * 3)
+    summary = run(tmp_path, client, pages=1, max_retries=2)
+    assert list(summary["failed"]) == ["000001-0001"]
+    assert client.calls == 3
+    assert not (tmp_path / "out" / "000001-0001.json").exists()
+
+
+def test_other_errors_are_not_retried(tmp_path):
+    client = ScriptedClient([ValueError("bad request")])
+    summary = run(tmp_path, client, pages=1)
+    assert summary["failed"] == {"000001-0001": "bad request"}
+    assert client.calls == 1
+
+
+def test_unparseable_responses_fail_the_page_and_are_retried_on_rerun(tmp_path):
+    client = ScriptedClient(text="I am unable to transcribe this page.")
+    cache_path = str(tmp_path / "cache.sqlite")
+    summary = run(tmp_path, client, pages=1, cache_path=cache_path)
+    assert list(summary["failed"]) == ["000001-0001"]
+    assert not (tmp_path / "out" / "000001-0001.json").exists()
+
+    client.text = json.dumps(RESPONSE)
+    rerun = process_directory(tmp_path / "in", tmp_path / "out", "claude-3-7-sonnet-20250219",
+                              client=client, report_every=0, cache_path=cache_path)
+    assert rerun["processed"] == 1 and not rerun["failed"]
+    assert client.calls == 2
+
+
+def test_ledger_retries_unparseable_pages_up_to_max_attempts(tmp_path):
+    # The text has no JSON, so no repair request is made either
+    client = ScriptedClient(text="Unreadable.")
+    ledger = JobLedger(str(tmp_path / "ledger.sqlite"), max_attempts=2)
+    summary = run(tmp_path, client, pages=1, ledger=ledger)
+    assert list(summary["failed"]) == ["000001-0001"]
+    assert ledger.counts()["pending"] == 1  # Back in the queue for the next run, no --resume needed
+
+    process_directory(tmp_path / "in", tmp_path / "out", "claude-3-7-sonnet-20250219",
+                      client=client, report_every=0, ledger=ledger)
+    assert client.calls == 2
+    assert ledger.counts()["failed"] == 1
+    assert ledger.failures() == [("000001-0001", "No JSON object found in response")]
+
+    # Only --resume brings a page back after max_attempts
+    client.text = json.dumps(RESPONSE)
+    summary = process_directory(tmp_path / "in", tmp_path / "out", "claude-3-7-sonnet-20250219",
+                                client=client, report_every=0, ledger=ledger, resume=True)
+    assert summary["processed"] == 1
+    assert ledger.counts()["done"] == 1
@@ -0,0 +1,33 @@
+from scripts.cache import ResponseCache, reparse
+
+GOOD = '{"document_text": "Know all men", "grantors": ["John Miller"]}'
+
+
+def test_failed_parses_are_kept_but_never_replayed(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    key = cache.make_key("aW1hZ2U=", "model", "prompt", 100)
+    cache.put(key, "I cannot read this page.", {"error": "No JSON object found", "raw_response": "..."},
+              file_id="000001-0001")
+    assert cache.get(key) is None
+    assert cache.stats()["entries"] == 1 and cache.stats()["misses"] == 1
+
+    cache.put(key, GOOD, {"document_text": "Know all men"}, file_id="000001-0001")
+    assert cache.get(key)["parsed"] == {"document_text": "Know all men"}
+    assert cache.stats()["hits"] == 1
+
+
+def test_packed_results_without_an_error_are_replayed(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    key = cache.make_key("aW1hZ2U=", "model", "prompt", 100)
+    cache.put(key, "{}", {"status": "ok", "data": {}, "missing": [], "error": None}, file_id="packed:a-b")
+    assert cache.get(key) is not None
+
+
+def test_reparse_writes_only_parseable_responses(tmp_path):
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    cache.put(cache.make_key("YQ==", "model", "prompt", 100), GOOD, {"error": "old parser"}, file_id="000001-0001")
+    cache.put(cache.make_key("Yg==", "model", "prompt", 100), "no json here", {"error": "x"}, file_id="000001-0002")
+    (tmp_path / "out").mkdir()
+    counts = reparse(cache, str(tmp_path / "out"))
+    assert counts == {"entries": 2, "failed": 1, "skipped": 0}
+    assert sorted(p.name for p in (tmp_path / "out").iterdir()) == ["000001-0001.json"]
@@ -0,0 +1,90 @@
+import json
+import os
+
+import pandas as pd
+
+from scripts.consolidate import consolidate, list_parts
+from scripts.documents import read_chunks
+
+
+def write_page(json_dir, document_id, grantor, execution_date="May 8, 1759"):
+    path = json_dir / f"{document_id}.json"
+    path.write_text(json.dumps({
+        "document_text": f"Know all men that I {grantor}",
+        "document_type": "Deed",
+        "grantors": [grantor],
+        "transaction_dates": {"execution_date": execution_date, "recording_date": ""},
+    }))
+    return path
+
+
+def read_table(parquet_dir):
+    return pd.concat(read_chunks(str(parquet_dir), 100)).set_index("Document ID")
+
+
+def test_only_new_and_changed_pages_are_read_and_written(tmp_path):
+    json_dir, parquet_dir, csv_path = tmp_path / "json", tmp_path / "deeds.parquet", tmp_path / "deeds.csv"
+    json_dir.mkdir()
+    for i, grantor in enumerate(["John Ely", "Caleb Ely", "Jno Bliss"]):
+        write_page(json_dir, f"000001-{i + 1:04d}", grantor)
+
+    def run(**kwargs):
+        return consolidate(str(json_dir), str(parquet_dir), str(csv_path), **kwargs)
+
+    assert run() == {"read": 3, "reused": 0, "removed": 0, "errors": 0}
+    assert list_parts(parquet_dir) == ["part-00000.parquet"]
+    assert read_table(parquet_dir).loc["000001-0001", "Execution Date ISO"] == "1759-05-08"
+    first_part = os.stat(parquet_dir / "part-00000.parquet").st_mtime_ns
+
+    # Unchanged, then touched but identical: nothing is read or written
+    assert run() == {"read": 0, "reused": 3, "removed": 0, "errors": 0}
+    os.utime(json_dir / "000001-0002.json", ns=(1, 1))
+    assert run() == {"read": 0, "reused": 3, "removed": 0, "errors": 0}
+    assert list_parts(parquet_dir) == ["part-00000.parquet"]
+
+    # A new page is written as a part of its own and appended to the CSV
+    write_page(json_dir, "000001-0004", "Saml Ely")
+    assert run()["read"] == 1
+    assert list_parts(parquet_dir) == ["part-00000.parquet", "part-00001.parquet"]
+    assert os.stat(parquet_dir / "part-00000.parquet").st_mtime_ns == first_part
+    assert len(pd.read_csv(csv_path, dtype=str)) == 4
+
+    # A changed page replaces its old row; a deleted page loses it
+    write_page(json_dir, "000001-0001", "John Ely", execution_date="3d day of May 1754")
+    os.remove(json_dir / "000001-0003.json")
+    assert run() == {"read": 1, "reused": 2, "removed": 1, "errors": 0}
+    table = read_table(parquet_dir)
+    assert sorted(table.index) == ["000001-0001", "000001-0002", "000001-0004"]
+    assert table.loc["000001-0001", "Execution Date ISO"] == "1754-05-03"
+    rows = pd.read_csv(csv_path, dtype=str).set_index("Document ID")
+    assert sorted(rows.index) == sorted(table.index)
+    assert rows.loc["000001-0001", "Execution Date ISO"] == "1754-05-03"
+
+
+def test_unreadable_pages_are_skipped_until_they_change(tmp_path):
+    json_dir, parquet_dir = tmp_path / "json", tmp_path / "deeds.parquet"
+    json_dir.mkdir()
+    write_page(json_dir, "000001-0001", "John Ely")
+    (json_dir / "000001-0002.json").write_text('{"error": "No JSON object found in response"}')
+    assert consolidate(str(json_dir), str(parquet_dir))["errors"] == 1
+    assert consolidate(str(json_dir), str(parquet_dir)) == {"read": 0, "reused": 1, "removed": 0, "errors": 0}
+    write_page(json_dir, "000001-0002", "Caleb Ely")
+    assert consolidate(str(json_dir), str(parquet_dir))["read"] == 1
+    assert len(read_table(parquet_dir)) == 2
+
+
+def test_a_full_run_or_a_stray_part_rebuilds_cleanly(tmp_path):
+    json_dir, parquet_dir = tmp_path / "json", tmp_path / "deeds.parquet"
+    json_dir.mkdir()
+    write_page(json_dir, "000001-0001", "John Ely")
+    consolidate(str(json_dir), str(parquet_dir))
+    write_page(json_dir, "000001-0002", "Caleb Ely")
+    consolidate(str(json_dir), str(parquet_dir))
+
+    # A part left by a run that stopped before saving its manifest is dropped
+    (parquet_dir / "part-00002.parquet").write_bytes((parquet_dir / "part-00001.parquet").read_bytes())
+    consolidate(str(json_dir), str(parquet_dir))
+    assert len(read_table(parquet_dir)) == 2
+
+    assert consolidate(str(json_dir), str(parquet_dir), full=True)["read"] == 2
+    assert list_parts(parquet_dir) == ["part-00000.parquet"]
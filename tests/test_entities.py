@@ -0,0 +1,54 @@
+import numpy as np
+
+from scripts.entities import assign_ids, jaro_winkler, person_name, resolve, same_person, soundex
+
+
+def clusters(names):
+    labels, _ = resolve(names)
+    groups = {}
+    for name, label in zip(names, labels.tolist()):
+        groups.setdefault(label, set()).add(name)
+    return sorted(groups.values(), key=min)
+
+
+def test_spelling_variants_merge():
+    assert clusters(["Zadock Knap", "Zadock Knapp", "Micah Lyman"]) == [{"Micah Lyman"}, {"Zadock Knap", "Zadock Knapp"}]
+
+
+def test_initial_does_not_bridge_different_given_names():
+    names = ["John Lyman", "J Lyman", "James Lyman", "Jonathan Lyman"]
+    assert not same_person("John Lyman", "James Lyman")
+    assert clusters(names) == [{"J Lyman"}, {"James Lyman"}, {"John Lyman"}, {"Jonathan Lyman"}]
+
+
+def test_initial_attaches_to_a_single_candidate():
+    assert clusters(["John Lyman", "Jno Lyman", "J Lyman", "Micah Lyman"]) == [
+        {"J Lyman", "Jno Lyman", "John Lyman"}, {"Micah Lyman"}]
+
+
+def test_initials_without_full_name_group_together():
+    assert clusters(["J Lyman", "J Lymann", "Micah Lyman"]) == [{"J Lyman", "J Lymann"}, {"Micah Lyman"}]
+
+
+def test_suffix_keeps_father_and_son_apart():
+    assert clusters(["John Smith", "John Smith Jr"]) == [{"John Smith"}, {"John Smith Jr"}]
+
+
+def test_ids_are_stable_across_rebuilds():
+    names = ["John Lyman", "Jno Lyman", "Micah Lyman"]
+    labels, _ = resolve(names)
+    first = assign_ids(names, labels, {})
+    previous = {name: first[int(label)] for name, label in zip(names, labels)}
+    # A new spelling joins an existing person and keeps its ID
+    grown = names + ["Micah Lymen"]
+    grown_labels, _ = resolve(grown)
+    second = assign_ids(grown, grown_labels, previous)
+    assert second[int(grown_labels[3])] == previous["Micah Lyman"]
+    assert second[int(grown_labels[0])] == previous["John Lyman"]
+
+
+def test_name_helpers():
+    assert person_name("John Ely of Springfield") == "John Ely"
+    assert person_name("his Heirs") is None
+    assert soundex("Robert") == soundex("Rupert") == "R163"
+    assert np.isclose(jaro_winkler("martha", "marhta"), 0.9611, atol=1e-4)
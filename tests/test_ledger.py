@@ -0,0 +1,115 @@
+import sqlite3
+import time
+
+import pytest
+
+from scripts.ledger import JobLedger, shard_of
+
+
+def make_pages(tmp_path, count=4):
+    pages = []
+    for i in range(count):
+        path = tmp_path / f"000001-{i + 1:04d}.tif"
+        path.touch()
+        pages.append(path)
+    return pages
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "ledger.sqlite")
+
+
+def test_pages_are_leased_once_and_only_from_their_shard(tmp_path, db_path):
+    pages = make_pages(tmp_path, 12)
+    shards = [JobLedger(db_path, shard, 3, owner=f"task{shard}") for shard in range(3)]
+    for ledger in shards:
+        ledger.register(pages)
+    assert shards[0].counts()["pending"] == 12
+
+    leased = [[file_id for file_id, _ in ledger.iter_leases(batch_size=2, steal=False)] for ledger in shards]
+    assert sorted(sum(leased, [])) == sorted(p.stem for p in pages)
+    for shard, file_ids in enumerate(leased):
+        assert all(shard_of(file_id, 3) == shard for file_id in file_ids)
+    assert shards[0].lease(steal=True) == []  # Every lease is live
+
+
+def test_register_marks_existing_output_done_and_is_idempotent(tmp_path, db_path):
+    pages = make_pages(tmp_path, 3)
+    ledger = JobLedger(db_path)
+    assert ledger.register(pages, done={"000001-0001"}) == 3
+    assert ledger.register(pages) == 0
+    assert ledger.counts() == {"pending": 2, "leased": 0, "done": 1, "failed": 0}
+
+
+def test_expired_lease_is_stolen_by_another_shard(tmp_path, db_path):
+    pages = make_pages(tmp_path, 6)
+    crashed = JobLedger(db_path, 0, 2, lease_seconds=0.05, owner="crashed")
+    crashed.register(pages)
+    stranded = [file_id for file_id, _ in crashed.iter_leases(steal=False)]
+    survivor = JobLedger(db_path, 1, 2, owner="survivor")
+    own = [file_id for file_id, _ in survivor.iter_leases(steal=False)]
+    assert survivor.lease(limit=10) == []  # Not yet expired
+
+    time.sleep(0.1)
+    stolen = [file_id for file_id, _ in survivor.lease(limit=10)]
+    assert sorted(stolen) == sorted(stranded)
+    for file_id in own + stolen:
+        assert survivor.complete(file_id)
+    assert survivor.counts()["done"] == 6
+
+
+def test_renewed_leases_do_not_expire(tmp_path, db_path):
+    worker = JobLedger(db_path, 0, 1, lease_seconds=0.1, owner="worker")
+    worker.register(make_pages(tmp_path, 2))
+    worker.lease(limit=2)
+    for _ in range(3):
+        time.sleep(0.05)
+        assert worker.renew() == 2
+    assert JobLedger(db_path, 0, 1, owner="other").lease(limit=2) == []
+
+
+def test_pages_fail_after_max_attempts_and_resume_resets_them(tmp_path, db_path):
+    ledger = JobLedger(db_path, 0, 1, lease_seconds=0.01, max_attempts=2)
+    ledger.register(make_pages(tmp_path, 1))
+    for _ in range(2):
+        assert len(ledger.lease()) == 1
+        time.sleep(0.03)
+    assert ledger.lease() == []
+    assert ledger.failures() == [("000001-0001", "lease expired 2 times")]
+
+    assert ledger.resume() == 1
+    assert ledger.counts()["pending"] == 1
+    assert len(ledger.lease()) == 1
+
+
+def test_complete_after_the_lease_was_stolen_is_refused(tmp_path, db_path):
+    slow = JobLedger(db_path, 0, 1, lease_seconds=0.05, owner="slow")
+    slow.register(make_pages(tmp_path, 1))
+    [(file_id, _)] = slow.lease()
+    time.sleep(0.1)
+    thief = JobLedger(db_path, 0, 1, owner="thief")
+    assert [leased for leased, _ in thief.lease()] == [file_id]
+
+    assert slow.complete(file_id) is False
+    assert slow.fail(file_id, "late error") is False
+    assert thief.counts()["leased"] == 1
+    assert thief.complete(file_id) is True
+    assert thief.counts()["done"] == 1
+
+
+def test_heartbeat_survives_a_locked_ledger(tmp_path, db_path, capsys):
+    ledger = JobLedger(db_path, 0, 1, lease_seconds=0.3, owner="worker", timeout=0.01)
+    ledger.register(make_pages(tmp_path, 1))
+    ledger.lease()
+    blocker = sqlite3.connect(db_path, isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    ledger.start_heartbeat(interval=0.02)
+    time.sleep(0.1)
+    blocker.execute("ROLLBACK")
+    time.sleep(0.1)
+    ledger.stop_heartbeat()
+
+    assert "Could not renew the leases of worker" in capsys.readouterr().out
+    expires = ledger._conn().execute("SELECT lease_expires FROM pages").fetchone()[0]
+    assert expires > time.time() + 0.1  # Renewed again once the lock was released
@@ -0,0 +1,9 @@
+from scripts.mapIndex import item_document_id
+
+
+def test_failed_item_without_id_is_named_from_its_source():
+    assert item_document_id({"_id": "000001-0001", "status": 201}) == "000001-0001"
+    item = {"error": "ConnectionTimeout", "status": "N/A", "data": {"document_id": "000001-0002"}}
+    assert item_document_id(item) == "000001-0002"
+    assert item_document_id({"error": "ConnectionTimeout"}) is None
+
@@ -0,0 +1,87 @@
+import json
+from types import SimpleNamespace
+
+from PIL import Image
+
+from scripts.message_batches import collect, load_manifest, poll, submit_book
+
+RESPONSE = {
+    "document_text": "Know all men by these presents",
+    "document_type": "Deed",
+    "grantors": ["John Miller"],
+    "grantees": ["Jedidiah Bliss"],
+}
+
+
+class FakeBatches:
+    """client.messages.batches: every batch ends on the second retrieve, with the scripted result per page."""
+
+    def __init__(self, outcomes):
+        # custom_id -> "succeeded", "unparseable" or an error result type such as "expired"
+        self.outcomes = outcomes
+        self.requests = {}
+        self.retrieved = {}
+
+    def create(self, requests):
+        batch_id = f"msgbatch_{len(self.requests) + 1}"
+        self.requests[batch_id] = requests
+        return SimpleNamespace(id=batch_id, processing_status="in_progress")
+
+    def retrieve(self, batch_id):
+        self.retrieved[batch_id] = self.retrieved.get(batch_id, 0) + 1
+        return SimpleNamespace(processing_status="ended" if self.retrieved[batch_id] > 1 else "in_progress")
+
+    def results(self, batch_id):
+        for request in self.requests[batch_id]:
+            outcome = self.outcomes.get(request["custom_id"], "succeeded")
+            if outcome in ("succeeded", "unparseable"):
+                text = json.dumps(RESPONSE) if outcome == "succeeded" else "I cannot read this page."
+                message = SimpleNamespace(content=[SimpleNamespace(type="text", text=text)], stop_reason="end_turn")
+                result = SimpleNamespace(type="succeeded", message=message)
+            else:
+                result = SimpleNamespace(type=outcome)
+            yield SimpleNamespace(custom_id=request["custom_id"], result=result)
+
+
+def make_client(outcomes):
+    return SimpleNamespace(messages=SimpleNamespace(batches=FakeBatches(outcomes)))
+
+
+def make_scans(directory, count):
+    directory.mkdir()
+    for i in range(count):
+        Image.new("L", (64, 80), 255).save(directory / f"000001-{i + 1:04d}.tif")
+    return directory
+
+
+def test_submit_poll_collect_and_resubmit_failed_pages(tmp_path):
+    input_dir, output_dir = make_scans(tmp_path / "in", 4), tmp_path / "out"
+    manifest_path = tmp_path / "manifest.json"
+    client = make_client({"000001-0002": "expired", "000001-0003": "unparseable"})
+
+    created = submit_book(input_dir, output_dir, manifest_path, "claude-3-7-sonnet-20250219",
+                          client=client, max_batch_requests=3)
+    assert created == ["msgbatch_1", "msgbatch_2"]
+    assert [len(r) for r in client.messages.batches.requests.values()] == [3, 1]
+
+    assert not poll(manifest_path, client=client)
+    assert poll(manifest_path, client=client)
+
+    counts = collect(manifest_path, output_dir, client=client)
+    assert counts == {"stored": 2, "failed": 2}
+    assert sorted(p.name for p in output_dir.iterdir()) == ["000001-0001.json", "000001-0004.json"]
+    failed = load_manifest(manifest_path)["batches"][0]["failed"]
+    assert failed["000001-0002"] == "expired"
+    assert failed["000001-0003"] == "No JSON object found in response"
+
+    # Collecting again is a no-op; submitting again sends only the two failed pages
+    assert collect(manifest_path, output_dir, client=client) == {"stored": 0, "failed": 0}
+    client.messages.batches.outcomes = {}
+    assert submit_book(input_dir, output_dir, manifest_path, "claude-3-7-sonnet-20250219",
+                       client=client) == ["msgbatch_3"]
+    assert sorted(r["custom_id"] for r in client.messages.batches.requests["msgbatch_3"]) == ["000001-0002", "000001-0003"]
+    poll(manifest_path, client=client)
+    poll(manifest_path, client=client)
+    assert collect(manifest_path, output_dir, client=client) == {"stored": 2, "failed": 0}
+    assert len(list(output_dir.iterdir())) == 4
+    assert submit_book(input_dir, output_dir, manifest_path, "claude-3-7-sonnet-20250219", client=client) == []
@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from scripts.normalize import normalize_dates, parse_date
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("May 8, 1759", "1759-05-08"),
+    ("3d day of May 1754", "1754-05-03"),
+    ("the twenty third of Feby 1758/9", "1759-02-23"),  # Old Style dual year gives the New Style year
+    ("7ber 5th 1760", "1760-09-05"),
+    ("one thousand seven hundred and fifty four May 3", "1754-05-03"),
+    ("the fifth day of June in the first year of His Majestys Reign George the Third", "1761-06-05"),
+    # Neither the regnal ordinal nor the sovereign's number is the day
+    ("the 2d year of his Majestys reign George the third, fifth day of June 1762", "1762-06-05"),
+    ("the thirty second year of His Majestys reign George the Second, 3d day of May", "1759-05-03"),
+    ("May 1754", "1754-05-01"),
+    ("March 3, 1650", "1650-03-03"),
+    ("1650-03-03", "1650-03-03"),
+])
+def test_parse_date(text, expected):
+    assert parse_date(text) == expected
+
+
+@pytest.mark.parametrize("text", ["Not specified", "", None, "1759", "1650-02-30"])
+def test_unreadable_dates_are_none(text):
+    assert parse_date(text) is None
+
+
+def test_dates_before_1677_survive():
+    # pandas Timestamps stop at 1677-09-21; the registry starts well before that
+    dates = normalize_dates(pd.Series(["1650-03-03", None, "June 5, 1761"]))
+    assert dates.tolist() == ["1650-03-03", None, "1761-06-05"]
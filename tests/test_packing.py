@@ -0,0 +1,103 @@
+import json
+from types import SimpleNamespace
+
+from PIL import Image
+
+from scripts.extract import SYSTEM_PROMPT
+from scripts.packing import MIN_CACHEABLE_TOKENS, build_packed_request, merge_continued, process_packed, split_packed_response
+
+
+class Throttled(Exception):
+    # Shaped like anthropic.APIStatusError: a status code and a response carrying headers
+
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers={"retry-after": "0.01"})
+
+
+class WindowClient:
+    """Raises the scripted errors first, then answers each window with one deed running across all its pages."""
+
+    def __init__(self, errors=()):
+        self.errors = list(errors)
+        self.calls = 0
+        self.messages = self
+
+    def create(self, **request):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        file_ids = [block["text"][len("Page "):-1] for block in request["messages"][0]["content"]
+                    if block["type"] == "text" and block["text"].startswith("Page ")]
+        data = {
+            "pages": [{"file_id": file_id, "document_text": f"text of {file_id}"} for file_id in file_ids],
+            "documents": [{"pages": file_ids, "continues_from_previous": file_ids[0] != "000001-0001",
+                           "continues_on_next": True, "document_text": file_ids[0], "grantors": ["John Ely"]}],
+        }
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=json.dumps(data))], stop_reason="end_turn",
+                               usage=SimpleNamespace(input_tokens=1000, output_tokens=200))
+
+
+def make_scans(directory, pages):
+    directory.mkdir()
+    for page in pages:
+        Image.new("L", (64, 80), 255).save(directory / f"000001-{page:04d}.tif")
+    return directory
+
+
+def test_cached_prefix_is_long_enough_to_cache():
+    request = build_packed_request("claude-3-7-sonnet-20250219", [])
+    block = request["system"][-1]
+    assert block["cache_control"] == {"type": "ephemeral"}
+    assert block["text"].startswith(SYSTEM_PROMPT)
+    # English prose runs about four characters per token; keep a margin over the minimum
+    assert len(block["text"]) / 4 > MIN_CACHEABLE_TOKENS * 1.25
+
+
+def test_documents_cut_at_a_window_boundary_merge():
+    first, first_docs = split_packed_response({
+        "pages": [{"file_id": "000001-0001", "document_text": "Know all men"}],
+        "documents": [{"pages": ["000001-0001"], "continues_on_next": True, "grantors": ["John Ely"]}],
+    }, ["000001-0001"])
+    _, second_docs = split_packed_response({
+        "pages": [{"file_id": "000001-0002", "document_text": "Recorded"}],
+        "documents": [{"pages": ["000001-0002"], "continues_from_previous": True, "grantees": ["Caleb Ely"]}],
+    }, ["000001-0002"])
+    assert first["000001-0001"]["document_text"] == "Know all men"
+    merged = merge_continued(first_docs + second_docs)
+    assert len(merged) == 1
+    assert merged[0]["pages"] == ["000001-0001", "000001-0002"]
+    assert (merged[0]["grantors"], merged[0]["grantees"]) == (["John Ely"], ["Caleb Ely"])
+
+
+def test_documents_on_non_adjacent_pages_do_not_merge():
+    documents = [
+        {"pages": ["000001-0001"], "continues_on_next": True, "document_text": "a"},
+        {"pages": ["000001-0003"], "continues_from_previous": True, "document_text": "b"},
+        {"pages": ["000001-0003"], "continues_on_next": True, "document_text": "c"},
+        {"pages": ["000002-0004"], "continues_from_previous": True, "document_text": "d"},
+    ]
+    assert [d["document_text"] for d in merge_continued(documents)] == ["a", "b", "c", "d"]
+
+
+def test_process_packed_retries_throttled_windows_and_merges_documents(tmp_path):
+    client = WindowClient(errors=[Throttled(429), Throttled(529)])
+    stats = process_packed(make_scans(tmp_path / "in", [1, 2, 3, 4, 5]), tmp_path / "out",
+                           "claude-3-7-sonnet-20250219", window=2, client=client)
+    assert client.calls == 5  # 3 windows, 2 of them retried once
+    assert stats["throttled"] == 2 and stats["telemetry"]["events"]["retry"] == 2
+    assert stats["pages"] == 5 and not stats["failed"]
+    documents = list((tmp_path / "out" / "documents").iterdir())
+    assert [p.name for p in documents] == ["000001-0001.json"]  # No temp files left behind
+    assert json.loads(documents[0].read_text())["pages"] == [f"000001-{i:04d}" for i in range(1, 6)]
+
+
+def test_process_packed_gives_up_on_a_window_after_max_retries(tmp_path):
+    client = WindowClient(errors=[Throttled(429)] * 2)
+    stats = process_packed(make_scans(tmp_path / "in", [1, 2, 4]), tmp_path / "out",
+                           "claude-3-7-sonnet-20250219", window=2, client=client, max_retries=1)
+    assert stats["failed"] == {"000001-0001-000001-0002": "status 429"}
+    assert stats["pages"] == 1
+    # The window after the failed one is not adjacent to anything written, so it stands alone
+    assert [p.name for p in (tmp_path / "out" / "documents").iterdir()] == ["000001-0004.json"]
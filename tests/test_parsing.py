@@ -0,0 +1,69 @@
+import json
+
+from scripts.parsing import ParseStats, parse_response
+
+FULL = {
+    "document_text": "Know all men by these presents",
+    "document_type": "Deed",
+    "grantors": ["John Miller"],
+    "grantees": ["Jedidiah Bliss"],
+    "legal_authorities": [],
+    "property_description": {"acreage": "10 acres", "boundaries": [], "lot_info": ""},
+    "geographical_references": {"city": "Springfield", "county": "Hampshire"},
+    "transaction_dates": {"execution_date": "March 29, 1757", "recording_date": ""},
+}
+
+
+def test_fenced_object_parses_ok():
+    for fence in ("```json", "```JSON", "```"):
+        result = parse_response(f"{fence}\n{json.dumps(FULL)}\n```")
+        assert result["status"] == "ok"
+        assert result["data"]["grantors"] == ["John Miller"]
+
+
+def test_prose_and_trailing_comma_are_recovered():
+    text = "Here is the extracted information:\n```json\n" + json.dumps(FULL)[:-1] + ",}\n```\nLet me know."
+    result = parse_response(text)
+    assert result["status"] == "recovered"
+    assert result["data"]["document_type"] == "Deed"
+
+
+def test_bare_object_without_fence():
+    assert parse_response("The result is " + json.dumps(FULL) + " as requested.")["status"] == "ok"
+
+
+def test_truncated_output_keeps_the_complete_prefix():
+    text = "```json\n" + json.dumps(FULL)[:60]
+    result = parse_response(text, truncated=True)
+    assert result["status"] == "recovered"
+    assert result["data"]["document_text"] == FULL["document_text"]
+    assert result["data"]["grantors"] == []  # Filled in by validation
+
+
+def test_missing_fields_are_filled_and_reported():
+    result = parse_response(json.dumps({"document_text": "a"}))
+    assert result["status"] == "recovered"
+    assert "grantors" in result["missing"]
+    assert result["data"]["property_description"] == {"acreage": "", "boundaries": [], "lot_info": ""}
+
+
+def test_failures():
+    assert parse_response("I cannot read this page.")["status"] == "failed"
+    assert parse_response(json.dumps({"grantors": []}))["error"] == "Missing document_text"
+    assert parse_response(None)["status"] == "failed"
+
+
+def test_outcomes_are_counted_in_the_given_stats():
+    stats = ParseStats()
+    parse_response(json.dumps(FULL), stats=stats)
+    parse_response("nothing", stats=stats)
+    parse_response(json.dumps(FULL), stats=None)
+    snapshot = stats.snapshot()
+    assert (snapshot["ok"], snapshot["failed"], snapshot["parse_failure_rate"]) == (1, 1, 0.5)
+
+
+def test_packed_shapes_skip_field_validation():
+    packed = {"pages": [{"file_id": "000001-0001", "document_text": "a"}], "documents": []}
+    result = parse_response(json.dumps(packed), validate_fields=False)
+    assert result["status"] == "ok"
+    assert result["data"] == packed
@@ -0,0 +1,26 @@
+from scripts.search import build_query, search_page
+
+
+class FakeElasticsearch:
+    """Answers client.search from a fixed, already sorted list of hits, honouring size and search_after."""
+
+    def __init__(self, count):
+        self.hits = [{"_id": f"000001-{i:04d}", "_source": {}, "sort": [1.0, f"000001-{i:04d}"]}
+                     for i in range(1, count + 1)]
+
+    def search(self, index, body, size):
+        start = 0
+        if "search_after" in body:
+            start = next(i for i, hit in enumerate(self.hits) if hit["sort"] == body["search_after"]) + 1
+        return {"hits": {"hits": self.hits[start:start + size], "total": {"value": len(self.hits)}}}
+
+
+def test_an_exactly_full_last_page_has_no_next_cursor():
+    client = FakeElasticsearch(4)
+    query_body = build_query("Springfield", "Full Text", None, None, "Match")
+    first = search_page(client, "land_deeds", query_body, page_size=2)
+    assert [hit["_id"] for hit in first["hits"]] == ["000001-0001", "000001-0002"]
+    assert first["next"] == [1.0, "000001-0002"]
+    second = search_page(client, "land_deeds", query_body, page_size=2, search_after=first["next"])
+    assert [hit["_id"] for hit in second["hits"]] == ["000001-0003", "000001-0004"]
+    assert second["next"] is None
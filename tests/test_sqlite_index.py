@@ -0,0 +1,58 @@
+import csv
+
+import pytest
+
+from scripts.search import build_query
+from scripts.sqlite_index import SQLiteBackend, build_index
+
+COLUMNS = ["Document ID", "Document Text", "Document Type", "Grantors", "Grantees", "Legal Authorities",
+           "Acreage", "Boundaries", "Lot Info", "City", "County", "Province/Colony", "Execution Date",
+           "Recording Date", "Deeds Standardized"]
+TEXTS = {
+    "000001-0001": "John Smith of Springfield conveys a meadow",
+    "000001-0002": "land by the hill near Westfield",
+    "000001-0003": "Peter Land of Hadley",
+    "000001-0004": "bounded by Connecticut river",
+}
+
+
+@pytest.fixture(scope="module")
+def backend(tmp_path_factory):
+    root = tmp_path_factory.mktemp("index")
+    with open(root / "deeds.csv", "w", newline="", encoding="utf-8") as table:
+        writer = csv.DictWriter(table, COLUMNS)
+        writer.writeheader()
+        for doc_id, text in TEXTS.items():
+            writer.writerow({"Document ID": doc_id, "Document Text": text, "Document Type": "Deed"})
+    build_index(str(root / "deeds.csv"), str(root / "deeds.sqlite"))
+    return SQLiteBackend(str(root / "deeds.sqlite"))
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("smyth", "smith"),  # Substitution with no trigram in common
+    ("hull", "hill"),
+    ("lund", "land"),
+    ("smtih", "smith"),  # Transposition
+    ("spingfield", "springfield"),
+])
+def test_expand_fuzzy_finds_one_edit_variants(backend, query, expected):
+    assert expected in backend.expand_fuzzy(query)
+
+
+def test_expand_fuzzy_keeps_to_the_edit_distance(backend):
+    assert "hadley" not in backend.expand_fuzzy("hull")
+    assert backend.expand_fuzzy("xq") == ["xq"]
+
+
+def test_fuzzy_search_returns_matching_documents(backend):
+    response = backend.search_page(build_query("Smyth", "Full Text", None, None, "Fuzzy Match"))
+    assert [hit["_id"] for hit in response["hits"]] == ["000001-0001"]
+
+
+def test_an_exactly_full_last_page_has_no_next_cursor(backend):
+    query_body = build_query("Deed", "Document Type", None, None, "Match")
+    first = backend.search_page(query_body, page_size=2)
+    assert first["total"] == 4 and len(first["hits"]) == 2 and first["next"] is not None
+    second = backend.search_page(query_body, page_size=2, search_after=first["next"])
+    assert len(second["hits"]) == 2 and second["next"] is None
+    assert {hit["_id"] for hit in first["hits"] + second["hits"]} == set(TEXTS)
@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from scripts.telemetry import SPANS_FILE, SUMMARY_FILE, Telemetry, estimate_cost, load_run, report
+
+MODEL = "claude-3-7-sonnet-20250219"
+
+
+def write_run(run_dir):
+    telemetry = Telemetry(str(run_dir))
+    telemetry.record_span("encode", 0.5, page="000001-0001", payload_bytes=1000)
+    telemetry.record_span("encode", 1.5, page="000001-0002", payload_bytes=1000)
+    # A throttled attempt, then the retry that succeeded
+    with pytest.raises(RuntimeError):
+        with telemetry.span("request", page="000001-0001", model=MODEL):
+            raise RuntimeError("status 429")
+    telemetry.event("retry", page="000001-0001", attempt=1)
+    telemetry.record_span("request", 2.0, page="000001-0001", input_tokens=1000, output_tokens=200, cost_usd=0.006)
+    telemetry.record_span("page", 2.5, page="000001-0001")
+    telemetry.event("cache_hit", page="000001-0002")
+    telemetry.record_span("page", 0.1, page="000001-0002")
+    return telemetry
+
+
+def test_summary_counts_error_spans_as_events_not_timings(tmp_path):
+    summary = write_run(tmp_path).close()
+    assert summary["pages"] == 2
+    assert summary["spans"]["request"]["count"] == 1
+    assert summary["spans"]["request"]["total_seconds"] == 2.0
+    assert summary["spans"]["encode"] == {"count": 2, "total_seconds": 2.0, "p50_seconds": 1.5, "p95_seconds": 1.5}
+    assert summary["events"] == {"request_error": 1, "retry": 1, "cache_hit": 1}
+    assert summary["tokens"]["input_tokens"] == 1000 and summary["tokens"]["output_tokens"] == 200
+    assert summary["estimated_cost_usd"] == pytest.approx(0.006)
+    assert summary["elapsed_seconds"] > 0
+
+    errors = [json.loads(line) for line in (tmp_path / SPANS_FILE).read_text().splitlines()
+              if json.loads(line).get("error")]
+    assert len(errors) == 1 and errors[0]["error"] == "RuntimeError('status 429')"
+    assert json.loads((tmp_path / SUMMARY_FILE).read_text()) == summary
+
+
+def test_prometheus_text(tmp_path):
+    lines = write_run(tmp_path).prometheus().splitlines()
+    assert "deeds_pages_total 2" in lines
+    assert 'deeds_span_seconds{span="encode",quantile="0.5"} 1.5' in lines
+    assert 'deeds_span_seconds_count{span="request"} 1' in lines
+    assert 'deeds_events_total{event="request_error"} 1' in lines
+    assert 'deeds_tokens_total{type="input_tokens"} 1000' in lines
+    # Every sample line belongs to a declared metric family
+    families = {line.split()[2] for line in lines if line.startswith("# TYPE")}
+    for line in lines:
+        if not line.startswith("#"):
+            name = line.split("{")[0].split()[0]
+            assert any(name == family or name.startswith(family + "_") for family in families), line
+
+
+def test_load_run_and_report_round_trip(tmp_path):
+    summary = write_run(tmp_path).close()
+    assert load_run(str(tmp_path)).summary() == summary
+    text = report(str(tmp_path))
+    assert text.startswith("2 pages in ")
+    assert "request_error 1" in text and "retry 1" in text
+    assert "input_tokens 1000" in text
+    assert "estimated cost: $0.01" in text
+
+
+def test_cost_is_only_estimated_for_known_models():
+    assert estimate_cost(MODEL, {"input_tokens": 1_000_000}) == pytest.approx(3.0)
+    assert estimate_cost("some-other-model", {"input_tokens": 1_000_000}) is None
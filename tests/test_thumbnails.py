@@ -0,0 +1,40 @@
+import os
+
+from PIL import Image
+
+from scripts import thumbnails
+
+
+def make_scans(image_dir, count):
+    os.makedirs(image_dir)
+    for i in range(count):
+        Image.effect_noise((600, 800), 40 + i).save(os.path.join(image_dir, f"000001-{i + 1:04d}.TIF"))
+
+
+def cache_size(cache_dir):
+    return sum(entry.stat().st_size for size_name in os.listdir(cache_dir)
+               for entry in os.scandir(os.path.join(cache_dir, size_name)))
+
+
+def test_misses_only_list_the_cache_when_it_is_over_budget(tmp_path, monkeypatch):
+    image_dir, cache_dir = str(tmp_path / "scans"), str(tmp_path / "cache")
+    make_scans(image_dir, 8)
+    scans = []
+    evict = thumbnails.evict
+    monkeypatch.setattr(thumbnails, "evict", lambda *args: scans.append(args) or evict(*args))
+
+    first = thumbnails.get_derivative(image_dir, "000001-0001", "thumb", cache_dir, max_cache_bytes=10 ** 9)
+    assert first is not None
+    for i in range(2, 5):
+        thumbnails.get_derivative(image_dir, f"000001-{i:04d}", "thumb", cache_dir, max_cache_bytes=10 ** 9)
+    assert len(scans) == 1  # The first miss learns the size; the rest only add to it
+
+    budget = cache_size(cache_dir) + 1
+    for i in range(5, 9):
+        thumbnails.get_derivative(image_dir, f"000001-{i:04d}", "thumb", cache_dir, max_cache_bytes=budget)
+    assert len(scans) > 1
+    assert cache_size(cache_dir) <= budget
+    # A hit neither generates nor lists anything
+    before = len(scans)
+    assert thumbnails.get_derivative(image_dir, "000001-0008", "preview", cache_dir, max_cache_bytes=budget)
+    assert len(scans) == before
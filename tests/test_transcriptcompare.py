@@ -0,0 +1,49 @@
+import random
+
+import pytest
+
+from scripts.Transcriptcompare import error_rates, levenshtein
+
+
+def reference_levenshtein(a, b):
+    # Plain Wagner-Fischer dynamic programming
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        previous = current
+    return previous[-1]
+
+
+@pytest.mark.parametrize("a, b, expected", [
+    ("", "", 0),
+    ("abc", "", 3),
+    ("", "abc", 3),
+    ("kitten", "sitting", 3),
+    ("flaw", "lawn", 2),
+    ("Springfield", "Sprinfeild", 3),
+])
+def test_known_distances(a, b, expected):
+    assert levenshtein(a, b) == expected == levenshtein(b, a)
+
+
+def test_matches_dynamic_programming_on_random_strings():
+    rng = random.Random(0)
+    for _ in range(500):
+        # Lengths either side of 64 exercise multi-word big-integer bit vectors
+        a = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 90)))
+        b = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 90)))
+        assert levenshtein(a, b) == reference_levenshtein(a, b)
+
+
+def test_word_sequences():
+    a = "know all men by these presents".split()
+    b = "know ye all men by these present".split()
+    assert levenshtein(a, b) == reference_levenshtein(a, b) == 2
+
+
+def test_error_rates_normalise_archaic_forms():
+    rates = error_rates("the said land", "ye sd land")
+    assert rates["cer"] == 0.0
+    assert rates["wer"] == 0.0